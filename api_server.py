@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+Headless HTTP chat API for the AI Commerce Chatbot.
+
+Runs the same ChatEngine as the Streamlit app on a single asyncio event
+loop, so many sessions can wait on the model at once without a thread per
+request. Replies can be streamed as Server-Sent Events. Live sessions are
+kept in a pluggable SessionStore (session_store.py); saved conversations can
+be resumed on any server process that shares the conversation store.
+
+A session answers one message at a time. A new message, or deleting the
+session, cancels the turn still running: its model request is aborted and
+its client gets a 409 (an "error" event when streaming). Turns that run past
+LLM_TURN_TIMEOUT get a 504.
+
+Endpoints:
+    POST   /v1/sessions                       start a session ({"conversation_id": ...} resumes one)
+    GET    /v1/sessions/<id>                  transcript of a session
+    POST   /v1/sessions/<id>/messages         send {"content": ..., "stream": true|false}
+    DELETE /v1/sessions/<id>                  end a session (the saved conversation is kept)
+    GET    /v1/conversations                  saved conversations (?limit=&offset=&title_prefix=)
+    GET    /v1/conversations/search?q=...     search saved conversations
+    DELETE /v1/conversations/<id>             delete a saved conversation
+    GET    /healthz                           liveness check
+    GET    /metrics                           Prometheus metrics
+
+Usage:
+    python api_server.py --host 127.0.0.1 --port 8000
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+import weakref
+import argparse
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from dotenv import load_dotenv
+
+from cancellation import DELETED, SUPERSEDED, TurnCancelledError, TurnTimeoutError
+from chat_engine import create_engine
+from llm_admission import LLMUnavailableError
+from metrics import REGISTRY, TurnTrace, configure_metrics, stats_gauges
+from prefetch import start_prefetcher
+from session_store import create_session_store
+from streaming import StreamResult
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+
+
+class HTTPError(Exception):
+    """Error answered with an HTTP status and a JSON body"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_llm_error(cls, error):
+        """503 with Retry-After while the model is unavailable, 504 past the turn's deadline,
+        409 for a cancelled turn, 502 for other model errors"""
+        if isinstance(error, LLMUnavailableError):
+            return cls(HTTPStatus.SERVICE_UNAVAILABLE, str(error), retry_after=error.retry_after)
+        if isinstance(error, TurnTimeoutError):
+            return cls(HTTPStatus.GATEWAY_TIMEOUT, str(error))
+        if isinstance(error, TurnCancelledError):
+            return cls(HTTPStatus.CONFLICT, str(error))
+        return cls(HTTPStatus.BAD_GATEWAY, f"Error generating response: {error}")
+
+    def payload(self):
+        payload = {"error": self.message}
+        if self.retry_after is not None:
+            payload["retry_after"] = self.retry_after
+        return payload
+
+
+class Request:
+    """A parsed HTTP/1.1 request"""
+
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self):
+        """Decode the body as a JSON object ({} if empty)"""
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+        return data
+
+
+async def read_request(reader):
+    """Read one request from the connection, or return None when the client is done"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Too many headers")
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(HTTPStatus.NOT_IMPLEMENTED, "Chunked request bodies are not supported")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, version, headers, body)
+
+
+def _response_head(status, headers):
+    status = HTTPStatus(status)
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_response(writer, status, body, content_type="application/json", keep_alive=True, headers=None):
+    """Send a complete response"""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    headers = dict(headers or {}, **{
+        "Content-Type": content_type,
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+    })
+    writer.write(_response_head(status, headers) + body)
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, keep_alive=True, headers=None):
+    await send_response(writer, status, json.dumps(payload, ensure_ascii=False),
+                        keep_alive=keep_alive, headers=headers)
+
+
+async def send_error(writer, error, keep_alive=True):
+    """Answer with an HTTPError"""
+    headers = None
+    if error.retry_after is not None:
+        headers = {"Retry-After": str(max(1, round(error.retry_after)))}
+    await send_json(writer, error.status, error.payload(), keep_alive, headers)
+
+
+def sse_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class ChatAPI:
+    """Routes HTTP requests to the chat engine"""
+
+    ROUTES = [
+        ("POST", re.compile(r"^/v1/sessions/?$"), "create_session"),
+        ("GET", re.compile(r"^/v1/sessions/(?P<session_id>[^/]+)$"), "get_session"),
+        ("DELETE", re.compile(r"^/v1/sessions/(?P<session_id>[^/]+)$"), "delete_session"),
+        ("POST", re.compile(r"^/v1/sessions/(?P<session_id>[^/]+)/messages$"), "send_message"),
+        ("GET", re.compile(r"^/v1/conversations/?$"), "list_conversations"),
+        ("GET", re.compile(r"^/v1/conversations/search$"), "search_conversations"),
+        ("DELETE", re.compile(r"^/v1/conversations/(?P<conversation_id>[^/]+)$"), "delete_conversation"),
+        ("GET", re.compile(r"^/healthz$"), "health"),
+        ("GET", re.compile(r"^/metrics$"), "metrics"),
+    ]
+
+    def __init__(self, engine, sessions, auto_save=True):
+        self.engine = engine
+        self.sessions = sessions
+        self.auto_save = auto_save
+        # session id -> asyncio.Lock serializing its turns; dropped once no request holds it
+        self._session_locks = weakref.WeakValueDictionary()
+        self.active_requests = 0
+        if hasattr(sessions, "stats"):
+            REGISTRY.add_collector(lambda: stats_gauges("api", dict(sessions.stats(),
+                                                                    active_requests=self.active_requests)))
+
+    # Connection handling
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await send_error(writer, e, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                if not await self.dispatch(request, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def dispatch(self, request, writer):
+        """Answer one request; returns False if the connection should be closed"""
+        self.active_requests += 1
+        try:
+            allowed = False
+            for method, pattern, handler_name in self.ROUTES:
+                match = pattern.match(request.path)
+                if not match:
+                    continue
+                allowed = True
+                if method == request.method:
+                    handler = getattr(self, handler_name)
+                    # Ids are percent-encoded in the path: JSON store ids contain the raw title
+                    return await handler(request, writer, **{name: unquote(value)
+                                                             for name, value in match.groupdict().items()})
+            if allowed:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{request.method} not allowed on {request.path}")
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown path {request.path}")
+        except HTTPError as e:
+            await send_error(writer, e, request.keep_alive)
+            return request.keep_alive
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            logger.exception("Error handling %s %s", request.method, request.path)
+            await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}, keep_alive=False)
+            return False
+        finally:
+            self.active_requests -= 1
+
+    # Sessions
+
+    async def _get_session(self, session_id):
+        """Find a live session, or resume the saved conversation with that id under the same id"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            # Kept under the requested id, so the next request finds this session
+            session = await asyncio.to_thread(self.engine.open_session, session_id, session_id)
+            if session is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session {session_id}")
+            session.auto_save = self.auto_save
+            self.sessions.put(session)
+        return session
+
+    def _session_lock(self, session_id):
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._session_locks[session_id] = lock
+        return lock
+
+    async def create_session(self, request, writer):
+        data = request.json()
+        conversation_id = data.get("conversation_id")
+        if conversation_id:
+            session = await asyncio.to_thread(self.engine.open_session, conversation_id)
+            if session is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown conversation {conversation_id}")
+        else:
+            session = await asyncio.to_thread(self.engine.new_session)
+        session.auto_save = self.auto_save
+        self.sessions.put(session)
+        await send_json(writer, HTTPStatus.CREATED, session.to_dict(), request.keep_alive)
+        return request.keep_alive
+
+    async def get_session(self, request, writer, session_id):
+        session = await self._get_session(session_id)
+        await send_json(writer, HTTPStatus.OK, session.to_dict(), request.keep_alive)
+        return request.keep_alive
+
+    async def delete_session(self, request, writer, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.cancel_turn(DELETED)
+        async with self._session_lock(session_id):
+            if session is not None and self.auto_save and session.unsaved and len(session.messages) > 1:
+                await asyncio.to_thread(self.engine.save, session)
+            self.sessions.delete(session_id)
+        await send_json(writer, HTTPStatus.OK, {"deleted": session_id}, request.keep_alive)
+        return request.keep_alive
+
+    async def send_message(self, request, writer, session_id):
+        data = request.json()
+        content = data.get("content")
+        if not isinstance(content, str) or not content.strip():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'content' must be a non-empty string")
+        stream = data.get("stream", True)
+
+        # The newest message wins: stop the session's running turn instead of queueing behind it
+        running = self.sessions.get(session_id)
+        if running is not None:
+            running.cancel_turn(SUPERSEDED)
+        async with self._session_lock(session_id):
+            session = await self._get_session(session_id)
+            session.add_user_message(content)
+            trace = TurnTrace(session_id=session.session_id, conversation_id=session.conversation_id)
+            trace.turn = True
+            result = StreamResult()
+            try:
+                if stream:
+                    return await self._stream_reply(writer, session, result, trace)
+                try:
+                    async for _ in self.engine.astream_response(session, result, trace=trace):
+                        pass
+                except Exception as e:
+                    self._discard_unanswered(session)
+                    trace.set("error", str(e))
+                    raise HTTPError.from_llm_error(e)
+                await self._save(session, trace)
+            except (ConnectionError, asyncio.CancelledError):
+                self._discard_unanswered(session)
+                raise
+            finally:
+                trace.conversation_id = session.conversation_id
+                trace.finish()
+
+        await send_json(writer, HTTPStatus.OK, self._reply_payload(session, result), request.keep_alive)
+        return request.keep_alive
+
+    async def _stream_reply(self, writer, session, result, trace):
+        """Send the reply as Server-Sent Events: token..., then done (or error)"""
+        writer.write(_response_head(HTTPStatus.OK, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "Connection": "close",
+        }))
+        replies = self.engine.astream_response(session, result, trace=trace)
+        try:
+            async for token in replies:
+                writer.write(sse_event("token", {"text": token}))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            await replies.aclose()
+            raise
+        except Exception as e:
+            # Failed before any token: the transcript is unchanged apart from the question
+            self._discard_unanswered(session)
+            trace.set("error", str(e))
+            writer.write(sse_event("error", HTTPError.from_llm_error(e).payload()))
+            await writer.drain()
+            return False
+        await self._save(session, trace)
+        if result.interrupted:
+            writer.write(sse_event("error", {"error": f"Response stream interrupted: {result.error}"}))
+        writer.write(sse_event("done", self._reply_payload(session, result)))
+        await writer.drain()
+        return False
+
+    def _discard_unanswered(self, session):
+        """Drop the user message of a failed turn so the client can simply retry"""
+        if session.pending_input is not None:
+            session.messages.pop()
+
+    async def _save(self, session, trace):
+        if not self.auto_save:
+            return
+        try:
+            with trace.span("save"):
+                await asyncio.to_thread(self.engine.save, session)
+        except Exception:
+            logger.exception("Error saving session %s", session.session_id)
+
+    def _reply_payload(self, session, result):
+        return {
+            "session_id": session.session_id,
+            "conversation_id": session.conversation_id,
+            "content": result.display_text,
+            "source": result.source,
+            "interrupted": result.interrupted,
+            "time_to_first_token": result.time_to_first_token,
+            "total_time": result.total_time,
+        }
+
+    # Saved conversations
+
+    async def list_conversations(self, request, writer):
+        try:
+            limit = int(request.query.get("limit", "20"))
+            offset = int(request.query.get("offset", "0"))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "limit and offset must be integers")
+        title_prefix = request.query.get("title_prefix")
+        store = self.engine.store
+        conversations, total = await asyncio.gather(
+            asyncio.to_thread(store.list_conversations, limit=limit, offset=offset, title_prefix=title_prefix),
+            asyncio.to_thread(store.count_conversations, title_prefix=title_prefix),
+        )
+        await send_json(writer, HTTPStatus.OK, {"conversations": conversations, "total": total}, request.keep_alive)
+        return request.keep_alive
+
+    async def search_conversations(self, request, writer):
+        query = request.query.get("q", "")
+        results = await asyncio.to_thread(self.engine.store.search_conversations, query, limit=20) if query else []
+        await send_json(writer, HTTPStatus.OK, {"conversations": results}, request.keep_alive)
+        return request.keep_alive
+
+    async def delete_conversation(self, request, writer, conversation_id):
+        # End the sessions continuing it first, so none of them saves it again
+        sessions = self.sessions.find(conversation_id)
+        for session in sessions.values():
+            if session is not None:
+                session.cancel_turn(DELETED)
+        for session_id in sessions:
+            async with self._session_lock(session_id):
+                self.sessions.delete(session_id)
+        try:
+            await asyncio.to_thread(self.engine.delete_conversation, conversation_id)
+        except FileNotFoundError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown conversation {conversation_id}")
+        await send_json(writer, HTTPStatus.OK, {"deleted": conversation_id}, request.keep_alive)
+        return request.keep_alive
+
+    # Operations
+
+    async def health(self, request, writer):
+        await send_json(writer, HTTPStatus.OK, {"status": "ok"}, request.keep_alive)
+        return request.keep_alive
+
+    async def metrics(self, request, writer):
+        await send_response(writer, HTTPStatus.OK, REGISTRY.render(),
+                            content_type="text/plain; version=0.0.4; charset=utf-8",
+                            keep_alive=request.keep_alive)
+        return request.keep_alive
+
+
+async def serve(host, port, api):
+    """Run the API until cancelled"""
+    server = await asyncio.start_server(api.handle_connection, host, port)
+    addresses = ", ".join(str(sock.getsockname()[:2]) for sock in server.sockets)
+    logger.info("Chat API listening on %s", addresses)
+    print(f"🛒 Chat API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Run the API server in the foreground"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="HTTP chat API for the AI Commerce Chatbot")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--no-auto-save", action="store_true", help="Do not save conversations after each turn")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    api_key = os.getenv("TOGETHER_API_KEY")
+    if not api_key:
+        parser.error("TOGETHER_API_KEY is not set")
+
+    configure_metrics()
+    engine = create_engine(api_key)
+    start_prefetcher(engine)
+    api = ChatAPI(engine, create_session_store(engine), auto_save=not args.no_auto_save)
+    try:
+        asyncio.run(serve(args.host, args.port, api))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Archive old conversations and apply the archive retention policy.
+
+Usage:
+    python archive_conversations.py [--older-than-days 30] [--max-age-days 365]
+                                    [--max-count 100000] [--max-bytes 1000000000] [--dry-run]
+
+Moves conversations in the conversations/ folder that have not been
+modified for --older-than-days into compressed segment files under
+conversations/.archive/, where the app can still open them. Then deletes
+archived conversations older than --max-age-days, and the oldest ones
+beyond --max-count or --max-bytes (compressed), and reclaims their space.
+Defaults come from the ARCHIVE_* settings; limits that are not set are not
+enforced. Safe to run from cron while the app is up.
+"""
+
+import os
+import sys
+import argparse
+
+import conversation_store
+from conversation_archive import archive_old_conversations, get_archive
+
+
+def _optional(name, convert):
+    value = os.getenv(name)
+    return convert(value) if value else None
+
+
+def main():
+    """Run the archival job once"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--older-than-days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")),
+                        help="Archive conversations idle for this many days (default: ARCHIVE_AFTER_DAYS or 30)")
+    parser.add_argument("--max-age-days", type=float, default=_optional("ARCHIVE_RETENTION_DAYS", float),
+                        help="Delete archived conversations older than this (default: ARCHIVE_RETENTION_DAYS)")
+    parser.add_argument("--max-count", type=int, default=_optional("ARCHIVE_MAX_CONVERSATIONS", int),
+                        help="Keep at most this many archived conversations (default: ARCHIVE_MAX_CONVERSATIONS)")
+    parser.add_argument("--max-bytes", type=int, default=_optional("ARCHIVE_MAX_BYTES", int),
+                        help="Keep at most this many compressed bytes (default: ARCHIVE_MAX_BYTES)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+    args = parser.parse_args()
+
+    if not os.path.exists(conversation_store.CONVERSATIONS_DIR):
+        print(f"❌ No {conversation_store.CONVERSATIONS_DIR}/ folder found")
+        sys.exit(1)
+
+    if args.dry_run:
+        count = archive_old_conversations(args.older_than_days, dry_run=True)
+        print(f"📦 {count} conversations would be archived")
+        return
+
+    archive = get_archive()
+    print(f"📦 Archiving conversations idle for {args.older_than_days:g}+ days...")
+    count = archive_old_conversations(args.older_than_days, archive=archive)
+    print(f"✅ Archived {count} conversations")
+
+    deleted = archive.enforce_retention(args.max_age_days, args.max_count, args.max_bytes)
+    freed = archive.vacuum()
+    if deleted or freed:
+        print(f"🗑️  Retention: deleted {deleted} archived conversations, freed {freed / 1e6:.1f} MB")
+
+    stats = archive.stats()
+    print(f"\n{stats['conversations']} conversations in the archive "
+          f"({stats['disk_bytes'] / 1e6:.1f} MB in {stats['segments']} segments), "
+          f"{conversation_store.count_conversations()} in {conversation_store.CONVERSATIONS_DIR}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Background auto-save for the AI Commerce Chatbot.
+
+BackgroundWriter hands conversation updates to a small pool of worker
+threads fed by a bounded queue, so disk I/O never runs inside the Streamlit
+script. Several pending saves of the same conversation are coalesced into
+one write, and writes of one conversation never run concurrently. Pending
+writes are flushed at interpreter shutdown.
+
+If another process or session has written to the same conversation, the
+store refuses the append (ConversationConflictError). The writer then saves
+this session's messages as a new conversation (a fork) and sends the
+session's later writes there, so neither side's messages are lost.
+
+A write that fails for another reason (disk full, database locked) is kept
+as a failure for its conversation: failure() reports it, so the session
+can roll back what it counts as saved, and the next save() of that
+conversation starts from the failed write's first message again.
+"""
+import os
+import atexit
+import queue
+import logging
+import threading
+import time
+
+from conversation_store import ConversationConflictError
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """Bounded, coalescing writer for ConversationStore.update_conversation()"""
+
+    def __init__(self, store, max_workers=2, max_queue=1000):
+        self.store = store
+        self.max_queue = max_queue
+        self._queue = queue.Queue()
+        self._pending = {}     # conversation id -> (messages, start, context)
+        self._active = set()   # conversation ids being written right now
+        self._forks = {}       # conflicting conversation id -> (fork id, messages written to it)
+        self._writing = threading.local()  # .conversation_id: what this worker thread is writing
+        self._failed = {}      # conversation id -> (start, context, error) of a write that failed
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.conflicts = 0
+        self.total_write_time = 0.0
+        self.max_write_time = 0.0
+        self.last_error = None
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f"conversation-writer-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.shutdown)
+
+    def save(self, conversation_id, conversation_data, start, context=None):
+        """Queue conversation_data[start:] (and an optional context summary) for writing.
+
+        If a save for the same conversation is still waiting, the two are
+        merged: the earliest start and the newest messages and context win.
+        Blocks only when max_queue conversations are already waiting.
+        """
+        # A SpilledMessages transcript copies only its resident tail
+        conversation_data = conversation_data.copy()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Background writer is shut down")
+            failed = self._failed.pop(conversation_id, None)
+            if failed is not None:
+                # Write again what the failed write did not
+                start, context = min(start, failed[0]), context or failed[1]
+            # Bound the number of conversations waiting to be written
+            self._idle.wait_for(
+                lambda: conversation_id in self._pending or len(self._pending) < self.max_queue)
+            pending = self._pending.get(conversation_id)
+            if pending is not None:
+                self._pending[conversation_id] = (
+                    conversation_data, min(start, pending[1]), context or pending[2])
+                self.coalesced += 1
+                return
+            self._pending[conversation_id] = (conversation_data, start, context)
+            # An active conversation is requeued by its worker when it finishes
+            if conversation_id in self._active:
+                return
+        self._queue.put(conversation_id)
+
+    def _run(self):
+        while True:
+            conversation_id = self._queue.get()
+            if conversation_id is None:
+                return
+            with self._lock:
+                job = self._pending.pop(conversation_id, None)
+                if job is None:
+                    continue
+                self._active.add(conversation_id)
+
+            start_time = time.perf_counter()
+            self._writing.conversation_id = conversation_id
+            try:
+                self._write(conversation_id, *job)
+            except Exception as e:
+                logger.exception("Error saving conversation %s", conversation_id)
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    failed = self._failed.get(conversation_id)
+                    self._failed[conversation_id] = (min(job[1], failed[0]) if failed else job[1],
+                                                     job[2] or (failed[1] if failed else None), str(e))
+            finally:
+                self._writing.conversation_id = None
+            elapsed = time.perf_counter() - start_time
+
+            requeue = False
+            with self._lock:
+                self._active.discard(conversation_id)
+                self.writes += 1
+                self.total_write_time += elapsed
+                self.max_write_time = max(self.max_write_time, elapsed)
+                requeue = conversation_id in self._pending
+                self._idle.notify_all()
+            if requeue:
+                self._queue.put(conversation_id)
+
+    def _write(self, conversation_id, messages, start, context):
+        """Write one job, forking the conversation if the store reports a conflict"""
+        fork = self._forks.get(conversation_id)
+        if fork is not None:
+            fork_id, written = fork
+            self.store.update_conversation(fork_id, messages, written, context)
+            self._forks[conversation_id] = (fork_id, len(messages))
+            return
+        try:
+            self.store.update_conversation(conversation_id, messages, start, context)
+        except ConversationConflictError as e:
+            fork_id = self.store.save_conversation(list(messages))
+            if context is not None:
+                self.store.save_context_summary(fork_id, context)
+            logger.warning("%s; saved this session's copy as %s", e, fork_id)
+            with self._lock:
+                self._forks[conversation_id] = (fork_id, len(messages))
+                self.conflicts += 1
+
+    def failure(self, conversation_id):
+        """(first unsaved message, error) of a failed write not retried yet, or None"""
+        with self._lock:
+            failed = self._failed.get(conversation_id)
+            return (failed[0], failed[2]) if failed else None
+
+    def fork_of(self, conversation_id):
+        """Id a conflicting conversation was forked to, once its queued writes are done, or None"""
+        with self._lock:
+            if conversation_id in self._pending or conversation_id in self._active:
+                return None
+            fork = self._forks.get(conversation_id)
+            return fork[0] if fork else None
+
+    def wait(self, conversation_id=None, timeout=None):
+        """Block until pending writes (for one conversation, or all) are done.
+
+        Called from a worker, e.g. when a spilled transcript reloads its older
+        messages during a write, the conversation that worker is writing does
+        not count: waiting for it would wait for itself.
+        """
+        own = getattr(self._writing, "conversation_id", None)
+
+        def done():
+            if conversation_id is None:
+                return not (self._pending.keys() - {own}) and not (self._active - {own})
+            if conversation_id == own:
+                return True
+            return conversation_id not in self._pending and conversation_id not in self._active
+
+        with self._lock:
+            return self._idle.wait_for(done, timeout=timeout)
+
+    def shutdown(self, timeout=30):
+        """Flush pending writes and stop the workers"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.wait(timeout=timeout)
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def stats(self):
+        """Return queue depth, write counts and write latency"""
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending),
+                "active": len(self._active),
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "conflicts": self.conflicts,
+                "avg_write_time": self.total_write_time / self.writes if self.writes else 0.0,
+                "max_write_time": self.max_write_time,
+                "last_error": self.last_error,
+            }
+
+
+def create_background_writer(store):
+    """Create a writer for store as configured by BACKGROUND_SAVE, or None to write inline"""
+    if os.getenv("BACKGROUND_SAVE", "true").lower() == "false":
+        return None
+    return BackgroundWriter(store,
+                            max_workers=int(os.getenv("SAVE_WORKERS", "2")),
+                            max_queue=int(os.getenv("SAVE_QUEUE_SIZE", "1000")))
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the AI Commerce Chatbot.
+
+Runs the conversation store and the turn pipeline outside Streamlit, against
+a local fake OpenAI-compatible server, and writes results to JSON so runs
+can be compared across commits. See benchmarks/README.md.
+"""
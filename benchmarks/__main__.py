@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Run the benchmark suite.
+
+Usage:
+    python -m benchmarks [--sizes 100,10000,100000] [--backends json,sqlite]
+                         [--catalog-sizes 10000,1000000]
+                         [--skip-store] [--skip-turn] [--skip-catalog] [--skip-import]
+                         [--skip-transcript] [--skip-compare]
+                         [--output results.json]
+    python -m benchmarks compare OLD.json NEW.json
+"""
+import sys
+import argparse
+
+from benchmarks.common import write_results
+
+
+def main():
+    """Parse arguments and run the selected benchmarks"""
+    if sys.argv[1:2] == ["compare"]:
+        from benchmarks.compare import main as compare_main
+        sys.argv = [sys.argv[0]] + sys.argv[2:]
+        compare_main()
+        return
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="AI Commerce Chatbot benchmarks")
+    parser.add_argument("--sizes", default="100,10000,100000",
+                        help="Comma-separated numbers of stored conversations")
+    parser.add_argument("--backends", default="json,sqlite", help="Comma-separated store backends")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions per read measurement")
+    parser.add_argument("--writes", type=int, default=200, help="Saves/appends per write measurement")
+    parser.add_argument("--turns", type=int, default=30, help="Turns for the per-turn overhead benchmark")
+    parser.add_argument("--session-turns", type=int, default=500, help="Turns for the memory growth benchmark")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="Fake model token rate")
+    parser.add_argument("--catalog-sizes", default="10000,1000000",
+                        help="Comma-separated numbers of products in the synthetic catalog")
+    parser.add_argument("--skip-store", action="store_true", help="Skip conversation store benchmarks")
+    parser.add_argument("--skip-turn", action="store_true", help="Skip turn pipeline benchmarks")
+    parser.add_argument("--skip-catalog", action="store_true", help="Skip product catalog benchmarks")
+    parser.add_argument("--skip-import", action="store_true", help="Skip import-time benchmarks")
+    parser.add_argument("--skip-transcript", action="store_true", help="Skip transcript rendering benchmarks")
+    parser.add_argument("--skip-compare", action="store_true", help="Skip product comparison benchmarks")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<time>_<commit>.json)")
+    args = parser.parse_args()
+
+    results = {}
+    if not args.skip_import:
+        from benchmarks import bench_import
+        results["import"] = bench_import.run()
+    if not args.skip_store:
+        from benchmarks import bench_store
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        results["store"] = bench_store.run(sizes, args.backends.split(","), repeat=args.repeat, writes=args.writes)
+    if not args.skip_turn:
+        from benchmarks import bench_turn
+        results["turn"] = bench_turn.run(turns=args.turns, session_turns=args.session_turns,
+                                         latency=args.latency, tokens_per_second=args.tokens_per_second)
+    if not args.skip_catalog:
+        from benchmarks import bench_catalog
+        sizes = [int(size) for size in args.catalog_sizes.split(",") if size]
+        results["catalog"] = bench_catalog.run(sizes, repeat=args.repeat * 2)
+    if not args.skip_transcript:
+        from benchmarks import bench_transcript
+        results["transcript"] = bench_transcript.run(repeat=args.repeat)
+    if not args.skip_compare:
+        from benchmarks import bench_compare
+        results["compare"] = bench_compare.run(latency=args.latency, tokens_per_second=args.tokens_per_second)
+
+    output = write_results(results, args.output)
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Product catalog benchmarks: index build time and size, load time, and
+BM25, vector and hybrid query latency on a synthetic catalog.
+"""
+import os
+import time
+import random
+import tempfile
+
+from benchmarks.common import timed
+
+from product_catalog import ProductCatalog, build_index
+
+BRANDS = ["Acme", "Nike", "Sony", "Apple", "Samsung", "Lenovo", "Dell", "Bose", "Logitech", "Philips",
+          "Adidas", "Canon", "Anker", "Dyson", "Breville", "Garmin", "LG", "Asus", "JBL", "Keurig"]
+PRODUCTS = {
+    "Electronics": ["laptop", "tablet", "monitor", "keyboard", "mouse", "webcam", "router", "charger"],
+    "Audio": ["headphones", "earbuds", "speaker", "soundbar", "microphone", "turntable"],
+    "Shoes": ["running shoes", "sneakers", "hiking boots", "sandals", "trail shoes"],
+    "Kitchen": ["coffee maker", "blender", "air fryer", "espresso machine", "toaster", "kettle"],
+    "Outdoors": ["tent", "backpack", "sleeping bag", "water bottle", "headlamp"],
+    "Fitness": ["smartwatch", "yoga mat", "dumbbells", "fitness tracker", "exercise bike"],
+}
+ADJECTIVES = ["wireless", "portable", "waterproof", "lightweight", "premium", "compact", "ergonomic",
+              "noise cancelling", "stainless steel", "gaming", "ultra", "pro", "smart", "rechargeable"]
+COLORS = ["black", "white", "silver", "blue", "red", "green", "gray", "rose gold"]
+QUERIES = [
+    "wireless noise cancelling headphones",
+    "lightweight running shoes",
+    "espresso machine stainless steel",
+    "gaming laptop",
+    "waterproof hiking boots",
+    "Bose speaker",
+    "portable blendr",
+    "smartwatch for fitness tracking",
+]
+
+
+def synthetic_products(count, seed=42):
+    """Yield count deterministic products spread over a few categories"""
+    rng = random.Random(seed)
+    categories = list(PRODUCTS)
+    for i in range(count):
+        category = rng.choice(categories)
+        kind = rng.choice(PRODUCTS[category])
+        brand = rng.choice(BRANDS)
+        title = f"{brand} {rng.choice(ADJECTIVES)} {kind} {rng.choice(COLORS)} model {i % 997}"
+        yield {
+            "sku": f"SKU{i:08d}",
+            "title": title,
+            "brand": brand,
+            "category": category,
+            "price": f"{rng.uniform(5, 2000):.2f}",
+            "rating": f"{rng.uniform(2.5, 5):.1f}",
+            "description": f"{rng.choice(ADJECTIVES).capitalize()} {kind} from {brand} with "
+                           f"{rng.choice(ADJECTIVES)} design and {rng.randint(1, 5)} year warranty.",
+        }
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_catalog(size, repeat=50):
+    """Benchmark one catalog size in a fresh temporary directory"""
+    with tempfile.TemporaryDirectory(prefix=f"bench_catalog_{size}_") as workdir:
+        index_dir = os.path.join(workdir, "catalog_index")
+        results = {"size": size}
+
+        start = time.perf_counter()
+        build_index(synthetic_products(size), index_dir)
+        results["build_s"] = time.perf_counter() - start
+        results["index_mb"] = _directory_size(index_dir) / 1e6
+
+        results["load"] = timed(lambda: ProductCatalog(index_dir), repeat=10)
+        catalog = ProductCatalog(index_dir)
+        for query in QUERIES:
+            catalog.search(query)   # page in the touched postings once
+
+        queries = QUERIES * (repeat // len(QUERIES) + 1)
+        for name, search in (("bm25", catalog.bm25), ("vector", catalog.vector_search), ("hybrid", catalog.search)):
+            pending = list(queries[:repeat])
+            results[f"query_{name}"] = timed(lambda: search(pending.pop()), repeat)
+        return results
+
+
+def run(sizes, repeat=50):
+    """Run the catalog benchmarks for every size"""
+    results = []
+    for size in sizes:
+        print(f"🏷️ catalog: {size:,} products...", flush=True)
+        results.append(bench_catalog(size, repeat=repeat))
+    return results
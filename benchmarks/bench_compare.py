@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Product comparison benchmarks against the local fake LLM server.
+
+For 2 to 4 products, the time to the first text and to the whole reply
+when the model writes one long comparison covering every product, versus
+ProductComparer's concurrent per-product profiles plus a short synthesis.
+The long reply is as long as the profiles put together.
+"""
+import os
+import time
+import tempfile
+
+from benchmarks.fake_llm_server import start_fake_server
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from conversation_memory import create_memory
+from llm_client import create_llm, load_llm_config
+from product_compare import ProductComparer
+from prompts import COMMERCE_SYSTEM_PROMPT
+
+PRODUCTS = ("iPhone 15", "Pixel 8", "Galaxy S24", "OnePlus 12")
+
+
+def _llm(base_url):
+    config = dict(load_llm_config(), base_url=base_url, model="fake-model")
+    return create_llm("fake-key", config)
+
+
+def _sequential(llm, request):
+    """One streamed completion for the whole comparison: (first text, total) seconds"""
+    messages = [SystemMessage(content=COMMERCE_SYSTEM_PROMPT), HumanMessage(content=request)]
+    start = time.perf_counter()
+    first = None
+    for chunk in llm.stream(messages):
+        if first is None and chunk.content:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def _fanout(comparer, memory, request):
+    """ProductComparer's reply: (first text, total) seconds"""
+    plan = comparer.plan(request)
+    result = comparer.respond(memory, request, plan)
+    return result.time_to_first_token, result.total_time
+
+
+def bench_compare(products, latency=0.2, tokens_per_second=200, profile_tokens=80):
+    """Compare one long completion with the parallel fan-out for one product count"""
+    request = "Compare the " + ", ".join(PRODUCTS[:products - 1]) + f" and {PRODUCTS[products - 1]}"
+    long_server, long_url = start_fake_server(latency=latency, tokens_per_second=tokens_per_second,
+                                              completion_tokens=profile_tokens * products)
+    short_server, short_url = start_fake_server(latency=latency, tokens_per_second=tokens_per_second,
+                                                completion_tokens=profile_tokens)
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_compare_") as workdir:
+            os.chdir(workdir)
+            llm = _llm(short_url)
+            comparer = ProductComparer(llm, concurrency=products)
+            memory = create_memory(llm, COMMERCE_SYSTEM_PROMPT)
+            sequential_first, sequential = _sequential(_llm(long_url), request)
+            fanout_first, fanout = _fanout(comparer, memory, request)
+    finally:
+        os.chdir(cwd)
+        long_server.shutdown()
+        short_server.shutdown()
+    return {
+        "products": products,
+        "sequential_first_text": sequential_first,
+        "sequential_total": sequential,
+        "fanout_first_text": fanout_first,
+        "fanout_total": fanout,
+    }
+
+
+def run(product_counts=(2, 3, 4), latency=0.2, tokens_per_second=200):
+    """Run the comparison benchmarks for several product counts"""
+    results = []
+    for products in product_counts:
+        print(f"⚖️ compare: {products} products...", flush=True)
+        results.append(bench_compare(products, latency=latency, tokens_per_second=tokens_per_second))
+    return results
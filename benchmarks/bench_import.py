@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmarks: how long a fresh interpreter spends importing the
+modules chatbot.py loads before it can render anything, and the chat
+engine it builds in the background, measured with `python -X importtime`.
+
+The chatbot shell's imports are read from chatbot.py itself, so a heavy
+module moved to its top level shows up as a regression in
+`python -m benchmarks compare`.
+
+Usage:
+    python -m benchmarks.bench_import [--repeat 5] [--top 15]
+"""
+import os
+import ast
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.common import REPO_ROOT
+
+ENGINE_MODULES = ["chat_engine"]
+
+# Imports each module, noting the ones not installed, and prints those as JSON
+IMPORT_SCRIPT = """
+import importlib, json, sys
+missing = []
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except ImportError as e:
+        missing.append(f"{name}: {e}")
+print(json.dumps(missing))
+"""
+
+
+def top_level_imports(path):
+    """Modules imported at the top level of a script (not inside functions)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into {top-level module: cumulative ms} and the total ms"""
+    modules, total = {}, 0.0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        total += int(self_us) / 1000
+        # Nested imports are indented below the module that triggered them
+        if not name[1:].startswith(" "):
+            modules[name.strip()] = modules.get(name.strip(), 0.0) + int(cumulative_us) / 1000
+    return modules, total
+
+
+def measure_imports(modules):
+    """Import modules in a fresh interpreter; returns (per-module ms, total ms, missing modules)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT, *modules],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    per_module, total = parse_importtime(result.stderr)
+    return per_module, total, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_imports(name, modules, repeat=5, top=15):
+    """Median import times over repeat fresh interpreters"""
+    runs = [measure_imports(modules) for _ in range(repeat)]
+    totals = [total for _, total, _ in runs]
+    per_module = {}
+    for module in runs[0][0]:
+        per_module[module] = statistics.median(run[0].get(module, 0.0) for run in runs)
+    slowest = sorted(per_module.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "target": name,
+        "imports": modules,
+        "missing": runs[0][2],
+        "total_ms": statistics.median(totals),
+        "modules_ms": dict(slowest),
+    }
+
+
+def run(repeat=5, top=15):
+    """Measure the chatbot shell and the chat engine"""
+    shell = top_level_imports(os.path.join(REPO_ROOT, "chatbot.py"))
+    results = {}
+    for name, modules in (("chatbot_shell", shell), ("chat_engine", ENGINE_MODULES)):
+        print(f"📥 imports: {name}...", flush=True)
+        results[name] = bench_imports(name, modules, repeat=repeat, top=top)
+    return results
+
+
+def main():
+    """Print an import-time report"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_import",
+                                     description="Import-time report for the chatbot")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level modules to list")
+    args = parser.parse_args()
+
+    for name, result in run(args.repeat, args.top).items():
+        print(f"\n{name}: {result['total_ms']:.1f} ms ({', '.join(result['imports'])})")
+        for module, ms in result["modules_ms"].items():
+            print(f"  {ms:8.1f} ms  {module}")
+        for missing in result["missing"]:
+            print(f"  ⚠️  not installed, not measured: {missing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Conversation store benchmarks: save, append, load, list and search
+throughput for each backend at several store sizes.
+"""
+import os
+import json
+import time
+import random
+import datetime
+import tempfile
+
+from benchmarks.common import synthetic_conversation, summarize, timed
+
+import conversation_store
+from sqlite_store import SqliteStore
+
+BASE_TIME = datetime.datetime(2025, 1, 1)
+
+
+def _conversation_record(i):
+    """Synthetic conversation i with a timestamp one minute apart from its neighbours"""
+    messages = synthetic_conversation(i)
+    created = BASE_TIME + datetime.timedelta(minutes=i)
+    return {
+        "id": f"{created.strftime('%Y%m%d_%H%M%S')}_{i:06d}",
+        "title": conversation_store.make_title(messages),
+        "timestamp": created.strftime("%Y%m%d_%H%M%S"),
+        "created": created.isoformat(),
+        "messages": messages,
+    }
+
+
+def _reset_json_caches():
+    """Forget in-process index caches when switching benchmark directories"""
+    conversation_store._index_cache.update(stat=None, index=None)
+    conversation_store._sorted_cache.update(index=None, entries=[])
+
+
+def populate(backend, size):
+    """Fill an empty store in the current directory with size conversations"""
+    if backend == "json":
+        os.makedirs(conversation_store.CONVERSATIONS_DIR, exist_ok=True)
+        for i in range(size):
+            record = _conversation_record(i)
+            path = os.path.join(conversation_store.CONVERSATIONS_DIR, record.pop("id") + ".json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, indent=2, ensure_ascii=False)
+        _reset_json_caches()
+        return conversation_store.JsonFileStore()
+
+    store = SqliteStore("conversations.db")
+    store.import_conversations(_conversation_record(i) for i in range(size))
+    return store
+
+
+def bench_store(backend, size, repeat=20, writes=200):
+    """Benchmark one backend at one store size, in a fresh temporary directory"""
+    rng = random.Random(42)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"bench_{backend}_{size}_") as workdir:
+        os.chdir(workdir)
+        try:
+            results = {"backend": backend, "size": size}
+
+            start = time.perf_counter()
+            store = populate(backend, size)
+            results["populate_s"] = time.perf_counter() - start
+
+            # First listing builds the JSON index from scratch
+            results["list_first_page_cold"] = timed(lambda: store.list_conversations(limit=10), repeat=1)
+            results["list_first_page"] = timed(
+                lambda: (store.list_conversations(limit=10), store.count_conversations()), repeat)
+            results["list_last_page"] = timed(
+                lambda: store.list_conversations(limit=10, offset=max(0, size - 10)), repeat)
+            results["list_title_prefix"] = timed(
+                lambda: (store.list_conversations(limit=10, title_prefix="what"),
+                         store.count_conversations(title_prefix="what")), repeat)
+
+            ids = [c["id"] for c in store.list_conversations()]
+            sample = [rng.choice(ids) for _ in range(repeat)]
+            results["load"] = timed(lambda: store.load_conversation(sample.pop()), repeat)
+
+            if backend == "sqlite" or size <= 10000:
+                results["search"] = timed(lambda: store.search_conversations("laptop video editing"), repeat=5)
+
+            # Writes: new conversations, then appending one turn to existing ones
+            samples = []
+            for i in range(writes):
+                messages = synthetic_conversation(size + i)
+                start = time.perf_counter()
+                store.save_conversation(messages, title=f"Benchmark conversation {size + i}")
+                samples.append(time.perf_counter() - start)
+            results["save"] = summarize(samples)
+            results["save_per_s"] = writes / sum(samples)
+
+            samples = []
+            for conversation_id in rng.sample(ids, min(writes, len(ids))):
+                messages = synthetic_conversation(0, turns=4)
+                start = time.perf_counter()
+                store.append_messages(conversation_id, messages, 7)
+                samples.append(time.perf_counter() - start)
+            results["append"] = summarize(samples)
+            results["append_per_s"] = len(samples) / sum(samples)
+            return results
+        finally:
+            os.chdir(cwd)
+            _reset_json_caches()
+
+
+def run(sizes, backends, repeat=20, writes=200):
+    """Run the store benchmarks for every backend and size"""
+    results = []
+    for backend in backends:
+        for size in sizes:
+            print(f"📦 store: {backend} × {size:,} conversations...", flush=True)
+            results.append(bench_store(backend, size, repeat=repeat, writes=writes))
+    return results
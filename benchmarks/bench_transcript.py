@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Transcript rendering benchmarks: per-rerun markdown preparation time and
+the markdown bytes sent to the browser, drawing the whole transcript versus
+the TRANSCRIPT_WINDOW window, as a session grows.
+
+This measures the work chatbot.py does for the transcript on each rerun,
+without Streamlit itself; the bytes are the text of every chat message
+drawn, which is what dominates the websocket payload for long chats.
+"""
+from benchmarks.common import synthetic_conversation, timed
+
+import transcript
+
+
+def _rerun(messages, cache, start):
+    """The transcript part of one rerun: markdown for every drawn message"""
+    return sum(len(cache.render(message).encode("utf-8")) for message in messages[start:])
+
+
+def bench_transcript(turns, repeat=20):
+    """Compare full and windowed rendering for one session length"""
+    messages = synthetic_conversation(0, turns=turns)
+    results = {"turn": turns}
+    for mode in ("full", "windowed"):
+        start = 0 if mode == "full" else transcript.visible_start(len(messages))
+        cache = transcript.MarkdownCache()
+        results[f"{mode}_first_rerun"] = timed(lambda: _rerun(messages, cache, start), repeat=1)
+        results[f"{mode}_rerun"] = timed(lambda: _rerun(messages, cache, start), repeat)
+        results[f"{mode}_messages"] = len(messages) - start
+        results[f"{mode}_payload_kb"] = _rerun(messages, cache, start) / 1024
+    return results
+
+
+def run(turns=(10, 100, 300, 1000), repeat=20):
+    """Run the transcript benchmarks for several session lengths"""
+    results = []
+    for count in turns:
+        print(f"💬 transcript: {count} turns...", flush=True)
+        results.append(bench_transcript(count, repeat=repeat))
+    return results
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Turn pipeline benchmarks against the local fake LLM server.
+
+- per-turn overhead: time spent outside the model (memory assembly, cache
+  key, prompt formatting, HTTP client, memory update, save), measured by
+  subtracting the fake server's configured model time
+- memory growth: Python heap growth and prompt size over long sessions,
+  for each memory mode
+"""
+import os
+import time
+import tempfile
+import tracemalloc
+
+from benchmarks.common import SAMPLE_QUESTIONS, summarize
+from benchmarks.fake_llm_server import model_time, start_fake_server
+
+from langchain.chains import ConversationChain
+
+import conversation_store
+from conversation_memory import create_memory
+from llm_client import create_llm, load_llm_config
+from prompts import COMMERCE_SYSTEM_PROMPT
+from response_cache import make_cache_key
+
+
+def _build_chain(base_url, memory_mode):
+    """Build the same LLM client, memory and chain the app uses, pointed at base_url"""
+    os.environ["MEMORY_MODE"] = memory_mode
+    config = dict(load_llm_config(), base_url=base_url, model="fake-model")
+    llm = create_llm("fake-key", config)
+    memory = create_memory(llm, COMMERCE_SYSTEM_PROMPT)
+    return llm, memory, ConversationChain(memory=memory, llm=llm)
+
+
+def _run_turn(llm, memory, conversation, user_input, store, conversation_id, messages):
+    """Run one turn stage by stage and return the duration of each stage"""
+    timings = {}
+
+    start = time.perf_counter()
+    inputs = {conversation.input_key: user_input}
+    inputs.update(memory.load_memory_variables(inputs))
+    timings["memory_load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    make_cache_key(llm.model_name, COMMERCE_SYSTEM_PROMPT, inputs[memory.memory_key], user_input)
+    timings["cache_key"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompt_value = conversation.prompt.format_prompt(**inputs)
+    timings["prompt_format"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = "".join(chunk.content for chunk in llm.stream(prompt_value))
+    timings["llm"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    memory.save_context({conversation.input_key: user_input}, {conversation.output_key: response})
+    timings["memory_save"] = time.perf_counter() - start
+
+    saved = len(messages)
+    messages.append({"role": "user", "content": user_input})
+    messages.append({"role": "assistant", "content": response})
+    start = time.perf_counter()
+    store.append_messages(conversation_id, messages, saved)
+    timings["store_save"] = time.perf_counter() - start
+    return timings
+
+
+def bench_turn_overhead(turns=30, latency=0.2, tokens_per_second=200, completion_tokens=60,
+                        memory_mode="token_budget"):
+    """Measure per-turn overhead outside model time"""
+    server, base_url = start_fake_server(latency=latency, tokens_per_second=tokens_per_second,
+                                         completion_tokens=completion_tokens)
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_turn_") as workdir:
+            os.chdir(workdir)
+            llm, memory, conversation = _build_chain(base_url, memory_mode)
+            store = conversation_store.JsonFileStore()
+            messages = [{"role": "assistant", "content": "Welcome!"}]
+            conversation_id = store.save_conversation(messages, title="Benchmark turn")
+
+            stages = {}
+            for t in range(turns):
+                timings = _run_turn(llm, memory, conversation, SAMPLE_QUESTIONS[t % len(SAMPLE_QUESTIONS)],
+                                    store, conversation_id, messages)
+                for stage, seconds in timings.items():
+                    stages.setdefault(stage, []).append(seconds)
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    expected_model = model_time(server)
+    non_model = [sum(samples[i] for stage, samples in stages.items() if stage != "llm") for i in range(turns)]
+    return {
+        "memory_mode": memory_mode,
+        "turns": turns,
+        "model_time_ms": expected_model * 1000,
+        "stages": {stage: summarize(samples) for stage, samples in stages.items()},
+        "client_overhead": summarize([max(0.0, s - expected_model) for s in stages["llm"]]),
+        "pipeline_overhead": summarize(non_model),
+    }
+
+
+def bench_memory_growth(turns=500, sample_every=50, memory_mode="token_budget"):
+    """Track heap growth and prompt size over a long session with an instant fake model"""
+    server, base_url = start_fake_server(latency=0.0, tokens_per_second=0, completion_tokens=80)
+    try:
+        llm, memory, conversation = _build_chain(base_url, memory_mode)
+        messages = []
+        samples = []
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for t in range(1, turns + 1):
+            user_input = f"{SAMPLE_QUESTIONS[t % len(SAMPLE_QUESTIONS)]} (turn {t})"
+            inputs = {conversation.input_key: user_input}
+            inputs.update(memory.load_memory_variables(inputs))
+            response = llm.invoke(conversation.prompt.format_prompt(**inputs)).content
+            memory.save_context({conversation.input_key: user_input}, {conversation.output_key: response})
+            messages.append({"role": "user", "content": user_input})
+            messages.append({"role": "assistant", "content": response})
+            if t % sample_every == 0:
+                samples.append({
+                    "turn": t,
+                    "heap_bytes": tracemalloc.get_traced_memory()[0] - baseline,
+                    "memory_messages": len(memory.chat_memory.messages),
+                    "prompt_tokens": getattr(memory, "last_prompt_tokens", None),
+                })
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+    finally:
+        server.shutdown()
+
+    return {"memory_mode": memory_mode, "turns": turns, "peak_heap_bytes": peak, "samples": samples}
+
+
+def run(turns=30, session_turns=500, latency=0.2, tokens_per_second=200):
+    """Run the turn pipeline benchmarks for each memory mode"""
+    results = {"overhead": [], "memory_growth": []}
+    for memory_mode in ("window", "token_budget"):
+        print(f"🔁 turn overhead: {memory_mode} memory, {turns} turns...", flush=True)
+        results["overhead"].append(bench_turn_overhead(
+            turns=turns, latency=latency, tokens_per_second=tokens_per_second, memory_mode=memory_mode))
+        print(f"📈 memory growth: {memory_mode} memory, {session_turns} turns...", flush=True)
+        results["memory_growth"].append(bench_memory_growth(turns=session_turns, memory_mode=memory_mode))
+    return results
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the benchmark suite: timing, synthetic data and results.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# Benchmarks import the app modules (conversation_store, llm_client, ...)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+SAMPLE_QUESTIONS = [
+    "I'm looking for a laptop under $800 for video editing",
+    "What are the best wireless earbuds for running?",
+    "Can you compare the latest iPhone and Pixel phones?",
+    "I need help tracking my order from last week",
+    "What is your return policy for opened electronics?",
+    "Find me a gift for a coffee lover under $50",
+]
+
+
+def summarize(samples):
+    """Summarize a list of durations (seconds) as milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(fn, repeat=20):
+    """Run fn() repeat times and summarize the durations"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def synthetic_conversation(i, turns=3):
+    """Build a deterministic conversation with the given number of turns"""
+    messages = [{"role": "assistant", "content": "🛍️ Welcome to your AI Commerce Assistant! What can I help you shop for today?"}]
+    for t in range(turns):
+        question = SAMPLE_QUESTIONS[(i + t) % len(SAMPLE_QUESTIONS)]
+        messages.append({"role": "user", "content": f"{question} (#{i}.{t})"})
+        messages.append({"role": "assistant", "content": (
+            f"Great question! Here are some options for conversation {i}, turn {t}. "
+            "Option one offers the best value, option two has the best reviews, "
+            "and option three is the premium pick with a longer warranty. 🛒")})
+    return messages
+
+
+def git_commit():
+    """Current git commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, output=None):
+    """Write results with environment metadata to a JSON file and return its path"""
+    commit = git_commit()
+    now = datetime.datetime.now()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{now.strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json")
+    payload = {
+        "commit": commit,
+        "created": now.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return output
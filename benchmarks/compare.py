@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compare two benchmark result files and flag regressions.
+
+Usage:
+    python -m benchmarks compare OLD.json NEW.json [--threshold 0.2]
+"""
+import json
+import argparse
+
+
+def flatten(value, prefix=""):
+    """Flatten nested results into {"path": number}, keying list items by backend/size/mode"""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = str(i)
+            if isinstance(item, dict):
+                parts = [str(item[k]) for k in ("backend", "size", "memory_mode", "turn") if k in item]
+                label = "/".join(parts) or label
+            flat.update(flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = value
+    return flat
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+
+def main():
+    """Print metrics that changed by more than the threshold"""
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change to report (default 20%%)")
+    args = parser.parse_args()
+
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    old_metrics = flatten(old["results"])
+    new_metrics = flatten(new["results"])
+
+    print(f"📊 {old.get('commit')} → {new.get('commit')}")
+    regressions = 0
+    for metric in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[metric], new_metrics[metric]
+        if not before or metric.endswith((".n", ".size", ".turns", ".turn", ".max_ms")):
+            continue
+        change = (after - before) / abs(before)
+        if abs(change) < args.threshold:
+            continue
+        worse = change < 0 if higher_is_better(metric) else change > 0
+        regressions += worse
+        print(f"{'🔴' if worse else '🟢'} {metric}: {before:.3f} → {after:.3f} ({change:+.0%})")
+    print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake OpenAI-compatible chat completions server.
+
+Answers POST /v1/chat/completions (streaming and non-streaming) with a canned
+reply after a configurable time-to-first-token, then emits tokens at a
+configurable rate. Useful for benchmarks and offline runs without a
+Together API key.
+
+Usage:
+    python -m benchmarks.fake_llm_server --port 8911 --latency 0.5 --tokens-per-second 50
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_WORDS = (
+    "Here are a few great options for you 🛍️ Each one balances price, "
+    "build quality and customer reviews so you can pick what fits your budget best "
+).split()
+
+
+def fake_reply(completion_tokens):
+    """Build a reply of roughly completion_tokens tokens (one word per token)"""
+    return [REPLY_WORDS[i % len(REPLY_WORDS)] + " " for i in range(completion_tokens)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the subset of the OpenAI API used by ChatOpenAI"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+        model = request.get("model", "fake-model")
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        tokens = fake_reply(server.completion_tokens)
+        token_delay = 1.0 / server.tokens_per_second if server.tokens_per_second else 0.0
+        created = int(time.time())
+
+        time.sleep(server.latency)
+
+        if not request.get("stream"):
+            time.sleep(token_delay * len(tokens))
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(token_delay)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def create_fake_server(host="127.0.0.1", port=0, latency=0.0, tokens_per_second=0, completion_tokens=50):
+    """Create (but do not start) a fake server; port 0 picks a free port.
+
+    latency is the time to first token in seconds; tokens_per_second=0
+    sends all tokens at once.
+    """
+    server = ThreadingHTTPServer((host, port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.tokens_per_second = tokens_per_second
+    server.completion_tokens = completion_tokens
+    server.requests = 0
+    server.stats_lock = threading.Lock()
+    return server
+
+
+def start_fake_server(**kwargs):
+    """Start a fake server on a background thread and return (server, base_url)"""
+    server = create_fake_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def model_time(server):
+    """Time the server spends 'generating' one reply, in seconds"""
+    if not server.tokens_per_second:
+        return server.latency
+    return server.latency + (server.completion_tokens - 1) / server.tokens_per_second
+
+
+def main():
+    """Run the fake server in the foreground"""
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="0 sends all tokens at once")
+    parser.add_argument("--completion-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    server = create_fake_server(args.host, args.port, args.latency, args.tokens_per_second, args.completion_tokens)
+    print(f"🤖 Fake LLM server listening on http://{args.host}:{args.port}/v1")
+    print(f"   Set LLM_BASE_URL=http://{args.host}:{args.port}/v1 to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
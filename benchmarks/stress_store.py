@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process stress test for the conversation store.
+
+Usage:
+    python -m benchmarks.stress_store [--processes 8] [--saves 50] [--appends 20]
+                                      [--backends json,sqlite]
+
+Starts --processes worker processes on one store in a temporary directory,
+as several Streamlit replicas on a shared volume would. Each worker saves
+--saves conversations with the same title and messages as every other
+worker (so many land in the same second), lists the store while the
+others write, and races the other workers --appends times to add a turn to
+one shared conversation. Afterwards the store is checked:
+
+- every save got its own id, and every saved conversation loads intact
+- the listing and the count include exactly the saved conversations
+- the shared conversation holds whole turns only, one per successful
+  append, and every losing append got ConversationConflictError
+
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+from benchmarks.common import synthetic_conversation
+
+import conversation_store
+from conversation_store import ConversationConflictError
+from sqlite_store import SqliteStore
+
+SHARED_TITLE = "Shared conversation"
+
+
+def _open_store(backend):
+    if backend == "sqlite":
+        return SqliteStore("conversations.db")
+    # Compact often, so compactions race with appends too
+    conversation_store.JOURNAL_COMPACT_BYTES = 4096
+    return conversation_store.JsonFileStore()
+
+
+def _worker(backend, workdir, worker, saves, appends, shared_id, barrier, results):
+    """Save, list and append concurrently with the other workers"""
+    os.chdir(workdir)
+    store = _open_store(backend)
+    messages = synthetic_conversation(0)
+    ids, list_errors, wins, conflicts = [], 0, 0, 0
+    barrier.wait()
+    for i in range(saves):
+        ids.append(store.save_conversation(messages, title="Same question"))
+        if i % 5 == 0:
+            try:
+                store.list_conversations(limit=20)
+                store.count_conversations()
+            except Exception:
+                list_errors += 1
+
+    barrier.wait()
+    while wins < appends:
+        conversation = store.load_conversation(shared_id)["messages"]
+        turn = [{"role": "user", "content": f"worker {worker} turn {wins}"},
+                {"role": "assistant", "content": f"reply to worker {worker} turn {wins}"}]
+        try:
+            store.append_messages(shared_id, conversation + turn, len(conversation))
+            wins += 1
+        except ConversationConflictError:
+            conflicts += 1
+    results.put({"worker": worker, "ids": ids, "list_errors": list_errors,
+                 "wins": wins, "conflicts": conflicts})
+
+
+def _check(store, records, processes, saves, appends, shared_id):
+    """Return a list of problems found in the store after a run"""
+    problems = []
+    ids = [conversation_id for record in records for conversation_id in record["ids"]]
+    if len(set(ids)) != processes * saves:
+        problems.append(f"{processes * saves} saves produced {len(set(ids))} distinct ids")
+    for conversation_id in ids:
+        try:
+            if len(store.load_conversation(conversation_id)["messages"]) != len(synthetic_conversation(0)):
+                problems.append(f"{conversation_id} has the wrong number of messages")
+        except Exception as e:
+            problems.append(f"{conversation_id} does not load: {type(e).__name__}: {e}")
+
+    listed = {entry["id"] for entry in store.list_conversations()}
+    expected = set(ids) | {shared_id}
+    if listed != expected:
+        problems.append(f"listing has {len(listed)} conversations, expected {len(expected)}")
+    if store.count_conversations() != len(expected):
+        problems.append(f"count is {store.count_conversations()}, expected {len(expected)}")
+    list_errors = sum(record["list_errors"] for record in records)
+    if list_errors:
+        problems.append(f"{list_errors} listings failed during the writes")
+
+    shared = store.load_conversation(shared_id)["messages"]
+    turns = shared[len(synthetic_conversation(0)):]
+    if len(turns) != 2 * processes * appends:
+        problems.append(f"shared conversation has {len(turns)} new messages, expected {2 * processes * appends}")
+    for user, assistant in zip(turns[::2], turns[1::2]):
+        if assistant["content"] != f"reply to {user['content']}":
+            problems.append(f"shared conversation has an interleaved turn: {user['content']!r}")
+            break
+    return problems
+
+
+def stress_store(backend, processes=8, saves=50, appends=20):
+    """Run one stress round against a fresh store; returns (stats, problems)"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"stress_{backend}_") as workdir:
+        os.chdir(workdir)
+        try:
+            store = _open_store(backend)
+            shared_id = store.save_conversation(synthetic_conversation(0), title=SHARED_TITLE)
+            barrier = multiprocessing.Barrier(processes)
+            results = multiprocessing.Queue()
+            workers = [multiprocessing.Process(
+                target=_worker, args=(backend, workdir, i, saves, appends, shared_id, barrier, results))
+                for i in range(processes)]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            records = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            if backend == "json":
+                conversation_store._index_cache.update(stat=None, index=None)
+                conversation_store._sorted_cache.update(index=None, entries=[])
+            problems = _check(store, records, processes, saves, appends, shared_id)
+            stats = {
+                "backend": backend,
+                "processes": processes,
+                "seconds": elapsed,
+                "saves": processes * saves,
+                "appends": processes * appends,
+                "append_conflicts": sum(record["conflicts"] for record in records),
+            }
+            return stats, problems
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    """Run the stress test for each backend"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.stress_store",
+                                     description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--processes", type=int, default=8, help="Worker processes")
+    parser.add_argument("--saves", type=int, default=50, help="New conversations saved per worker")
+    parser.add_argument("--appends", type=int, default=20, help="Turns each worker adds to the shared conversation")
+    parser.add_argument("--backends", default="json,sqlite", help="Comma-separated store backends")
+    args = parser.parse_args()
+
+    failed = False
+    for backend in args.backends.split(","):
+        print(f"🔨 {backend}: {args.processes} processes...", flush=True)
+        stats, problems = stress_store(backend, args.processes, args.saves, args.appends)
+        print(f"   {stats['saves']} saves and {stats['appends']} appends in {stats['seconds']:.1f}s, "
+              f"{stats['append_conflicts']} append conflicts detected")
+        for problem in problems:
+            print(f"   ❌ {problem}")
+        if not problems:
+            print("   ✅ No lost, duplicated, partial or interleaved writes")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Build the product catalog index used to ground the chatbot's recommendations.
+
+Usage:
+    python build_catalog_index.py products.csv [--index catalog_index] [--clusters N]
+
+Reads a CSV or JSONL product file (columns such as sku, title, brand,
+category, description, price, rating and url; common alternatives like
+id/name are recognized) and writes a memory-mapped index directory that the
+app opens at startup. Rebuilding replaces the index atomically, so it is
+safe to run while the app is up; restart the app to pick up the new index.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from product_catalog import ProductCatalog, build_index, read_products
+
+
+def main():
+    """Build the index and run a sample query"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("catalog", help="Product file (.csv, .jsonl or .ndjson)")
+    parser.add_argument("--index", default=os.getenv("PRODUCT_CATALOG_INDEX", "catalog_index"),
+                        help="Index directory (default: PRODUCT_CATALOG_INDEX or catalog_index)")
+    parser.add_argument("--clusters", type=int, default=None,
+                        help="Vector clusters (default: about the square root of the product count)")
+    parser.add_argument("--query", default="wireless headphones", help="Sample query to run after the build")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.catalog):
+        print(f"❌ No such file: {args.catalog}")
+        sys.exit(1)
+
+    print(f"📦 Indexing {args.catalog} into {args.index}/...")
+    try:
+        count = build_index(read_products(args.catalog), args.index, clusters=args.clusters, log=print)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ Indexed {count:,} products")
+
+    start = time.perf_counter()
+    catalog = ProductCatalog(args.index)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    matches = catalog.search(args.query)
+    searched = time.perf_counter() - start
+    print(f"\n🔎 \"{args.query}\" (load {loaded * 1000:.1f} ms, search {searched * 1000:.1f} ms):")
+    for product in matches:
+        print(f"   {product['sku']}  {product.get('title', '')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Per-turn deadlines and cooperative cancellation for LLM calls.
+
+Every chat turn gets a CancelToken (ChatSession.start_turn). A turn is
+cancelled when a newer message supersedes it, when its chat is reset or
+deleted, or when the caller goes away; it times out once its deadline
+(LLM_TURN_TIMEOUT) passes. The streaming code checks the token while it
+waits for admission and between chunks, closes the model's HTTP stream (so
+the admission slot is freed) and never writes a cancelled turn to memory,
+the transcript or the store.
+"""
+import time
+import asyncio
+import threading
+import contextlib
+
+# Reasons a turn stops early, used as the metrics label
+SUPERSEDED = "superseded"
+RESET = "reset"
+DELETED = "deleted"
+ABANDONED = "abandoned"
+TIMEOUT = "timeout"
+
+
+class TurnCancelledError(Exception):
+    """The turn was cancelled before its reply was used; reason says why"""
+
+    def __init__(self, reason):
+        super().__init__(f"The request was cancelled ({reason}).")
+        self.reason = reason
+
+
+class TurnTimeoutError(TurnCancelledError):
+    """The turn ran past its deadline"""
+
+    def __init__(self, timeout=None):
+        Exception.__init__(self, "The assistant took too long to answer, please try again."
+                           if timeout is None else
+                           f"The assistant took longer than {timeout:g}s to answer, please try again.")
+        self.reason = TIMEOUT
+        self.timeout = timeout
+
+
+class CancelToken:
+    """Cancellation flag and optional deadline (seconds from now) for one turn"""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @property
+    def expired(self):
+        """True once the deadline has passed"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def cancel(self, reason=ABANDONED):
+        """Cancel the turn (the first reason wins) and run the on_cancel callbacks"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call callback() once when the turn is cancelled (at once if it already is)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def remaining(self):
+        """Seconds left before the deadline (may be negative), or None without one"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self, deadline=True):
+        """Raise TurnCancelledError if cancelled, or TurnTimeoutError once the deadline has passed.
+
+        deadline=False only checks for cancellation, for work that has already finished.
+        """
+        if deadline and not self.cancelled and self.expired:
+            self.cancel(TIMEOUT)
+        if self.cancelled:
+            if self.reason == TIMEOUT:
+                raise TurnTimeoutError(self.timeout)
+            raise TurnCancelledError(self.reason)
+
+    def wait(self, seconds):
+        """Sleep up to seconds, returning early if the turn is cancelled or reaches its deadline"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, max(0.0, remaining))
+        self._event.wait(seconds)
+
+
+@contextlib.contextmanager
+def cancel_future(cancel):
+    """An asyncio future on the running loop that completes when cancel fires, from any thread"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve():
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    cancel.on_cancel(resolve)
+    try:
+        yield future
+    finally:
+        cancel.remove_callback(resolve)
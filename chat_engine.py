@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+Chat engine for the AI Commerce Chatbot.
+
+Everything a chat turn needs outside of a user interface lives here: the
+system prompt, per-session conversation memory, intent routing, product
+catalog retrieval, parallel product comparisons, the response cache and its
+warm-start prefetch, the LLM call (blocking, streamed, or on an asyncio
+event loop) with per-turn deadlines and cancellation, and conversation
+persistence. The Streamlit app (chatbot.py) and the
+HTTP API (api_server.py) are both clients of one ChatEngine per process.
+"""
+import os
+import time
+import uuid
+import logging
+import asyncio
+
+from langchain.chains import ConversationChain
+
+import conversation_store
+from background_writer import create_background_writer
+from cancellation import ABANDONED, SUPERSEDED, TIMEOUT, CancelToken, TurnCancelledError
+from conversation_memory import create_memory, rehydrate_memory
+from intent_router import create_router
+from llm_admission import create_admission_controller
+from llm_client import create_llm, create_small_llm
+from metrics import REGISTRY, count_tokens, stats_gauges, trace_span
+from product_catalog import create_catalog, format_products
+from product_compare import create_comparer
+from prompts import CATALOG_CONTEXT_PROMPT, COMMERCE_SYSTEM_PROMPT, WELCOME_MESSAGE
+from response_cache import create_response_cache, make_cache_key
+from streaming import StreamResult, astream_conversation, complete_conversation, stream_conversation
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession:
+    """One user's conversation: transcript, memory and what has been saved"""
+
+    def __init__(self, memory, messages, session_id=None, conversation_id=None,
+                 saved_message_count=0, saved_summary=""):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.memory = memory
+        self.messages = messages
+        self.conversation_id = conversation_id
+        self.saved_message_count = saved_message_count
+        self.saved_summary = saved_summary
+        self.last_active = time.time()
+        self.turn = None
+        # False when the user turned auto-save off: the session store must not save it either
+        self.auto_save = True
+
+    def add_user_message(self, content):
+        """Append a user message; respond() answers it"""
+        self.messages.append({"role": "user", "content": content})
+        self.last_active = time.time()
+
+    def start_turn(self, timeout=None):
+        """Return a CancelToken for a new turn, superseding the one still running"""
+        self.cancel_turn(SUPERSEDED)
+        self.turn = CancelToken(timeout)
+        return self.turn
+
+    def cancel_turn(self, reason):
+        """Cancel the running turn, if any: its reply is never used"""
+        turn = self.turn
+        if turn is not None:
+            turn.cancel(reason)
+
+    def end_turn(self, token):
+        if self.turn is token:
+            self.turn = None
+
+    @property
+    def pending_input(self):
+        """The user message waiting for a reply, or None"""
+        if self.messages and self.messages[-1]["role"] == "user":
+            return self.messages[-1]["content"]
+        return None
+
+    @property
+    def unsaved(self):
+        """True if there are messages that have not been saved yet"""
+        return len(self.messages) > self.saved_message_count
+
+    def to_dict(self):
+        """Session as a JSON-serializable dict"""
+        return {
+            "session_id": self.session_id,
+            "conversation_id": self.conversation_id,
+            "messages": list(self.messages),
+        }
+
+
+class ChatEngine:
+    """System prompt, memory, LLM and persistence shared by every session in a process"""
+
+    def __init__(self, llm, store, writer=None, response_cache=None, admission=None, catalog=None,
+                 router=None, small_llm=None, comparer=None, system_prompt=COMMERCE_SYSTEM_PROMPT,
+                 turn_timeout=None, registry=REGISTRY):
+        self.llm = llm
+        self.small_llm = small_llm
+        self.router = router
+        self.comparer = comparer
+        self.store = store
+        self.writer = writer
+        self.response_cache = response_cache
+        self.admission = admission
+        self.catalog = catalog
+        self.system_prompt = system_prompt
+        self.turn_timeout = turn_timeout
+        self.registry = registry
+        self.prefetcher = None  # set by prefetch.start_prefetcher()
+
+    # Sessions
+
+    def new_session(self, welcome=WELCOME_MESSAGE, session_id=None):
+        """Start a conversation with a welcome message and fresh memory"""
+        return ChatSession(create_memory(self.llm, self.system_prompt, self.admission),
+                           [{"role": "assistant", "content": welcome}],
+                           session_id=session_id)
+
+    def reset_memory(self, session):
+        """Start the session's memory afresh (system prompt only)"""
+        session.memory = create_memory(self.llm, self.system_prompt, self.admission)
+        session.saved_summary = ""
+
+    def open_session(self, conversation_id, session_id=None):
+        """Resume a saved conversation, rebuilding its memory without an LLM call.
+
+        The session gets a new id unless session_id is given, so two clients
+        resuming one conversation never share a session. Returns None if no
+        such conversation exists.
+        """
+        self.wait_for_save(conversation_id)
+        try:
+            conversation = self.store.load_conversation(conversation_id)
+        except (FileNotFoundError, KeyError):
+            return None
+        if not conversation:
+            return None
+        try:
+            context = self.store.load_context_summary(conversation_id)
+        except Exception:
+            context = None
+        messages = conversation["messages"]
+        memory = rehydrate_memory(create_memory(self.llm, self.system_prompt, self.admission), messages, context)
+        return ChatSession(memory, messages,
+                           session_id=session_id,
+                           conversation_id=conversation_id,
+                           saved_message_count=len(messages),
+                           saved_summary=(context or {}).get("summary", ""))
+
+    # Turns
+
+    def _chain(self, session, llm):
+        # Cheap: only the memory is per-session
+        return ConversationChain(memory=session.memory, llm=llm)
+
+    def _pending_input(self, session):
+        user_input = session.pending_input
+        if user_input is None:
+            raise ValueError("The last message is not a user message")
+        if hasattr(session.memory, "turn_position"):
+            # So the saved summary records which transcript messages it covers
+            session.memory.turn_position = len(session.messages) - 1
+        return user_input
+
+    def _route(self, user_input, trace=None, memory=None):
+        """Pick the route for the user's message (memory: the session's, for comparisons).
+
+        Returns (model to call or None, canned reply or None, comparison plan or None).
+        """
+        if self.router is None:
+            return self.llm, None, None
+        with trace_span(trace, "routing"):
+            decision = self.router.route(user_input)
+        if trace is not None:
+            for name, value in decision.as_dict().items():
+                trace.set(name, value)
+        if decision.route == "template":
+            return None, decision.template, None
+        if decision.route == "small" and self.small_llm is not None:
+            return self.small_llm, None, None
+        if decision.route == "compare":
+            return self.llm, None, self._plan_comparison(user_input, trace, memory)
+        return self.llm, None, None
+
+    def _plan_comparison(self, user_input, trace=None, memory=None):
+        """The products a comparison request names, or None to answer it in one call"""
+        plan = None
+        if self.comparer is not None:
+            with trace_span(trace, "compare_planning"):
+                plan = self.comparer.plan(user_input, memory)
+        if trace is not None:
+            if plan is None:
+                trace.set("route", "large")
+            else:
+                trace.set("compare_products", len(plan.names))
+        return plan
+
+    def _retrieve(self, user_input, trace=None):
+        """Catalog matches for the user's message as prompt context, or None"""
+        if self.catalog is None:
+            return None
+        with trace_span(trace, "retrieval"):
+            products = self.catalog.search(user_input)
+        if trace is not None:
+            trace.set("catalog_products", len(products))
+        if not products:
+            return None
+        return CATALOG_CONTEXT_PROMPT.format(products=format_products(products))
+
+    def _cache_key(self, session, user_input, llm, context=None):
+        history = session.memory.load_memory_variables({})["history"]
+        # The retrieved products are part of the prompt, so they are part of the key
+        return make_cache_key(llm.model_name, self.system_prompt,
+                              history + [context] if context else history,
+                              user_input)
+
+    def _cache_lookup(self, session, user_input, llm, context=None, trace=None):
+        """Return (cache key, cached reply or None)"""
+        if self.response_cache is None:
+            return None, None
+        with trace_span(trace, "cache_lookup"):
+            cache_key = self._cache_key(session, user_input, llm, context)
+            return cache_key, self.response_cache.get(cache_key)
+
+    def _finish_turn(self, session, result, cache_key, trace=None):
+        """Cache a complete reply and add it to the transcript"""
+        if cache_key and result.source == "model" and not result.interrupted:
+            self.response_cache.set(cache_key, result.text)
+        if trace is not None:
+            trace.set("source", result.source)
+            if result.source == "model":
+                trace.set("prompt_tokens", getattr(session.memory, "last_prompt_tokens", None))
+            trace.set("completion_tokens", count_tokens(result.text, self.llm))
+            if result.interrupted:
+                trace.set("error", str(result.error))
+        session.messages.append({"role": "assistant", "content": result.display_text})
+        session.last_active = time.time()
+
+    def _canned_reply(self, session, user_input, text, source, trace=None, result=None):
+        """Use text as the reply without a model call, and add the turn to memory"""
+        result = result or StreamResult()
+        result.source = source
+        result.text = text
+        with trace_span(trace, "memory_update"):
+            session.memory.save_context({"input": user_input}, {"response": text})
+        return result
+
+    def _turn_cancelled(self, reason, trace=None):
+        """Count a turn that was cancelled or timed out before its reply was used"""
+        if reason == TIMEOUT:
+            self.registry.inc("turns_timed_out_total", help="Chat turns that ran past LLM_TURN_TIMEOUT")
+        else:
+            self.registry.inc("turns_cancelled_total", help="Chat turns cancelled before their reply was used",
+                              reason=reason)
+        if trace is not None:
+            trace.set("cancelled", reason)
+
+    def respond(self, session, stream=True, on_token=None, trace=None):
+        """Answer the session's pending user message and return a StreamResult.
+
+        With stream=True, on_token(text_so_far) is called as tokens arrive.
+        Exceptions before any text was produced are raised and leave the
+        transcript unchanged. So does TurnCancelledError, raised if the turn
+        is superseded or cancelled (session.cancel_turn()) or times out; an
+        exception from on_token abandons the turn the same way.
+        """
+        user_input = self._pending_input(session)
+        cancel = session.start_turn(self.turn_timeout)
+        try:
+            llm, reply, plan = self._route(user_input, trace, session.memory)
+            cache_key = None
+            if reply is not None:
+                # Routine question: answer from a template without calling a model
+                cancel.check(deadline=False)
+                result = self._canned_reply(session, user_input, reply, "template", trace)
+            else:
+                context = plan.context if plan is not None else self._retrieve(user_input, trace)
+                cache_key, cached = self._cache_lookup(session, user_input, llm, context, trace)
+                if cached is not None:
+                    # Identical request seen before: skip the model round trip
+                    cancel.check(deadline=False)
+                    result = self._canned_reply(session, user_input, cached, "cache", trace)
+                elif plan is not None:
+                    # One short call per product at once, then a synthesis of the results
+                    result = self.comparer.respond(session.memory, user_input, plan,
+                                                   on_token=on_token if stream else None,
+                                                   trace=trace, cancel=cancel)
+                elif stream:
+                    result = stream_conversation(self._chain(session, llm), user_input, on_token=on_token,
+                                                 trace=trace, admission=self.admission, context=context,
+                                                 cancel=cancel)
+                else:
+                    result = complete_conversation(self._chain(session, llm), user_input, trace=trace,
+                                                   admission=self.admission, context=context, cancel=cancel)
+            self._finish_turn(session, result, cache_key, trace)
+            return result
+        except TurnCancelledError as e:
+            self._turn_cancelled(e.reason, trace)
+            raise
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # e.g. Streamlit stopping the script for a rerun
+                cancel.cancel(ABANDONED)
+                self._turn_cancelled(ABANDONED, trace)
+            raise
+        finally:
+            session.end_turn(cancel)
+
+    async def astream_response(self, session, result, trace=None):
+        """Answer the pending user message on the event loop, yielding each new token.
+
+        result (a StreamResult) receives the outcome. If the consumer stops
+        early, or the turn is cancelled or times out (TurnCancelledError),
+        nothing is added to the transcript or memory.
+        """
+        user_input = self._pending_input(session)
+        cancel = session.start_turn(self.turn_timeout)
+        try:
+            llm, reply, plan = await asyncio.to_thread(self._route, user_input, trace, session.memory)
+            cache_key = cached = None
+            if reply is None:
+                context = plan.context if plan is not None else await asyncio.to_thread(self._retrieve, user_input, trace)
+                cache_key, cached = await asyncio.to_thread(self._cache_lookup, session, user_input, llm,
+                                                            context, trace)
+            if reply is not None or cached is not None:
+                text, source = (reply, "template") if reply is not None else (cached, "cache")
+                yield text
+                cancel.check(deadline=False)
+                await asyncio.to_thread(self._canned_reply, session, user_input, text, source, trace, result)
+            elif plan is not None:
+                async for text in self.comparer.arespond(session.memory, result, user_input, plan,
+                                                         trace=trace, cancel=cancel):
+                    yield text
+            else:
+                async for token in astream_conversation(self._chain(session, llm), result, user_input, trace=trace,
+                                                        admission=self.admission, context=context, cancel=cancel):
+                    yield token
+            await asyncio.to_thread(self._finish_turn, session, result, cache_key, trace)
+        except TurnCancelledError as e:
+            self._turn_cancelled(e.reason, trace)
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away
+            cancel.cancel(ABANDONED)
+            self._turn_cancelled(ABANDONED, trace)
+            raise
+        finally:
+            session.end_turn(cancel)
+
+    # Persistence
+
+    def prefetch(self, user_input, force=False):
+        """Generate and cache the reply to user_input as the first turn of a new chat.
+
+        Goes through the same routing, retrieval and cache key as respond(),
+        so a user who sends the same first message gets the cached reply.
+        Returns "template" (answered without a model anyway), "cached" (a
+        reply is already cached and force is False) or "generated".
+        """
+        if self.response_cache is None:
+            raise ValueError("Prefetching needs a response cache")
+        session = self.new_session()
+        llm, reply, plan = self._route(user_input, memory=session.memory)
+        if reply is not None:
+            return "template"
+        context = plan.context if plan is not None else self._retrieve(user_input)
+        if force:
+            cache_key = self._cache_key(session, user_input, llm, context)
+        else:
+            cache_key, cached = self._cache_lookup(session, user_input, llm, context)
+            if cached is not None:
+                return "cached"
+        cancel = CancelToken(self.turn_timeout)
+        if plan is not None:
+            result = self.comparer.respond(session.memory, user_input, plan, cancel=cancel)
+        else:
+            result = complete_conversation(self._chain(session, llm), user_input, admission=self.admission,
+                                           context=context, cancel=cancel)
+        if result.error is not None:
+            raise result.error
+        self._finish_turn(session, result, cache_key)
+        return "generated"
+
+    def changed_context_summary(self, session):
+        """Return the memory's context summary if it changed since the last save, else None"""
+        memory = session.memory
+        if not hasattr(memory, "context_snapshot") or memory.summary == session.saved_summary:
+            return None
+        return memory.context_snapshot()
+
+    def save_failure(self, session):
+        """Error of a background save of the session that failed, or None.
+
+        The messages that write did not save count as unsaved again, so the
+        next save() writes them.
+        """
+        if not self.writer or not session.conversation_id:
+            return None
+        failure = self.writer.failure(session.conversation_id)
+        if failure is None:
+            return None
+        start, error = failure
+        session.saved_message_count = min(session.saved_message_count, start)
+        return error
+
+    def save(self, session):
+        """Save the session's conversation, appending to it if it was saved before"""
+        self.save_failure(session)
+        context = self.changed_context_summary(session)
+        if not session.conversation_id:
+            session.conversation_id = self.store.save_conversation(list(session.messages))
+            session.saved_message_count = len(session.messages)
+            if context is None:
+                return session.conversation_id
+        if self.writer:
+            # Continue in the fork if an earlier write hit a conflict
+            session.conversation_id = self.writer.fork_of(session.conversation_id) or session.conversation_id
+            self.writer.save(session.conversation_id, session.messages, session.saved_message_count, context)
+        else:
+            try:
+                self.store.update_conversation(session.conversation_id, session.messages,
+                                               session.saved_message_count, context)
+            except conversation_store.ConversationConflictError as e:
+                # Someone else wrote to this conversation: keep ours as a new one
+                session.conversation_id = self.store.save_conversation(list(session.messages))
+                if context is not None:
+                    self.store.save_context_summary(session.conversation_id, context)
+                logger.warning("%s; saved this session's copy as %s", e, session.conversation_id)
+        session.saved_message_count = len(session.messages)
+        if context is not None:
+            session.saved_summary = context["summary"]
+        return session.conversation_id
+
+    def wait_for_save(self, conversation_id, timeout=10):
+        """Make sure queued writes for a conversation have landed before reading or deleting it"""
+        if self.writer:
+            self.writer.wait(conversation_id, timeout=timeout)
+
+    def delete_conversation(self, conversation_id):
+        """Delete a saved conversation once its pending writes are done"""
+        self.wait_for_save(conversation_id)
+        self.store.delete_conversation(conversation_id)
+
+    def stats(self):
+        """Background writer, response cache, LLM admission, catalog, routing, comparison and prefetch statistics"""
+        return {
+            "background_save": self.writer.stats() if self.writer else None,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+            "llm_admission": self.admission.stats() if self.admission is not None else None,
+            "catalog": self.catalog.stats() if self.catalog is not None else None,
+            "router": self.router.stats() if self.router is not None else None,
+            "compare": self.comparer.stats() if self.comparer is not None else None,
+            "prefetch": self.prefetcher.stats() if self.prefetcher is not None else None,
+        }
+
+
+def create_engine(api_key, registry=REGISTRY, cache=True):
+    """Create the engine from environment settings and export its stats to registry.
+
+    cache=False leaves out the response cache, so every turn calls a model.
+    """
+    store = conversation_store.get_store()
+    small_llm = create_small_llm(api_key)
+    turn_timeout = float(os.getenv("LLM_TURN_TIMEOUT", "120"))
+    llm = create_llm(api_key)
+    admission = create_admission_controller()
+    catalog = create_catalog()
+    engine = ChatEngine(llm, store,
+                        writer=create_background_writer(store),
+                        response_cache=create_response_cache() if cache else None,
+                        admission=admission,
+                        catalog=catalog,
+                        router=create_router(small_model=small_llm is not None),
+                        small_llm=small_llm,
+                        comparer=create_comparer(llm, catalog, admission),
+                        turn_timeout=turn_timeout or None,
+                        registry=registry)
+
+    def collect():
+        gauges = {}
+        for prefix, stats in engine.stats().items():
+            if stats:
+                gauges.update(stats_gauges(prefix, stats))
+        return gauges
+
+    registry.add_collector(collect)
+    return engine
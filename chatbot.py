@@ -1,126 +1,133 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
-from streamlit_chat import message
 # from langchain.chat_models import ChatOpenAI
-from langchain_openai import ChatOpenAI
 # from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import ConversationChain
-from langchain.chains.conversation.memory import ConversationBufferWindowMemory
-from langchain_core.messages import SystemMessage
 
 import os
-import json
+import uuid
 import datetime
 from dotenv import load_dotenv
-from PIL import Image
+
+# Only light modules here: the chat engine (LangChain, OpenAI client, numpy)
+# is imported and built on a background thread, see warmup.py
+import conversation_store
+import transcript
+from cancellation import RESET, TurnCancelledError, TurnTimeoutError
+from llm_admission import LLMUnavailableError
+from metrics import REGISTRY, TurnTrace, configure_metrics, stats_gauges
+from prompts import (BUSY_MESSAGE, ERROR_MESSAGE, QUICK_ACTIONS, TIMEOUT_MESSAGE, WELCOME_BACK_MESSAGE,
+                     WELCOME_MESSAGE)
+from session_store import create_spilling_session_store
+from warmup import Warmup, warm_engine
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Timing spans for this rerun (see metrics.py)
+rerun_trace = TurnTrace()
+
+# Number of saved conversations shown per page in the sidebar
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+# Messages drawn live at the bottom of the chat, and how many more each "Show earlier" click loads
+TRANSCRIPT_WINDOW = int(os.getenv("TRANSCRIPT_WINDOW", str(transcript.TRANSCRIPT_WINDOW)))
+TRANSCRIPT_PAGE_SIZE = int(os.getenv("TRANSCRIPT_PAGE_SIZE", str(transcript.TRANSCRIPT_PAGE_SIZE)))
+
 # Configure API key from environment variables or Streamlit secrets
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY") or st.secrets.get("TOGETHER_API_KEY")
 
-# AI Commerce Chatbot System Prompt
-COMMERCE_SYSTEM_PROMPT = """You are an AI Commerce Assistant specialized in helping customers with online shopping, product recommendations, and e-commerce support. Your role is to:
-
-🛍️ **Core Responsibilities:**
-- Provide expert product recommendations based on customer needs and preferences
-- Assist with order inquiries, tracking, and returns/exchanges
-- Answer questions about product features, specifications, and comparisons
-- Help customers navigate the shopping experience and find the best deals
-- Provide information about shipping, delivery, and payment options
-- Assist with account management and customer service issues
-
-💡 **Expertise Areas:**
-- Product discovery and personalized recommendations
-- Price comparisons and deal identification
-- Inventory availability and restocking information
-- Technical product specifications and compatibility
-- Customer reviews and ratings analysis
-- Shopping cart optimization and checkout assistance
-- Post-purchase support and satisfaction
-
-🎯 **Communication Style:**
-- Be friendly, helpful, and professional
-- Ask clarifying questions to better understand customer needs
-- Provide detailed but concise product information
-- Use emojis appropriately to enhance the shopping experience
-- Offer multiple options when possible
-- Be proactive in suggesting complementary products
-- Always prioritize customer satisfaction
-
-🔧 **Guidelines:**
-- If you don't have specific product information, acknowledge this and suggest how the customer can find it
-- For order-specific issues, direct customers to contact customer service with their order number
-- Maintain customer privacy and never ask for sensitive information like passwords or full credit card numbers
-- Stay updated on current trends and seasonal shopping patterns
-- Provide honest assessments of products, including potential drawbacks
-
-Remember: Your goal is to make the customer's shopping experience as smooth and satisfying as possible while helping them find exactly what they need."""
+@st.cache_resource(show_spinner=False)
+def get_engine_warmup():
+    """Start building the chat engine on a background thread, once per process"""
+    return Warmup(lambda: warm_engine(TOGETHER_API_KEY), name="engine-warmup")
+
+@st.cache_resource(show_spinner=False)
+def get_markdown_cache():
+    """Rendered markdown per message, shared by all sessions of the process"""
+    return transcript.MarkdownCache()
+
+def get_engine():
+    """The chat engine (pooled LLM client, response cache, background writer), waiting for the warm-up if needed"""
+    try:
+        return get_engine_warmup().result()
+    except Exception:
+        # Don't cache a failed start; the next rerun tries again
+        get_engine_warmup.clear()
+        raise
+
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    """Every tab's chat session, kept within SESSION_MEMORY_MB per process (see session_store.py)"""
+    sessions = create_spilling_session_store(get_engine())
+    REGISTRY.add_collector(lambda: stats_gauges("sessions", sessions.stats()))
+    return sessions
+
+def set_chat_session(session):
+    """Make session this tab's conversation, forgetting the previous one"""
+    sessions = get_session_store()
+    previous = st.session_state.get("chat_session_id")
+    if previous and previous != session.session_id:
+        sessions.delete(previous)
+    sessions.put(session)
+    st.session_state.chat_session_id = session.session_id
 
 # Conversation History Functions
 def save_conversation(conversation_data, title=None):
-    """Save the current conversation to a file"""
-    if not os.path.exists("conversations"):
-        os.makedirs("conversations")
-    
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    if not title:
-        # Generate title from first user message
-        first_user_msg = next((msg["content"][:50] for msg in conversation_data if msg["role"] == "user"), "New Conversation")
-        title = first_user_msg.replace("/", "_").replace("\\", "_")[:30] + "..."
-    
-    filename = f"conversations/{timestamp}_{title.replace(' ', '_')}.json"
-    
-    conversation_info = {
-        "timestamp": timestamp,
-        "title": title,
-        "messages": conversation_data,
-        "created": datetime.datetime.now().isoformat()
-    }
-    
+    """Save the current conversation and return its id"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(conversation_info, f, indent=2, ensure_ascii=False)
-        return filename
+        return conversation_store.get_store().save_conversation(conversation_data, title)
     except Exception as e:
         st.error(f"Error saving conversation: {str(e)}")
         return None
 
-def load_conversations():
-    """Load all saved conversations"""
-    conversations = []
-    if not os.path.exists("conversations"):
-        return conversations
-    
+def save_current_conversation(session):
+    """Save the session's conversation, appending to it if it was saved before (in the background if enabled)"""
     try:
-        for filename in os.listdir("conversations"):
-            if filename.endswith(".json"):
-                with open(f"conversations/{filename}", 'r', encoding='utf-8') as f:
-                    conversation = json.load(f)
-                    conversation["filename"] = filename
-                    conversations.append(conversation)
-        
-        # Sort by timestamp (newest first)
-        conversations.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        engine = get_engine()
+        error = engine.save_failure(session)
+        if error:
+            st.warning(f"⚠️ The last auto-save failed ({error}); saving again.")
+        engine.save(session)
+    except Exception as e:
+        st.error(f"Error saving conversation: {str(e)}")
+
+def load_conversations(limit=None, offset=0, title_prefix=None):
+    """Load one page of saved conversation metadata"""
+    try:
+        return conversation_store.get_store().list_conversations(limit=limit, offset=offset, title_prefix=title_prefix)
     except Exception as e:
         st.error(f"Error loading conversations: {str(e)}")
-    
-    return conversations
+        return []
 
-def load_conversation(filename):
-    """Load a specific conversation"""
+def count_conversations(title_prefix=None):
+    """Count saved conversations"""
     try:
-        with open(f"conversations/{filename}", 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return conversation_store.get_store().count_conversations(title_prefix=title_prefix)
+    except Exception as e:
+        st.error(f"Error loading conversations: {str(e)}")
+        return 0
+
+def search_conversations(query):
+    """Search saved conversations by message content"""
+    try:
+        return conversation_store.get_store().search_conversations(query, limit=10)
+    except Exception as e:
+        st.error(f"Error searching conversations: {str(e)}")
+        return []
+
+def load_conversation(conversation_id):
+    """Load a specific conversation as a chat session, with its memory rebuilt"""
+    try:
+        # A session of its own, even if another tab has the same conversation open
+        return get_engine().open_session(conversation_id, session_id=uuid.uuid4().hex)
     except Exception as e:
         st.error(f"Error loading conversation: {str(e)}")
         return None
 
-def delete_conversation(filename):
-    """Delete a conversation file"""
+def delete_conversation(conversation_id):
+    """Delete a saved conversation"""
     try:
-        os.remove(f"conversations/{filename}")
+        get_engine().delete_conversation(conversation_id)
         return True
     except Exception as e:
         st.error(f"Error deleting conversation: {str(e)}")
@@ -139,48 +146,70 @@ def format_conversation_title(conversation):
             pass
     return title
 
+def conversation_date_group(conversation, today=None):
+    """Date group heading for a conversation in the history sidebar"""
+    try:
+        day = datetime.datetime.strptime(conversation.get("timestamp", ""), "%Y%m%d_%H%M%S").date()
+    except ValueError:
+        return "Older"
+    days_ago = ((today or datetime.date.today()) - day).days
+    if days_ago <= 0:
+        return "Today"
+    if days_ago == 1:
+        return "Yesterday"
+    if days_ago < 7:
+        return "Previous 7 Days"
+    if days_ago < 30:
+        return "Previous 30 Days"
+    return day.strftime("%B %Y")
+
+def display_conversation_entry(conv):
+    """Show load and delete buttons for one saved conversation"""
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        conv_title = format_conversation_title(conv)
+        if st.button(f"💬 {conv_title}", key=f"load_conv_{conv['id']}", help=conv.get("snippet")):
+            # Load the selected conversation, rebuilding memory from its messages and saved summary
+            loaded_session = load_conversation(conv["id"])
+            if loaded_session:
+                set_chat_session(loaded_session)
+                st.success(f"💬 Loaded: {conv['title']}")
+                st.rerun()
+    
+    with col2:
+        if st.button("🗑️", key=f"del_conv_{conv['id']}", help="Delete conversation"):
+            if delete_conversation(conv["id"]):
+                st.success("🗑️ Deleted!")
+                st.rerun()
+
 # Initialize session state variables
-if 'current_conversation_file' not in st.session_state:
-    st.session_state.current_conversation_file = None
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
 
 if 'auto_save' not in st.session_state:
     st.session_state.auto_save = True
-if 'buffer_memory' not in st.session_state:
-    st.session_state.buffer_memory = ConversationBufferWindowMemory(k=5, return_messages=True)
-
-if "messages" not in st.session_state.keys(): # Initialize the chat message history
-    st.session_state.messages = [
-        {"role": "assistant", "content": "🛍️ Welcome to your AI Commerce Assistant! I'm here to help you with product recommendations, shopping questions, order support, and finding the best deals. What can I help you shop for today?"}
-    ]
+if 'stream_responses' not in st.session_state:
+    st.session_state.stream_responses = os.getenv("STREAM_RESPONSES", "true").lower() != "false"
+if 'show_debug_panel' not in st.session_state:
+    st.session_state.show_debug_panel = os.getenv("DEBUG_PANEL", "false").lower() == "true"
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
 
-# Initialize ChatOpenAI and ConversationChain
+# Initialize the chat engine and this session's conversation
 if not TOGETHER_API_KEY:
     st.error("❌ TOGETHER_API_KEY not found! Please set it in your environment variables or Streamlit secrets.")
     st.stop()
 
-try:
-    # llm = ChatOpenAI(model_name="gpt-4o-mini")
-    # llm = ChatGoogleGenerativeAI(model = "gemini-pro")
-    llm = ChatOpenAI(
-        model="meta-llama/Llama-3.2-90B-Vision-Instruct-Turbo",
-        openai_api_key=TOGETHER_API_KEY,
-        openai_api_base="https://api.together.xyz/v1"
-    )
-    
-    # Create conversation chain with system prompt
-    conversation = ConversationChain(
-        memory=st.session_state.buffer_memory, 
-        llm=llm
-    )
-    
-    # Add system message to set the AI's role (this will be included in the conversation context)
-    if not hasattr(st.session_state, 'system_prompt_added'):
-        st.session_state.buffer_memory.chat_memory.add_message(SystemMessage(content=COMMERCE_SYSTEM_PROMPT))
-        st.session_state.system_prompt_added = True
-        
-except Exception as e:
-    st.error(f"❌ Error initializing chatbot: {str(e)}")
-    st.stop()
+@st.cache_resource(show_spinner=False)
+def get_metrics_export():
+    """Start the metrics log, endpoint and file export once per process"""
+    return configure_metrics()
+
+metrics_export = get_metrics_export()
+
+# Start building the engine now; the page shell below renders meanwhile
+engine_warmup = get_engine_warmup()
 
 # Create user interface with logo
 def display_sidebar_logo():
@@ -192,8 +221,7 @@ def display_sidebar_logo():
     for logo_path in logo_files:
         if os.path.exists(logo_path):
             try:
-                logo = Image.open(logo_path)
-                st.image(logo, width=150)
+                st.image(logo_path, width=150)
                 logo_found = True
                 break
             except Exception as e:
@@ -280,8 +308,7 @@ if title_logo:
     # Display title with small logo
     col1, col2 = st.columns([0.1, 0.9])
     with col1:
-        logo = Image.open(title_logo)
-        st.image(logo, width=50)
+        st.image(title_logo, width=50)
     with col2:
         st.markdown("# AI Commerce Assistant")
         st.markdown("### 🤖 Your intelligent shopping companion powered by AI")
@@ -290,6 +317,30 @@ else:
     st.title("🛒 AI Commerce Assistant")
     st.subheader("🤖 Your intelligent shopping companion powered by AI")
 
+try:
+    if engine_warmup.ready():
+        engine = get_engine()
+    else:
+        # First session of a fresh process: show the welcome message while the engine finishes loading
+        warmup_placeholder = st.empty()
+        with warmup_placeholder.container():
+            with st.chat_message("assistant"):
+                st.write(WELCOME_MESSAGE)
+            with st.spinner("⏳ Warming up the assistant..."), rerun_trace.span("engine_warmup"):
+                engine = get_engine()
+        warmup_placeholder.empty()
+    
+    # Per-session transcript and memory with the system prompt pinned (see chat_engine.py). The
+    # session lives in the process-wide session store, which reloads it if it was moved out of memory
+    chat = get_session_store().get(st.session_state.get("chat_session_id"))
+    if chat is None:
+        chat = engine.new_session()
+        set_chat_session(chat)
+        
+except Exception as e:
+    st.error(f"❌ Error initializing chatbot: {str(e)}")
+    st.stop()
+
 # Add helpful sidebar with commerce features
 with st.sidebar:
     # Display logo at top of sidebar
@@ -298,25 +349,10 @@ with st.sidebar:
     st.markdown("---")  # Separator line
     st.header("🛍️ Quick Actions")
     
-    if st.button("🔍 Product Search"):
-        st.session_state.messages.append({"role": "user", "content": "I'm looking for product recommendations. Can you help me find something specific?"})
-        st.rerun()
-    
-    if st.button("📦 Order Support"):
-        st.session_state.messages.append({"role": "user", "content": "I need help with my order status or tracking information."})
-        st.rerun()
-    
-    if st.button("💰 Find Deals"):
-        st.session_state.messages.append({"role": "user", "content": "What are the best deals and discounts available right now?"})
-        st.rerun()
-    
-    if st.button("⭐ Product Compare"):
-        st.session_state.messages.append({"role": "user", "content": "I want to compare different products. Can you help me?"})
-        st.rerun()
-    
-    if st.button("🔄 Returns & Exchanges"):
-        st.session_state.messages.append({"role": "user", "content": "I need information about returns, exchanges, or refund policies."})
-        st.rerun()
+    for label, prompt in QUICK_ACTIONS:
+        if st.button(label):
+            chat.add_user_message(prompt)
+            st.rerun()
     
     st.markdown("---")
     
@@ -326,64 +362,88 @@ with st.sidebar:
     # New conversation button
     if st.button("🆕 New Chat"):
         # Save current conversation if it has messages
-        if len(st.session_state.messages) > 1:  # More than just welcome message
-            save_conversation(st.session_state.messages)
+        if len(chat.messages) > 1:  # More than just welcome message
+            save_current_conversation(chat)
         
-        # Reset to new conversation
-        st.session_state.messages = [
-            {"role": "assistant", "content": "🛍️ Welcome to your AI Commerce Assistant! I'm here to help you with product recommendations, shopping questions, order support, and finding the best deals. What can I help you shop for today?"}
-        ]
-        st.session_state.buffer_memory.clear()
-        st.session_state.buffer_memory.chat_memory.add_message(SystemMessage(content=COMMERCE_SYSTEM_PROMPT))
-        st.session_state.current_conversation_file = None
+        # Reset to new conversation with fresh memory; a reply still on its way is dropped
+        chat.cancel_turn(RESET)
+        set_chat_session(engine.new_session(WELCOME_MESSAGE))
         st.rerun()
     
     # Auto-save toggle
     st.session_state.auto_save = st.checkbox("🔄 Auto-save conversations", value=st.session_state.auto_save)
+    chat.auto_save = st.session_state.auto_save
+    
+    # Streaming toggle
+    st.session_state.stream_responses = st.checkbox("⚡ Stream responses", value=st.session_state.stream_responses)
+    
+    # Per-session performance panel (shown at the bottom of the sidebar)
+    st.session_state.show_debug_panel = st.checkbox("🐞 Show performance stats", value=st.session_state.show_debug_panel)
     
     # Save current conversation manually
     if st.button("💾 Save Current Chat"):
-        if len(st.session_state.messages) > 1:
-            filename = save_conversation(st.session_state.messages)
-            if filename:
-                st.session_state.current_conversation_file = filename
+        if len(chat.messages) > 1:
+            conversation_id = save_conversation(list(chat.messages))
+            if conversation_id:
+                chat.conversation_id = conversation_id
+                chat.saved_message_count = len(chat.messages)
                 st.success("💾 Conversation saved!")
         else:
             st.warning("No conversation to save!")
     
-    # Load conversations
-    conversations = load_conversations()
+    # Search saved conversations by content
+    search_query = st.text_input("🔎 Search chats", placeholder="e.g. laptops under $800")
     
-    if conversations:
-        st.markdown("**📚 Saved Conversations:**")
+    if search_query:
+        with rerun_trace.span("search_conversations"):
+            conversations = search_conversations(search_query)
+        if conversations:
+            st.markdown("**🔎 Search Results:**")
+            for conv in conversations:
+                display_conversation_entry(conv)
+        else:
+            st.markdown("*No matching conversations*")
+    else:
+        # Only one page of metadata is fetched per rerun, however many chats are stored
+        title_filter = st.text_input("🔤 Filter by title", key="history_title_filter",
+                                     on_change=lambda: st.session_state.update(history_page=0))
+        with rerun_trace.span("load_conversations"):
+            total_conversations = count_conversations(title_filter)
+            page_count = max(1, -(-total_conversations // HISTORY_PAGE_SIZE))
+            st.session_state.history_page = min(st.session_state.history_page, page_count - 1)
+            conversations = load_conversations(limit=HISTORY_PAGE_SIZE,
+                                               offset=st.session_state.history_page * HISTORY_PAGE_SIZE,
+                                               title_prefix=title_filter)
         
-        for i, conv in enumerate(conversations[:10]):  # Show last 10 conversations
-            col1, col2 = st.columns([3, 1])
+        if conversations:
+            st.markdown("**📚 Saved Conversations:**")
             
-            with col1:
-                conv_title = format_conversation_title(conv)
-                if st.button(f"💬 {conv_title}", key=f"load_conv_{i}"):
-                    # Load the selected conversation
-                    loaded_conv = load_conversation(conv["filename"])
-                    if loaded_conv:
-                        st.session_state.messages = loaded_conv["messages"]
-                        st.session_state.current_conversation_file = conv["filename"]
-                        # Reset memory and rebuild from loaded messages
-                        st.session_state.buffer_memory.clear()
-                        st.session_state.buffer_memory.chat_memory.add_message(SystemMessage(content=COMMERCE_SYSTEM_PROMPT))
-                        st.success(f"💬 Loaded: {conv['title']}")
-                        st.rerun()
+            current_group = None
+            for conv in conversations:
+                group = conversation_date_group(conv)
+                if group != current_group:
+                    st.caption(group)
+                    current_group = group
+                display_conversation_entry(conv)
             
-            with col2:
-                if st.button("🗑️", key=f"del_conv_{i}", help="Delete conversation"):
-                    if delete_conversation(conv["filename"]):
-                        st.success("🗑️ Deleted!")
+            if page_count > 1:
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col1:
+                    if st.button("◀", key="history_newer", help="Newer conversations",
+                                 disabled=st.session_state.history_page == 0):
+                        st.session_state.history_page -= 1
                         st.rerun()
-        
-        if len(conversations) > 10:
-            st.markdown(f"*... and {len(conversations) - 10} more conversations*")
-    else:
-        st.markdown("*No saved conversations yet*")
+                with col2:
+                    st.markdown(f"*Page {st.session_state.history_page + 1} of {page_count}*")
+                with col3:
+                    if st.button("▶", key="history_older", help="Older conversations",
+                                 disabled=st.session_state.history_page >= page_count - 1):
+                        st.session_state.history_page += 1
+                        st.rerun()
+        elif title_filter:
+            st.markdown("*No matching conversations*")
+        else:
+            st.markdown("*No saved conversations yet*")
     
     st.markdown("---")
     st.markdown("### 💡 Tips:")
@@ -396,50 +456,133 @@ with st.sidebar:
 # Main chat interface
 
 if prompt := st.chat_input("Ask me about products, orders, deals, or any shopping questions..."): # Prompt for user input and save to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    chat.add_user_message(prompt)
 
-for message in st.session_state.messages: # Display the prior chat messages
-    with st.chat_message(message["role"]):
-        st.write(message["content"])
+with rerun_trace.span("render_history"):
+    # Draw only the latest messages; older ones load a page at a time on request
+    if st.session_state.get("transcript_pages", (None, 0))[0] != chat.session_id:
+        st.session_state.transcript_pages = (chat.session_id, 0)
+    transcript_pages = st.session_state.transcript_pages[1]
+    first_shown = transcript.visible_start(len(chat.messages), TRANSCRIPT_WINDOW, TRANSCRIPT_PAGE_SIZE,
+                                           transcript_pages)
+    if first_shown or transcript_pages:
+        col1, col2 = st.columns(2)
+        with col1:
+            if first_shown and st.button(f"⬆️ Show earlier messages ({first_shown} hidden)", key="transcript_earlier"):
+                st.session_state.transcript_pages = (chat.session_id, transcript_pages + 1)
+                st.rerun()
+        with col2:
+            if transcript_pages and st.button("⬇️ Hide earlier messages", key="transcript_collapse"):
+                st.session_state.transcript_pages = (chat.session_id, 0)
+                st.rerun()
+    markdown_cache = get_markdown_cache()
+    for message in chat.messages[first_shown:]: # Display the prior chat messages
+        with st.chat_message(message["role"]):
+            st.markdown(markdown_cache.render(message))
+    rerun_trace.set("rendered_messages", len(chat.messages) - first_shown)
 
 # If last message is not from assistant, generate a new response
-if st.session_state.messages[-1]["role"] != "assistant":
+if chat.pending_input is not None:
+    rerun_trace.turn = True
     with st.chat_message("assistant"):
-        with st.spinner("🛍️ Finding the best solution for you..."):
-            try:
-                response = conversation.predict(input=prompt)
-                st.write(response)
-                message = {"role": "assistant", "content": response}
-                st.session_state.messages.append(message)  # Add response to message history
-                
-                # Auto-save conversation if enabled
-                if st.session_state.auto_save and len(st.session_state.messages) > 2:
-                    if st.session_state.current_conversation_file:
-                        # Update existing conversation
-                        save_conversation(st.session_state.messages, 
-                                        st.session_state.current_conversation_file.split('_', 1)[1].replace('.json', ''))
-                    else:
-                        # Save new conversation
-                        filename = save_conversation(st.session_state.messages)
-                        if filename:
-                            st.session_state.current_conversation_file = filename
-                            
-            except Exception as e:
-                st.error(f"❌ Error generating response: {str(e)}")
-                error_message = {"role": "assistant", "content": "🛒 I apologize, but I'm having trouble processing your request right now. Please try again, and I'll be happy to assist you with your shopping needs!"}
-                st.session_state.messages.append(error_message)
+        placeholder = st.empty()
+        try:
+            if st.session_state.stream_responses:
+                # Render tokens as they arrive instead of waiting for the full reply. A click or new
+                # message meanwhile stops this run at the next token, which aborts the model request
+                placeholder.markdown("🛍️ Finding the best solution for you...")
+                result = engine.respond(chat, stream=True,
+                                        on_token=lambda text: placeholder.markdown(transcript.to_markdown(text) + "▌"),
+                                        trace=rerun_trace)
+            else:
+                with st.spinner("🛍️ Finding the best solution for you..."):
+                    result = engine.respond(chat, stream=False, trace=rerun_trace)
+            with rerun_trace.span("render"):
+                placeholder.markdown(transcript.to_markdown(result.display_text))
+            if result.interrupted:
+                st.error(f"❌ Response stream interrupted: {str(result.error)}")
+            
+            # Auto-save conversation if enabled
+            if st.session_state.auto_save and len(chat.messages) > 2:
+                with rerun_trace.span("save"):
+                    save_current_conversation(chat)
+        except LLMUnavailableError as e:
+            # Over capacity or the model is down: answer at once instead of queueing forever
+            rerun_trace.set("error", str(e))
+            st.warning(f"⏳ {str(e)}")
+            chat.messages.append({"role": "assistant", "content": BUSY_MESSAGE})
+        except TurnTimeoutError as e:
+            # Ran past LLM_TURN_TIMEOUT: the request was aborted and nothing was remembered
+            rerun_trace.set("error", str(e))
+            st.warning(f"⏳ {str(e)}")
+            chat.messages.append({"role": "assistant", "content": TIMEOUT_MESSAGE})
+        except TurnCancelledError:
+            # Superseded or reset while waiting for the model: the reply belongs to no conversation
+            placeholder.empty()
+        except Exception as e:
+            rerun_trace.set("error", str(e))
+            st.error(f"❌ Error generating response: {str(e)}")
+            error_message = {"role": "assistant", "content": ERROR_MESSAGE}
+            chat.messages.append(error_message)
 
 # Clear chat button
 if st.button("🗑️ Clear Chat History"):
     # Save current conversation before clearing if it has content
-    if len(st.session_state.messages) > 1 and st.session_state.auto_save:
-        save_conversation(st.session_state.messages)
+    if len(chat.messages) > 1 and st.session_state.auto_save:
+        save_current_conversation(chat)
     
-    st.session_state.messages = [
-        {"role": "assistant", "content": "🛍️ Welcome back! I'm here to help you with product recommendations, shopping questions, order support, and finding the best deals. What can I help you shop for today?"}
-    ]
-    st.session_state.buffer_memory.clear()
-    st.session_state.current_conversation_file = None
-    # Re-add system prompt
-    st.session_state.buffer_memory.chat_memory.add_message(SystemMessage(content=COMMERCE_SYSTEM_PROMPT))
+    # Fresh conversation and memory with the system prompt; a reply still on its way is dropped
+    chat.cancel_turn(RESET)
+    set_chat_session(engine.new_session(WELCOME_BACK_MESSAGE))
     st.rerun()
+
+# Close this rerun's trace: structured log, process-wide histograms, optional file export
+rerun_trace.session_id = st.session_state.session_id
+rerun_trace.conversation_id = chat.conversation_id
+rerun_record = rerun_trace.finish()
+if rerun_trace.turn:
+    st.session_state.last_turn_stats = rerun_record
+if metrics_export["file"]:
+    try:
+        REGISTRY.write(metrics_export["file"])
+    except OSError as e:
+        st.warning(f"Could not write metrics file: {str(e)}")
+
+if st.session_state.show_debug_panel:
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("### 🐞 Performance")
+        last_turn = st.session_state.get("last_turn_stats")
+        if last_turn:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("First token", f"{last_turn.get('llm_first_token_ms', 0):.0f} ms")
+            col2.metric("LLM total", f"{last_turn.get('llm_ms', 0):.0f} ms")
+            col3.metric("Prompt tokens", last_turn.get("prompt_tokens", "–"))
+            st.caption("Last turn")
+            st.json(last_turn, expanded=False)
+        else:
+            st.caption("No turns yet in this session")
+        st.caption("This rerun")
+        st.json(rerun_record, expanded=False)
+        engine_stats = engine.stats()
+        if engine_stats["background_save"]:
+            st.caption("Background save")
+            st.json(engine_stats["background_save"], expanded=False)
+        if engine_stats["response_cache"]:
+            st.caption("Response cache")
+            st.json(engine_stats["response_cache"], expanded=False)
+        if engine_stats["llm_admission"]:
+            st.caption("LLM admission")
+            st.json(engine_stats["llm_admission"], expanded=False)
+        if engine_stats["catalog"]:
+            st.caption("Product catalog")
+            st.json(engine_stats["catalog"], expanded=False)
+        if engine_stats["router"]:
+            st.caption("Intent routing")
+            st.json(engine_stats["router"], expanded=False)
+        st.caption("Chat sessions in this process")
+        st.json(get_session_store().stats(), expanded=False)
+        st.caption("Transcript markdown cache")
+        st.json(get_markdown_cache().stats(), expanded=False)
+        if metrics_export["server"]:
+            st.caption(f"Prometheus metrics on port {metrics_export['server'].server_address[1]} at /metrics")
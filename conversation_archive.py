@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed archive tier for the JSON conversation store.
+
+Old conversations are moved out of conversations/ into append-only segment
+files under conversations/.archive/. Each conversation is written as one
+independent gzip member, and a SQLite seek index (index.db) records its
+segment, byte offset and length, so opening an archived chat reads and
+decompresses only that member. Segments roll over at ARCHIVE_SEGMENT_BYTES.
+
+The hot folder and its metadata index never look at the archive, so
+listing speed does not depend on how much has been archived.
+conversation_store.load_conversation() falls back to the archive for ids
+that are not in the hot folder, and saving more messages to an archived
+chat moves it back to the hot folder first.
+
+archive_old_conversations() is the archival job and enforce_retention()
+drops archived conversations by age, count or total size; run both with
+archive_conversations.py (e.g. from cron).
+"""
+import os
+import gzip
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+import conversation_store
+
+ARCHIVE_DIR = os.path.join(conversation_store.CONVERSATIONS_DIR, ".archive")
+ARCHIVE_SEGMENT_BYTES = 64 * 1024 * 1024
+VACUUM_DEAD_RATIO = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived (
+    id TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_timestamp ON archived(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_archived_segment ON archived(segment);
+"""
+
+
+class ConversationArchive:
+    """Gzip segment files plus a SQLite seek index"""
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_bytes=ARCHIVE_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connect(self):
+        """Return this thread's index connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _current_segment(self):
+        """Newest segment, or a new one once it has reached segment_bytes"""
+        segments = sorted(name for name in os.listdir(self.directory) if name.startswith("segment-"))
+        if segments and os.path.getsize(self._segment_path(segments[-1])) < self.segment_bytes:
+            return segments[-1]
+        number = int(segments[-1][8:14]) + 1 if segments else 1
+        return f"segment-{number:06d}.gz"
+
+    def add(self, conversation_id, conversation, context=None):
+        """Append a conversation to the current segment and index it"""
+        record = dict(conversation, id=conversation_id, context=context)
+        member = gzip.compress(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._write_lock:
+            segment = self._current_segment()
+            with open(self._segment_path(segment), 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+                f.flush()
+                os.fsync(f.fileno())
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO archived VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (conversation_id, segment, offset, len(member), conversation.get("title", "Untitled"),
+                     conversation.get("timestamp", ""), conversation.get("created", ""),
+                     len(conversation.get("messages", [])), datetime.datetime.now().isoformat()))
+
+    def _read_record(self, segment, offset, length):
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    def load(self, conversation_id):
+        """Return the archived record (conversation plus "context"), or None"""
+        row = self._connect().execute(
+            "SELECT segment, offset, length FROM archived WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        return self._read_record(*row)
+
+    def __contains__(self, conversation_id):
+        return self._connect().execute(
+            "SELECT 1 FROM archived WHERE id = ?", (conversation_id,)).fetchone() is not None
+
+    def delete(self, conversation_id):
+        """Drop a conversation from the index; its bytes are reclaimed by vacuum()"""
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute("DELETE FROM archived WHERE id = ?", (conversation_id,)).rowcount > 0
+
+    def list(self, limit=None, offset=0):
+        """One page of archived conversation metadata, newest first"""
+        rows = self._connect().execute(
+            "SELECT id, title, timestamp, created, message_count, length FROM archived "
+            "ORDER BY timestamp DESC, id LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset)).fetchall()
+        return [{"id": r[0], "filename": f"{r[0]}.json", "title": r[1], "timestamp": r[2], "created": r[3],
+                 "message_count": r[4], "size": r[5], "archived": True} for r in rows]
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+
+    def enforce_retention(self, max_age_days=None, max_count=None, max_bytes=None):
+        """Delete the oldest archived conversations until every given limit holds.
+
+        Age is measured from the conversation's timestamp, and size is the
+        compressed size. Returns the number of conversations deleted.
+        """
+        conn = self._connect()
+        doomed = set()
+        if max_age_days is not None:
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime("%Y%m%d_%H%M%S")
+            doomed.update(r[0] for r in conn.execute("SELECT id FROM archived WHERE timestamp < ?", (cutoff,)))
+        if max_count is not None or max_bytes is not None:
+            rows = conn.execute("SELECT id, length FROM archived ORDER BY timestamp, id").fetchall()
+            live = [r for r in rows if r[0] not in doomed]
+            count, total = len(live), sum(length for _, length in live)
+            for conversation_id, length in live:
+                if (max_count is None or count <= max_count) and (max_bytes is None or total <= max_bytes):
+                    break
+                doomed.add(conversation_id)
+                count -= 1
+                total -= length
+        with self._write_lock:
+            with conn:
+                conn.executemany("DELETE FROM archived WHERE id = ?", [(i,) for i in doomed])
+        return len(doomed)
+
+    def vacuum(self, dead_ratio=VACUUM_DEAD_RATIO):
+        """Reclaim space from deleted conversations.
+
+        Segments with no live records are removed. Segments where more
+        than dead_ratio of the bytes belong to deleted records are
+        rewritten with only the live members (copied without recompressing).
+        Returns the number of bytes freed.
+        """
+        freed = 0
+        with self._write_lock:
+            conn = self._connect()
+            live_bytes = dict(conn.execute("SELECT segment, SUM(length) FROM archived GROUP BY segment"))
+            for segment in sorted(name for name in os.listdir(self.directory) if name.startswith("segment-")):
+                path = self._segment_path(segment)
+                size = os.path.getsize(path)
+                live = live_bytes.get(segment, 0)
+                if live == 0:
+                    os.remove(path)
+                    freed += size
+                elif (size - live) / size > dead_ratio:
+                    rows = conn.execute("SELECT id, offset, length FROM archived WHERE segment = ? ORDER BY offset",
+                                        (segment,)).fetchall()
+                    tmp_path = f"{path}.tmp"
+                    moved = []
+                    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                        for conversation_id, offset, length in rows:
+                            src.seek(offset)
+                            moved.append((dst.tell(), conversation_id))
+                            dst.write(src.read(length))
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    with conn:
+                        os.replace(tmp_path, path)
+                        conn.executemany("UPDATE archived SET offset = ? WHERE id = ?", moved)
+                    freed += size - os.path.getsize(path)
+        return freed
+
+    def stats(self):
+        """Return the number of archived conversations and their compressed and on-disk size"""
+        count, live = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM archived").fetchone()
+        segments = [name for name in os.listdir(self.directory) if name.startswith("segment-")]
+        return {
+            "conversations": count,
+            "live_bytes": live,
+            "disk_bytes": sum(os.path.getsize(self._segment_path(name)) for name in segments),
+            "segments": len(segments),
+        }
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive(create=True):
+    """Return the process-wide archive, or None if there is none and create is False"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            if not create and not os.path.exists(os.path.join(ARCHIVE_DIR, "index.db")):
+                return None
+            _archive = ConversationArchive(
+                segment_bytes=int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(ARCHIVE_SEGMENT_BYTES))))
+        return _archive
+
+
+def _last_modified(entry):
+    """Last write to a hot conversation: its snapshot or, if newer, its journal"""
+    mtime = entry["mtime"] / 1e9
+    try:
+        mtime = max(mtime, os.path.getmtime(conversation_store._journal_path(entry["filename"])))
+    except OSError:
+        pass
+    return mtime
+
+
+def archive_old_conversations(older_than_days, archive=None, dry_run=False):
+    """Move conversations not modified for older_than_days into the archive; returns how many"""
+    if not os.path.exists(conversation_store.CONVERSATIONS_DIR):
+        return 0
+    archive = archive or get_archive()
+    cutoff = time.time() - older_than_days * 86400
+    moved = 0
+    for entry in list(conversation_store.get_index()["entries"].values()):
+        if _last_modified(entry) >= cutoff:
+            continue
+        if not dry_run:
+            filename = entry["filename"]
+            # Held from the check to the delete, so a message saved meanwhile
+            # keeps the conversation in the folder instead of being lost
+            with conversation_store._conversation_lock(filename):
+                try:
+                    mtime = os.stat(conversation_store._conversation_path(filename)).st_mtime_ns
+                except FileNotFoundError:
+                    continue  # Deleted since the index was read
+                if _last_modified({"filename": filename, "mtime": mtime}) >= cutoff:
+                    continue
+                conversation = conversation_store.load_conversation(filename)
+                archive.add(entry["id"], conversation, conversation_store.load_context_summary(filename))
+                conversation_store.delete_conversation(filename)
+        moved += 1
+    return moved
+
+
+def restore_conversation(conversation_id, archive=None):
+    """Move an archived conversation back to the hot folder; returns False if it is not archived"""
+    archive = archive or get_archive(create=False)
+    record = archive.load(conversation_id) if archive is not None else None
+    if record is None:
+        return False
+    context = record.pop("context", None)
+    record.pop("id", None)
+    filename = conversation_store._filename(conversation_id)
+    path = conversation_store._conversation_path(filename)
+    os.makedirs(conversation_store.CONVERSATIONS_DIR, exist_ok=True)
+    conversation_store._atomic_write(path, json.dumps(record, indent=2, ensure_ascii=False))
+    if context is not None:
+        conversation_store.save_context_summary(filename, context)
+    conversation_store._update_index_entry(filename, conversation_store._index_entry(filename, record, path))
+    archive.delete(conversation_id)
+    return True
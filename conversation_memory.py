@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Conversation memory for the AI Commerce Chatbot.
+
+TokenBudgetMemory replaces the fixed k=5 turn window with a token budget:
+
+- the system prompt is pinned and never evicted
+- recent turns are kept verbatim while they fit in the budget
+- older turns are folded into a rolling summary; each update only
+  summarizes the turns being evicted plus the previous summary, so the
+  full history is never re-summarized
+- the summary call goes through the LLM admission controller; if it
+  fails, the turn still succeeds and the evicted turns wait in
+  pending_summary for the next attempt
+
+MEMORY_MODE=window keeps the previous ConversationBufferWindowMemory.
+
+When a saved conversation is loaded, rehydrate_memory() rebuilds memory from
+the stored messages plus the context summary saved alongside them, without
+calling the LLM.
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain.chains.conversation.memory import ConversationBufferWindowMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBudgetMemory(BaseChatMemory):
+    """Pinned system prompt + rolling summary + recent turns within a token budget"""
+
+    llm: BaseLanguageModel
+    # llm_admission.AdmissionController for the summary calls, or None
+    admission: Any = None
+    system_prompt: str = ""
+    max_token_limit: int = 2000
+    summary: str = ""
+    memory_key: str = "history"
+    return_messages: bool = True
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    # Token count of the history plus input from the last load_memory_variables()
+    last_prompt_tokens: int = 0
+    # Older messages that are not in the summary yet: restored from storage,
+    # or evicted while a summary call failed; folded in on the next prune()
+    pending_summary: List[BaseMessage] = []
+    # Transcript index of each message in pending_summary, then in the buffer
+    message_positions: List[int] = []
+    # Number of leading transcript messages the summary covers
+    summarized_count: int = 0
+    # Transcript index of the user message of the turn being answered, set
+    # by ChatEngine; None: the turn follows the last one in memory
+    turn_position: Optional[int] = None
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def count_tokens(self, messages: List[BaseMessage]) -> int:
+        """Count tokens with the model's tokenizer, or estimate if unavailable"""
+        if not messages:
+            return 0
+        try:
+            return self.llm.get_num_tokens_from_messages(messages)
+        except Exception:
+            # Roughly four characters per token, plus per-message overhead
+            return sum(len(str(msg.content)) // 4 + 4 for msg in messages)
+
+    def _pinned_messages(self) -> List[BaseMessage]:
+        messages = []
+        if self.system_prompt:
+            messages.append(SystemMessage(content=self.system_prompt))
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}"))
+        return messages
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = self._pinned_messages() + self.chat_memory.messages
+        self.last_prompt_tokens = self.count_tokens(messages)
+        user_input = [HumanMessage(content=v) for v in inputs.values() if isinstance(v, str) and v]
+        self.last_prompt_tokens += self.count_tokens(user_input)
+
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(
+            messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        position = self.turn_position
+        if position is None:
+            position = self.message_positions[-1] + 1 if self.message_positions else self.summarized_count
+        self.message_positions = self.message_positions + [position, position + 1]
+        self.turn_position = None
+        self.prune()
+
+    def prune(self) -> None:
+        """Evict the oldest turns until the history fits, folding them into the summary"""
+        buffer = list(self.chat_memory.messages)
+        pinned_tokens = self.count_tokens(self._pinned_messages())
+        evicted = []
+        # Always keep the latest turn verbatim, even if it alone exceeds the budget
+        while len(buffer) > 2 and pinned_tokens + self.count_tokens(buffer) > self.max_token_limit:
+            evicted.extend(buffer[:2])
+            buffer = buffer[2:]
+
+        if evicted:
+            self.chat_memory.clear()
+            self.chat_memory.add_messages(buffer)
+
+        # Kept in pending_summary until the summary call succeeds, so a failure loses nothing
+        self.pending_summary = self.pending_summary + evicted
+        if self.pending_summary:
+            self._summarize()
+
+    def _summarize(self) -> None:
+        """Fold pending_summary into the summary; on failure keep both for the next turn"""
+        to_summarize = self.pending_summary
+        prompt = SUMMARY_PROMPT.format(
+            summary=self.summary,
+            new_lines=get_buffer_string(to_summarize, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix),
+        )
+        try:
+            if self.admission is not None:
+                reply = self.admission.call(lambda: self.llm.invoke(prompt))
+            else:
+                reply = self.llm.invoke(prompt)
+        except Exception:
+            # The reply was already shown: a late summary is better than a failed turn
+            logger.warning("Could not update the conversation summary; retrying on the next turn", exc_info=True)
+            return
+        self.summary = reply.content
+        self.summarized_count = self.message_positions[len(to_summarize) - 1] + 1
+        self.message_positions = self.message_positions[len(to_summarize):]
+        self.pending_summary = []
+
+    def context_snapshot(self) -> Dict[str, Any]:
+        """Return the summary and how many transcript messages it covers, for saving"""
+        return {"summary": self.summary, "summarized_count": self.summarized_count if self.summary else 0}
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = ""
+        self.last_prompt_tokens = 0
+        self.pending_summary = []
+        self.message_positions = []
+        self.summarized_count = 0
+        self.turn_position = None
+
+
+def create_memory(llm, system_prompt, admission=None):
+    """Create conversation memory for a new session, as selected by MEMORY_MODE.
+
+    admission is the AdmissionController the summary calls go through.
+    """
+    mode = os.getenv("MEMORY_MODE", "token_budget").lower()
+    if mode == "window":
+        memory = ConversationBufferWindowMemory(k=int(os.getenv("MEMORY_WINDOW_TURNS", "5")), return_messages=True)
+        # Add system message to set the AI's role (this will be included in the conversation context)
+        memory.chat_memory.add_message(SystemMessage(content=system_prompt))
+        return memory
+    if mode == "token_budget":
+        return TokenBudgetMemory(
+            llm=llm,
+            admission=admission,
+            system_prompt=system_prompt,
+            max_token_limit=int(os.getenv("MEMORY_TOKEN_BUDGET", "2000")),
+        )
+    raise ValueError(f"Unknown MEMORY_MODE: {mode}")
+
+
+def _to_chat_messages(messages, start=0):
+    """Convert stored {"role", "content"} dicts from messages[start:] to chat messages, skipping
+    leading assistant messages; returns (chat messages, their transcript indexes)"""
+    chat_messages, positions = [], []
+    for position, msg in enumerate(messages[start:], start):
+        if msg["role"] == "user":
+            chat_messages.append(HumanMessage(content=msg["content"]))
+        elif msg["role"] == "assistant" and chat_messages:
+            chat_messages.append(AIMessage(content=msg["content"]))
+        else:
+            continue
+        positions.append(position)
+    return chat_messages, positions
+
+
+def _newest_within_budget(memory, messages, budget):
+    """Split messages into (older, newest) where newest fits in budget tokens"""
+    used = 0
+    split = len(messages)
+    while split > 0:
+        used += memory.count_tokens([messages[split - 1]])
+        if used > budget:
+            break
+        split -= 1
+    return messages[:split], messages[split:]
+
+
+def rehydrate_memory(memory, messages, context=None):
+    """Rebuild memory from a saved conversation without an LLM call.
+
+    context is the dict from TokenBudgetMemory.context_snapshot() saved with
+    the conversation. Messages it covers are represented by its summary;
+    the newest remaining messages that fit the budget are restored verbatim,
+    and anything older waits in pending_summary until the next turn.
+    """
+    if isinstance(memory, TokenBudgetMemory):
+        if context:
+            memory.summary = context.get("summary", "")
+            memory.summarized_count = context.get("summarized_count", 0)
+        # A leading assistant message (welcome, or a reply whose question
+        # is already summarized) is skipped by _to_chat_messages
+        tail, positions = _to_chat_messages(messages, memory.summarized_count)
+
+        budget = memory.max_token_limit - memory.count_tokens(memory._pinned_messages())
+        older, recent = _newest_within_budget(memory, tail, budget)
+        # Only the most recent budget's worth of older messages is kept for summarizing
+        _, memory.pending_summary = _newest_within_budget(memory, older, memory.max_token_limit)
+        memory.message_positions = positions[len(tail) - len(recent) - len(memory.pending_summary):]
+        memory.chat_memory.add_messages(recent)
+    else:
+        chat_messages, _ = _to_chat_messages(messages)
+        k = getattr(memory, "k", len(chat_messages))
+        memory.chat_memory.add_messages(chat_messages[-2 * k:])
+    return memory
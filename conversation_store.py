@@ -0,0 +1,785 @@
+# -*- coding: utf-8 -*-
+"""
+Conversation history storage for the AI Commerce Chatbot.
+
+The app talks to a ConversationStore returned by get_store(). Two backends
+are available, chosen with the CONVERSATION_STORE environment variable:
+
+- "json" (default): JsonFileStore, one JSON file per conversation (below)
+- "sqlite": SqliteStore (sqlite_store.py), with full-text search
+
+Conversations are saved as JSON files in the conversations/ folder. A small
+metadata index (conversations/.meta/index.json) keeps the title, timestamp,
+message count, size and mtime of every file so the sidebar can list chats
+without opening each conversation. The index is updated by save/delete and
+reconciled against file mtimes whenever the folder changes behind our back.
+
+Auto-save does not rewrite the whole conversation on every turn. Each new
+message is appended as one line to a per-conversation JSONL journal
+(conversations/.meta/journal/<id>.jsonl). Once a journal grows past
+JOURNAL_COMPACT_BYTES it is folded into the conversation's JSON snapshot on a
+background thread. Loading a conversation replays the snapshot plus whatever
+is left in the journal.
+
+A precomputed memory summary can be kept next to each conversation
+(conversations/.meta/context/<id>.json) so loading a chat restores the
+model's context without an LLM call.
+
+Several app processes (e.g. Streamlit replicas on a shared volume) can use
+the same folder. Conversation ids carry a random suffix and new files are
+created exclusively, so two saves never overwrite each other. Every file is
+written atomically (temp file + rename). Updates of the index and of each
+conversation's journal are serialized across processes with advisory file
+locks in conversations/.meta/locks/, and appends are versioned: an append
+that does not start at the stored message count raises
+ConversationConflictError instead of silently interleaving two sessions.
+
+Old conversations can be moved to a compressed archive
+(conversation_archive.py). Loading, appending to and deleting a
+conversation fall back to the archive when it is not in the folder.
+"""
+import os
+import json
+import uuid
+import zlib
+import logging
+import datetime
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CONVERSATIONS_DIR = "conversations"
+META_DIR = os.path.join(CONVERSATIONS_DIR, ".meta")
+INDEX_FILE = os.path.join(META_DIR, "index.json")
+INDEX_VERSION = 1
+JOURNAL_DIR = os.path.join(META_DIR, "journal")
+JOURNAL_COMPACT_BYTES = 64 * 1024
+CONTEXT_DIR = os.path.join(META_DIR, "context")
+LOCK_DIR = os.path.join(META_DIR, "locks")
+LOCK_STRIPES = 64
+
+logger = logging.getLogger(__name__)
+
+# In-process copy of the index, reused while the index file is unchanged
+_index_cache = {"stat": None, "index": None}
+_index_lock = threading.RLock()
+_sorted_cache = {"index": None, "entries": []}
+
+# Conversations with a compaction queued or running in this process
+_conversation_locks_guard = threading.Lock()
+_compacting = set()
+
+
+class ConversationConflictError(Exception):
+    """An append did not start where the stored conversation ends (another session wrote to it)"""
+
+    def __init__(self, conversation_id, expected, stored):
+        super().__init__(f"Conversation {conversation_id} has {stored} stored messages, "
+                         f"but the update starts at message {expected}")
+        self.conversation_id = conversation_id
+        self.expected = expected
+        self.stored = stored
+
+
+class FileLock:
+    """Advisory lock on a file, held across processes; re-entrant within a thread.
+
+    Threads of one process first take an RLock, so only the outermost
+    holder opens and locks the lock file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(LOCK_DIR, exist_ok=True)
+                self._file = open(os.path.join(LOCK_DIR, self.name), 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            pass  # LK_LOCK gives up after ten seconds; keep waiting
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is None:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            # Closing the file releases a POSIX lock
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+_index_file_lock = FileLock("index.lock")
+# Conversations share a fixed set of lock files instead of one each
+_conversation_file_locks = [FileLock(f"conversation-{i:02d}.lock") for i in range(LOCK_STRIPES)]
+
+
+def _filename(conversation_id):
+    """Normalize a conversation id, filename or path to its filename"""
+    filename = os.path.basename(conversation_id)
+    if not filename.endswith(".json"):
+        filename += ".json"
+    return filename
+
+
+def _conversation_path(filename):
+    """Return the on-disk path for a conversation filename"""
+    return os.path.join(CONVERSATIONS_DIR, _filename(filename))
+
+
+def _archive():
+    """The conversation archive, or None if nothing was ever archived"""
+    import conversation_archive
+    return conversation_archive.get_archive(create=False)
+
+
+def _conversation_id(filename):
+    return os.path.splitext(_filename(filename))[0]
+
+
+def _journal_path(filename):
+    """Return the journal path for a conversation filename"""
+    stem = os.path.splitext(_filename(filename))[0]
+    return os.path.join(JOURNAL_DIR, f"{stem}.jsonl")
+
+
+def _context_path(filename):
+    """Return the context summary path for a conversation filename"""
+    stem = os.path.splitext(_filename(filename))[0]
+    return os.path.join(CONTEXT_DIR, f"{stem}.json")
+
+
+def _conversation_lock(filename):
+    """Return the cross-process lock guarding a conversation's snapshot and journal"""
+    stripe = zlib.crc32(_filename(filename).encode("utf-8")) % LOCK_STRIPES
+    return _conversation_file_locks[stripe]
+
+
+@contextlib.contextmanager
+def _index_locked():
+    """Hold the index lock, in this process and across processes"""
+    with _index_lock, _index_file_lock:
+        yield
+
+
+def _write_temp(path, text):
+    """Write text to a hidden temp file next to path and return its path"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return tmp_path
+
+
+def _atomic_write(path, text):
+    """Write text to path via a temp file and rename, so readers never see partial data"""
+    os.replace(_write_temp(path, text), path)
+
+
+def _atomic_create(path, text):
+    """Like _atomic_write, but raise FileExistsError rather than replace an existing file"""
+    tmp_path = _write_temp(path, text)
+    try:
+        # link() fails if path exists, where rename would overwrite it
+        os.link(tmp_path, path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hard links here (some network mounts, FAT/exFAT, container volumes):
+        # claim the name with an exclusive create, then rename over the placeholder
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(path)
+            raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _dir_mtime_ns():
+    """Modification time of the conversations folder (changes on create/delete)"""
+    return os.stat(CONVERSATIONS_DIR).st_mtime_ns
+
+
+def _is_conversation_file(filename):
+    """Check whether a directory entry is a saved conversation"""
+    return filename.endswith(".json") and not filename.startswith(".")
+
+
+def _entry_from_file(filename, stat_result):
+    """Build an index entry by reading a conversation file once"""
+    with open(_conversation_path(filename), 'r', encoding='utf-8') as f:
+        conversation = json.load(f)
+    return {
+        "id": os.path.splitext(filename)[0],
+        "filename": filename,
+        "title": conversation.get("title", "Untitled"),
+        "timestamp": conversation.get("timestamp", ""),
+        "created": conversation.get("created", ""),
+        "message_count": len(conversation.get("messages", [])),
+        "size": stat_result.st_size,
+        "mtime": stat_result.st_mtime_ns,
+    }
+
+
+def _stat_key(stat_result):
+    """Identify one version of the index file.
+
+    Each write replaces the file, so the inode changes even when another
+    process writes twice within the filesystem's mtime granularity.
+    """
+    return stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_size
+
+
+def _read_index():
+    """Read the index file, returning None if it is missing or unreadable"""
+    try:
+        stat_key = _stat_key(os.stat(INDEX_FILE))
+    except OSError:
+        return None
+
+    if _index_cache["stat"] == stat_key:
+        return _index_cache["index"]
+
+    try:
+        with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != INDEX_VERSION:
+        return None
+
+    _index_cache["stat"] = stat_key
+    _index_cache["index"] = index
+    return index
+
+
+def _write_index(index):
+    """Write the index atomically (temp file + rename inside .meta/)"""
+    _atomic_write(INDEX_FILE, json.dumps(index, ensure_ascii=False, separators=(",", ":")))
+
+    _index_cache["stat"] = _stat_key(os.stat(INDEX_FILE))
+    _index_cache["index"] = index
+
+
+def rebuild_index(index=None):
+    """Reconcile the index with the conversations folder.
+
+    Files whose size and mtime match their index entry are kept as-is; only
+    new or modified files are opened and parsed. Entries for files that no
+    longer exist are dropped.
+    """
+    with _index_locked():
+        return _rebuild_index(index)
+
+
+def _rebuild_index(index):
+    entries = dict(index["entries"]) if index else {}
+    seen = set()
+
+    for dir_entry in os.scandir(CONVERSATIONS_DIR):
+        if not dir_entry.is_file() or not _is_conversation_file(dir_entry.name):
+            continue
+        seen.add(dir_entry.name)
+        stat_result = dir_entry.stat()
+        cached = entries.get(dir_entry.name)
+        if cached and cached["mtime"] == stat_result.st_mtime_ns and cached["size"] == stat_result.st_size:
+            continue
+        try:
+            entries[dir_entry.name] = _entry_from_file(dir_entry.name, stat_result)
+        except (OSError, ValueError):
+            # Skip unreadable files rather than failing the whole listing
+            entries.pop(dir_entry.name, None)
+
+    for filename in list(entries):
+        if filename not in seen:
+            del entries[filename]
+
+    # Create .meta/ before reading the folder mtime, so creating it is not
+    # mistaken for an external change on the next call
+    os.makedirs(META_DIR, exist_ok=True)
+    index = {"version": INDEX_VERSION, "dir_mtime": _dir_mtime_ns(), "entries": entries}
+    _write_index(index)
+    return index
+
+
+def get_index():
+    """Return an up-to-date index, rebuilding it if missing or stale"""
+    index = _read_index()
+    if index is None or index.get("dir_mtime") != _dir_mtime_ns():
+        index = rebuild_index(index)
+    return index
+
+
+def _update_index_entry(filename, entry=None):
+    """Add, replace (entry given) or remove (entry None) one index entry"""
+    with _index_locked():
+        index = _read_index()
+        if index is None:
+            _rebuild_index(None)
+            return
+
+        entries = dict(index["entries"])
+        if entry is None:
+            entries.pop(filename, None)
+        else:
+            entries[filename] = entry
+
+        _write_index({"version": INDEX_VERSION, "dir_mtime": _dir_mtime_ns(), "entries": entries})
+
+
+def _index_entry(filename, conversation, path):
+    """Build an index entry for a conversation that was just written"""
+    stat_result = os.stat(path)
+    return {
+        "id": os.path.splitext(filename)[0],
+        "filename": filename,
+        "title": conversation["title"],
+        "timestamp": conversation["timestamp"],
+        "created": conversation.get("created", ""),
+        "message_count": len(conversation["messages"]),
+        "size": stat_result.st_size,
+        "mtime": stat_result.st_mtime_ns,
+    }
+
+
+def make_title(conversation_data):
+    """Generate a conversation title from the first user message"""
+    first_user_msg = next((msg["content"][:50] for msg in conversation_data if msg["role"] == "user"), "New Conversation")
+    return first_user_msg.replace("/", "_").replace("\\", "_")[:30] + "..."
+
+
+def save_conversation(conversation_data, title=None):
+    """Save a conversation to a new file and record it in the index"""
+    os.makedirs(CONVERSATIONS_DIR, exist_ok=True)
+
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    if not title:
+        title = make_title(conversation_data)
+
+    conversation_info = {
+        "timestamp": timestamp,
+        "title": title,
+        "messages": conversation_data,
+        "created": now.isoformat()
+    }
+    text = json.dumps(conversation_info, indent=2, ensure_ascii=False)
+
+    # The random suffix keeps ids unique across processes saving the same
+    # title in the same second; exclusive creation catches the rare clash
+    while True:
+        filename = f"{timestamp}_{title.replace(' ', '_')}_{uuid.uuid4().hex[:8]}.json"
+        path = _conversation_path(filename)
+        try:
+            _atomic_create(path, text)
+            break
+        except FileExistsError:
+            continue
+
+    _update_index_entry(filename, _index_entry(filename, conversation_info, path))
+    return path
+
+
+def append_messages(filename, messages, start):
+    """Append messages[start:] to a conversation's journal.
+
+    Each message becomes one JSONL record tagged with its position, so the
+    cost of a save is proportional to the new messages only. Replaying is
+    idempotent: records already folded into the snapshot are skipped.
+
+    start is the number of messages the caller believes are stored. If
+    another session has written to the conversation since, the append is
+    refused with ConversationConflictError.
+    """
+    filename = _filename(filename)
+    records = "".join(
+        json.dumps(dict(msg, i=i), ensure_ascii=False) + "\n"
+        for i, msg in enumerate(messages[start:], start)
+    )
+    if not records:
+        return
+
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    with _conversation_lock(filename):
+        if not os.path.exists(_conversation_path(filename)) and _archive() is not None:
+            # Continuing an archived chat: bring it back to the hot folder first
+            import conversation_archive
+            conversation_archive.restore_conversation(_conversation_id(filename))
+        stored = _stored_message_count(filename)
+        if stored != start:
+            raise ConversationConflictError(_conversation_id(filename), start, stored)
+        with open(_journal_path(filename), 'a', encoding='utf-8') as f:
+            f.write(records)
+            journal_size = f.tell()
+
+    if journal_size >= JOURNAL_COMPACT_BYTES:
+        schedule_compaction(filename)
+
+
+def _stored_message_count(filename):
+    """Number of messages stored for a conversation; call with its lock held.
+
+    Also drops a torn last journal line left by a crashed writer, so the
+    next append starts on a fresh line.
+    """
+    path = _journal_path(filename)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    if data and not data.endswith(b"\n"):
+        data = data[:data.rfind(b"\n") + 1]
+        with open(path, 'r+b') as f:
+            f.truncate(len(data))
+    if data:
+        return json.loads(data[data.rfind(b"\n", 0, len(data) - 1) + 1:])["i"] + 1
+    try:
+        with open(_conversation_path(filename), 'r', encoding='utf-8') as f:
+            return len(json.load(f)["messages"])
+    except FileNotFoundError:
+        return 0
+
+
+def _read_journal(filename):
+    """Read journal records for a conversation, ignoring a torn last line"""
+    records = []
+    try:
+        with open(_journal_path(filename), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A crash mid-append can leave a partial final line
+                    break
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _replay_journal(conversation, records):
+    """Apply journal records on top of a snapshot's messages.
+
+    Returns False if the journal has a gap after the snapshot, in which case
+    the conversation stops at the last consistent message.
+    """
+    messages = conversation["messages"]
+    for record in records:
+        position = record.pop("i")
+        if position < len(messages):
+            continue  # Already folded into the snapshot
+        if position > len(messages):
+            return False
+        messages.append(record)
+    return True
+
+
+def compact_conversation(filename):
+    """Fold a conversation's journal into its JSON snapshot"""
+    filename = _filename(filename)
+    path = _conversation_path(filename)
+
+    # Held throughout, so a compaction in another process cannot write an
+    # older snapshot over this one
+    with _conversation_lock(filename):
+        conversation = load_conversation(filename)
+        _atomic_write(path, json.dumps(conversation, indent=2, ensure_ascii=False))
+        folded = len(conversation["messages"])
+
+        remaining = [r for r in _read_journal(filename) if r["i"] >= folded]
+        if remaining:
+            _atomic_write(_journal_path(filename), "".join(
+                json.dumps(r, ensure_ascii=False) + "\n" for r in remaining))
+        elif os.path.exists(_journal_path(filename)):
+            os.remove(_journal_path(filename))
+
+    _update_index_entry(filename, _index_entry(filename, conversation, path))
+
+
+def _compact_in_background(filename):
+    try:
+        compact_conversation(filename)
+    except Exception:
+        logger.exception("Error compacting conversation %s", filename)
+    finally:
+        with _conversation_locks_guard:
+            _compacting.discard(filename)
+
+
+def schedule_compaction(filename):
+    """Compact a conversation on a background thread (at most one at a time)"""
+    filename = _filename(filename)
+    with _conversation_locks_guard:
+        if filename in _compacting:
+            return
+        _compacting.add(filename)
+    threading.Thread(target=_compact_in_background, args=(filename,), daemon=True).start()
+
+
+def _sorted_entries():
+    """Index entries sorted newest first, re-sorted only when the index changes"""
+    index = get_index()
+    if _sorted_cache["index"] is not index:
+        entries = list(index["entries"].values())
+        entries.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        _sorted_cache["index"] = index
+        _sorted_cache["entries"] = entries
+    return _sorted_cache["entries"]
+
+
+def _title_filter(entries, title_prefix):
+    """Entries whose title starts with title_prefix (case-insensitive)"""
+    if not title_prefix:
+        return entries
+    prefix = title_prefix.lower()
+    return [e for e in entries if e.get("title", "").lower().startswith(prefix)]
+
+
+def load_conversations(limit=None, offset=0, title_prefix=None):
+    """List one page of saved conversations (metadata only), newest first"""
+    if not os.path.exists(CONVERSATIONS_DIR):
+        return []
+
+    conversations = _title_filter(_sorted_entries(), title_prefix)
+    end = None if limit is None else offset + limit
+    return conversations[offset:end]
+
+
+def count_conversations(title_prefix=None):
+    """Count saved conversations, optionally only those with a title prefix"""
+    if not os.path.exists(CONVERSATIONS_DIR):
+        return 0
+    if not title_prefix:
+        return len(get_index()["entries"])
+    return len(_title_filter(_sorted_entries(), title_prefix))
+
+
+def _load_archived(filename):
+    """Archived record for a conversation that is not in the folder, or None"""
+    archive = _archive()
+    return archive.load(_conversation_id(filename)) if archive is not None else None
+
+
+def _read_conversation(filename):
+    """Read the snapshot (or archived record) and replay the journal; returns (conversation, complete)"""
+    try:
+        with open(_conversation_path(filename), 'r', encoding='utf-8') as f:
+            conversation = json.load(f)
+    except FileNotFoundError:
+        conversation = _load_archived(filename)
+        if conversation is None:
+            raise
+        conversation.pop("context", None)
+        conversation.pop("id", None)
+    return conversation, _replay_journal(conversation, _read_journal(filename))
+
+
+def load_conversation(filename):
+    """Load the full body of a specific conversation (snapshot + journal tail, or the archive)"""
+    conversation, complete = _read_conversation(filename)
+    if complete:
+        return conversation
+    # A compaction replaced the snapshot and trimmed the journal between the
+    # two reads: read both again with the lock held, so they match
+    with _conversation_lock(filename):
+        conversation, complete = _read_conversation(filename)
+    if not complete:
+        logger.warning("Journal of conversation %s has a gap; loaded only its first %d messages",
+                       _conversation_id(filename), len(conversation["messages"]))
+    return conversation
+
+
+def delete_conversation(filename):
+    """Delete a conversation file and its journal, and drop it from the index"""
+    try:
+        os.remove(_conversation_path(filename))
+    except FileNotFoundError:
+        archive = _archive()
+        if archive is None or not archive.delete(_conversation_id(filename)):
+            raise
+        return
+    with _conversation_lock(filename):
+        for path in (_journal_path(filename), _context_path(filename)):
+            if os.path.exists(path):
+                os.remove(path)
+    _update_index_entry(_filename(filename))
+
+
+def save_context_summary(filename, context):
+    """Save the memory context summary for a conversation"""
+    os.makedirs(CONTEXT_DIR, exist_ok=True)
+    _atomic_write(_context_path(filename), json.dumps(context, ensure_ascii=False))
+
+
+def load_context_summary(filename):
+    """Load the memory context summary for a conversation, or None"""
+    try:
+        with open(_context_path(filename), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if os.path.exists(_conversation_path(filename)):
+            return None
+        record = _load_archived(filename)
+        return record.get("context") if record else None
+    except (OSError, ValueError):
+        return None
+
+
+def search_conversations(query, limit=20):
+    """Find conversations whose messages mention the query words.
+
+    The JSON backend has no text index, so this opens every conversation;
+    use the SQLite backend for large histories.
+    """
+    words = [w for w in query.lower().split() if w]
+    if not words:
+        return []
+
+    results = []
+    for entry in load_conversations():
+        try:
+            conversation = load_conversation(entry["filename"])
+        except (OSError, ValueError):
+            continue
+        text = " ".join(msg["content"] for msg in conversation["messages"]).lower()
+        score = sum(1 for w in words if w in text)
+        if score:
+            results.append((score, entry))
+
+    results.sort(key=lambda x: x[0], reverse=True)
+    return [entry for _, entry in results[:limit]]
+
+
+class ConversationStore:
+    """Interface implemented by conversation storage backends.
+
+    Conversations are identified by an opaque string id. Listing and search
+    return metadata dicts with at least id, title, timestamp and
+    message_count; load_conversation() returns the full body with messages.
+    """
+
+    def save_conversation(self, conversation_data, title=None):
+        """Save a new conversation and return its id"""
+        raise NotImplementedError
+
+    def append_messages(self, conversation_id, conversation_data, start):
+        """Append conversation_data[start:] to an existing conversation"""
+        raise NotImplementedError
+
+    def update_conversation(self, conversation_id, conversation_data, start, context=None):
+        """Append new messages and, if given, replace the saved context summary"""
+        self.append_messages(conversation_id, conversation_data, start)
+        if context is not None:
+            self.save_context_summary(conversation_id, context)
+
+    def list_conversations(self, limit=None, offset=0, title_prefix=None):
+        """Return one page of conversation metadata, newest first"""
+        raise NotImplementedError
+
+    def count_conversations(self, title_prefix=None):
+        """Return the number of stored conversations"""
+        raise NotImplementedError
+
+    def load_conversation(self, conversation_id):
+        """Return a conversation with its messages"""
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id):
+        """Delete a conversation"""
+        raise NotImplementedError
+
+    def search_conversations(self, query, limit=20):
+        """Return metadata for conversations matching a free-text query"""
+        raise NotImplementedError
+
+    def save_context_summary(self, conversation_id, context):
+        """Save the precomputed memory context for a conversation"""
+        raise NotImplementedError
+
+    def load_context_summary(self, conversation_id):
+        """Return the precomputed memory context for a conversation, or None"""
+        raise NotImplementedError
+
+
+class JsonFileStore(ConversationStore):
+    """One JSON file per conversation in the conversations/ folder"""
+
+    def save_conversation(self, conversation_data, title=None):
+        return os.path.splitext(os.path.basename(save_conversation(conversation_data, title)))[0]
+
+    def append_messages(self, conversation_id, conversation_data, start):
+        append_messages(conversation_id, conversation_data, start)
+
+    def list_conversations(self, limit=None, offset=0, title_prefix=None):
+        return load_conversations(limit, offset, title_prefix)
+
+    def count_conversations(self, title_prefix=None):
+        return count_conversations(title_prefix)
+
+    def load_conversation(self, conversation_id):
+        conversation = load_conversation(conversation_id)
+        conversation["id"] = os.path.splitext(_filename(conversation_id))[0]
+        return conversation
+
+    def delete_conversation(self, conversation_id):
+        delete_conversation(conversation_id)
+
+    def search_conversations(self, query, limit=20):
+        return search_conversations(query, limit)
+
+    def save_context_summary(self, conversation_id, context):
+        save_context_summary(conversation_id, context)
+
+    def load_context_summary(self, conversation_id):
+        return load_context_summary(conversation_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide conversation store selected by CONVERSATION_STORE"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv("CONVERSATION_STORE", "json").lower()
+            if backend == "sqlite":
+                from sqlite_store import SqliteStore
+                _store = SqliteStore(os.getenv("CONVERSATION_DB", "conversations.db"))
+            elif backend == "json":
+                _store = JsonFileStore()
+            else:
+                raise ValueError(f"Unknown CONVERSATION_STORE backend: {backend}")
+        return _store
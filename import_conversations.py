@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Import saved JSON conversations into the SQLite conversation store.
+
+Usage:
+    python import_conversations.py [--db conversations.db] [--batch-size 500]
+
+Reads every conversation in the conversations/ folder (including any
+auto-save journal that has not been compacted yet) and inserts it into the
+SQLite database. Conversation ids are the JSON file names, so running the
+import again skips conversations that were already imported.
+"""
+
+import os
+import sys
+import argparse
+
+import conversation_store
+from sqlite_store import SqliteStore
+
+
+def iter_json_conversations():
+    """Yield conversations from the JSON folder in the shape the importer expects"""
+    for entry in conversation_store.load_conversations():
+        try:
+            conversation = conversation_store.load_conversation(entry["filename"])
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Skipping {entry['filename']}: {e}")
+            continue
+        yield {
+            "id": entry["id"],
+            "title": conversation.get("title", entry["title"]),
+            "timestamp": conversation.get("timestamp", entry["timestamp"]),
+            "created": conversation.get("created", ""),
+            "messages": conversation.get("messages", []),
+        }
+
+
+def main():
+    """Run the one-shot import"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB", "conversations.db"),
+                        help="SQLite database path (default: CONVERSATION_DB or conversations.db)")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Conversations inserted per transaction")
+    args = parser.parse_args()
+
+    if not os.path.exists(conversation_store.CONVERSATIONS_DIR):
+        print(f"❌ No {conversation_store.CONVERSATIONS_DIR}/ folder found")
+        sys.exit(1)
+
+    print(f"📦 Importing conversations into {args.db}...")
+    store = SqliteStore(args.db)
+    count = store.import_conversations(iter_json_conversations(), batch_size=args.batch_size)
+    print(f"✅ Imported {count} conversations ({store.count_conversations()} now in the database)")
+    print("\nSet CONVERSATION_STORE=sqlite in .env to use the database.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Intent routing for the AI Commerce Chatbot.
+
+Routine questions (order status, returns, shipping, payment) do not need
+the large model. IntentRouter classifies each user message locally in well
+under a millisecond and picks a route:
+
+- "template": answer with the store's canned policy reply, no LLM call
+- "small": answer with the small model (LLM_SMALL_MODEL)
+- "large": answer with the main model (open-ended shopping questions)
+- "compare": compare the products a message names with parallel
+  per-product calls to the main model (see product_compare.py)
+
+Classification tries high-precision keyword rules first, then a
+nearest-neighbour classifier over hashed word and character-trigram vectors
+of labelled example phrases. Anything the classifier is not confident
+about goes to the large model. A canned reply is only used when it answers
+the whole message: the keyword rules of exactly one intent match it, it
+says nothing about products or shopping ("What laptops have free
+shipping?" is a shopping question), the classifier agrees with the rule by
+a clear margin, and none of its clauses is about another intent ("I was
+charged twice and my order never arrived"); otherwise the message goes to
+the large model.
+
+The canned replies state store policy (return windows, shipping costs), so
+none are built in: they are read from the JSON file named by
+ROUTER_TEMPLATES (see policy_templates.example.json). Without it, the
+template intents are answered by the small model, or the large one.
+
+Each decision is recorded on the turn trace (intent, route, confidence,
+method and the "routing" stage time) so the thresholds can be tuned from
+the metrics log.
+"""
+import os
+import re
+import json
+import time
+
+import numpy as np
+
+from product_catalog import HashingEncoder
+
+ROUTES = ("template", "small", "large", "compare")
+DEFAULT_INTENT = "shopping"
+
+# Where a message asking several things splits: sentences and joined clauses
+CLAUSE_BREAKS = re.compile(r"[.?!;]+|\b(?:and|also|but|plus)\b", re.IGNORECASE)
+
+# Product and shopping cues: a message with any of these wants more than a policy reply
+SHOPPING_TERMS = re.compile(
+    r"\b(?:buy(?:ing)?|recommend\w*|suggest\w*|looking for|shopping for|worth|best|cheap\w*|budget"
+    r"|afford\w*|prices?|priced|costs? (?:of|for)|deals?|discounts?|reviews?|rated|ratings?|brands?|models?"
+    r"|specs?|features?|laptops?|computers?|phones?|tablets?|headphones|earbuds|tvs?|monitors?|cameras?"
+    r"|watch(?:es)?|consoles?|speakers?|jackets?|coats?|shoes|sneakers|boots|dress(?:es)?|shirts?|jeans"
+    r"|bags?|furniture|sofa|mattress(?:es)?|blender|appliances?|toys?|gifts?)\b"
+    r"|\b(?:under|below|less than) \$?\d|\$\d"
+    # Model names such as XM5, S24, PS5
+    r"|\b[a-z]{1,5}\d{1,4}[a-z]?\b",
+    re.IGNORECASE)
+
+# intent -> default route, keyword rules and example phrases
+INTENTS = {
+    "order_status": {
+        "route": "template",
+        "rules": [r"\bwhere(?:'s| is) my (?:order|package|parcel|delivery)\b",
+                  r"\btrack(?:ing)? (?:my |an |the )?(?:order|package|parcel|shipment)\b",
+                  r"\border (?:status|tracking)\b", r"\btracking (?:number|info|information)\b",
+                  r"\b(?:order|package|parcel|delivery) (?:never|hasn't|has not|didn't|did not|still hasn't)"
+                  r" (?:arrive|arrived|come|came|show up|showed up)\b"],
+        "examples": ["I need help with my order status or tracking information",
+                     "where is my order", "has my package shipped yet", "track my order",
+                     "my order hasn't arrived", "when will my order arrive", "order status",
+                     "I haven't received my package", "what is the status of my purchase",
+                     "my delivery is late"],
+    },
+    "returns": {
+        "route": "template",
+        "rules": [r"\breturn polic(?:y|ies)\b", r"\brefund(?:s|ed)?\b",
+                  r"\b(?:return|exchange) (?:an? |my |this |the )?(?:item|order|product|purchase)\b",
+                  r"\bsend (?:it|this|them) back\b"],
+        "examples": ["I need information about returns, exchanges, or refund policies",
+                     "how do I return an item", "can I exchange this for a different size",
+                     "what is your return policy", "I want my money back", "how long do refunds take",
+                     "the product arrived damaged", "can I return opened electronics",
+                     "I received the wrong item"],
+    },
+    "shipping": {
+        "route": "template",
+        "rules": [r"\bshipping (?:cost|costs|fee|fees|time|times|option|options|rate|rates)\b",
+                  r"\bfree shipping\b", r"\bdo you ship to\b", r"\bexpress (?:shipping|delivery)\b",
+                  r"\bhow (?:much|long) (?:is|does) (?:shipping|delivery)\b"],
+        "examples": ["how much is shipping", "do you offer free shipping", "how long does delivery take",
+                     "do you ship internationally", "what shipping options do you have",
+                     "can I get next day delivery", "do you ship to Canada"],
+    },
+    "payment": {
+        "route": "template",
+        "rules": [r"\bpayment (?:method|methods|option|options)\b", r"\bpay (?:with|by|in installments)\b",
+                  r"\b(?:paypal|apple pay|google pay|klarna|afterpay)\b",
+                  r"\b(?:charged|billed) (?:me )?(?:twice|two times|double|again)\b", r"\bdouble (?:charged|billed)\b"],
+        "examples": ["what payment methods do you accept", "can I pay with PayPal",
+                     "do you take credit cards", "can I pay in installments", "my payment was declined",
+                     "is it safe to pay on your site", "I was charged twice", "you billed me twice for one order"],
+    },
+    "account": {
+        "route": "small",
+        "rules": [r"\b(?:reset|forgot|change) (?:my )?password\b", r"\b(?:log|sign) ?in\b",
+                  r"\bmy account\b"],
+        "examples": ["I can't log in to my account", "how do I reset my password",
+                     "change the email on my account", "update my shipping address",
+                     "delete my account", "how do I create an account"],
+    },
+    "small_talk": {
+        "route": "small",
+        "rules": [r"^\s*(?:hi|hello|hey|thanks|thank you|thx|bye|goodbye|ok|okay)\b[\s!.?]*$"],
+        "examples": ["hi", "hello there", "thanks for your help", "thank you so much", "goodbye",
+                     "who are you", "what can you do"],
+    },
+    # Only explicit comparisons; product_compare.py sends requests that name no products to "large"
+    "compare": {
+        "route": "compare",
+        "rules": [r"\bcompar(?:e|ing|ison|isons)\b", r"\b(?:vs\.?|versus)\s",
+                  r"\bdifferences? between\b", r"\b(?:choose|decide|pick) between\b",
+                  r"\bwhich (?:one )?is better\b"],
+        "examples": [],
+    },
+    DEFAULT_INTENT: {
+        "route": "large",
+        "rules": [],
+        "examples": ["I'm looking for product recommendations. Can you help me find something specific?",
+                     "What are the best deals and discounts available right now?",
+                     "I want to compare different products. Can you help me?",
+                     "I'm looking for a laptop under $800 for video editing",
+                     "What are the best wireless earbuds for running?",
+                     "Can you compare the latest iPhone and Pixel phones?",
+                     "Find me a gift for a coffee lover under $50",
+                     "which tv should I buy for a bright living room",
+                     "is this blender good for smoothies",
+                     "recommend running shoes for flat feet",
+                     "what's the difference between these two cameras",
+                     "suggest a budget gaming monitor"],
+    },
+}
+
+
+class RouteDecision:
+    """Where a user message goes, and why"""
+
+    def __init__(self, intent, route, confidence, method, seconds=0.0, template=None):
+        self.intent = intent
+        self.route = route
+        self.confidence = confidence
+        self.method = method
+        self.seconds = seconds
+        self.template = template
+
+    def as_dict(self):
+        """Decision as a JSON-serializable dict"""
+        return {
+            "intent": self.intent,
+            "route": self.route,
+            "router_confidence": round(self.confidence, 3),
+            "router_method": self.method,
+        }
+
+
+class IntentRouter:
+    """Keyword rules plus a nearest-neighbour classifier over example phrases"""
+
+    def __init__(self, intents=INTENTS, routes=None, templates=None, min_confidence=0.6, min_margin=0.05,
+                 template_max_words=30, small_model=True):
+        self.intents = intents
+        self.templates = templates or {}
+        self.routes = {name: spec["route"] for name, spec in intents.items()}
+        self.routes.update(routes or {})
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.template_max_words = template_max_words
+        self.small_model = small_model
+        self._rules = [(name, re.compile(pattern, re.IGNORECASE))
+                       for name, spec in intents.items() for pattern in spec.get("rules", [])]
+        self._encoder = HashingEncoder(dim=256)
+        labels, vectors = [], []
+        for name, spec in intents.items():
+            for example in spec.get("examples", []):
+                labels.append(name)
+                vectors.append(self._encoder.encode(example))
+        self._labels = np.asarray(labels)
+        self._names = sorted(set(labels))
+        self._examples = np.vstack(vectors)
+        self.decisions = {route: 0 for route in ROUTES}
+
+    def _rule_intents(self, text):
+        """Intents whose keyword rules match text, in rule order"""
+        intents = []
+        for name, pattern in self._rules:
+            if name not in intents and pattern.search(text):
+                intents.append(name)
+        return intents
+
+    def _scores(self, text):
+        """Best example similarity per intent, highest first, or [] for a message with no usable words"""
+        vector = self._encoder.encode(text)
+        if not vector.any():
+            return []
+        similarities = self._examples @ vector
+        return sorted(((float(similarities[self._labels == name].max()), name) for name in self._names), reverse=True)
+
+    def classify(self, text):
+        """Return (intent, confidence, method) without choosing a route"""
+        rule_intents = self._rule_intents(text)
+        if rule_intents:
+            return rule_intents[0], 1.0, "rule"
+        best = self._scores(text)
+        if not best:
+            return DEFAULT_INTENT, 0.0, "default"
+        # Best example per intent; the runner-up tells how clear-cut the match is
+        (confidence, intent), runner_up = best[0], best[1][0] if len(best) > 1 else 0.0
+        if confidence < self.min_confidence or confidence - runner_up < self.min_margin:
+            return DEFAULT_INTENT, confidence, "low_confidence"
+        return intent, confidence, "classifier"
+
+    def _template_answers(self, text, intent):
+        """Whether intent's canned reply answers the whole message"""
+        # Long messages usually ask more than the canned reply answers
+        if len(text.split()) > self.template_max_words:
+            return False
+        # "Do you ship to Canada? I'm looking for a winter jacket under $200" is a shopping question
+        if SHOPPING_TERMS.search(text):
+            return False
+        # Exactly this intent's rules match: a classifier guess alone is not enough
+        if self._rule_intents(text) != [intent]:
+            return False
+        # ...and the classifier agrees, by a clear margin
+        best = self._scores(text)
+        if not best or best[0][1] != intent:
+            return False
+        if len(best) > 1 and best[0][0] - best[1][0] < self.min_margin:
+            return False
+        # "I was charged twice and my order never arrived": no part may be about something else
+        for clause in CLAUSE_BREAKS.split(text):
+            scores = self._scores(clause) if len(clause.split()) > 1 else []
+            if scores and scores[0][0] >= self.min_confidence and scores[0][1] not in (intent, "small_talk"):
+                return False
+        return True
+
+    def route(self, text):
+        """Classify a user message and choose its route"""
+        started = time.perf_counter()
+        intent, confidence, method = self.classify(text)
+        route = self.routes.get(intent, "large")
+        template = self.templates.get(intent)
+        if route == "template" and not self._template_answers(text, intent):
+            route = "large"
+        elif route == "template" and not template:
+            route = "small"
+        if route == "small" and not self.small_model:
+            route = "large"
+        if route != "template":
+            template = None
+        self.decisions[route] += 1
+        return RouteDecision(intent, route, confidence, method, time.perf_counter() - started, template)
+
+    def stats(self):
+        """Return how many messages took each route"""
+        return dict(self.decisions)
+
+
+def _parse_routes(value):
+    """Parse "intent=route,intent=route" overrides"""
+    routes = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        intent, _, route = item.partition("=")
+        intent, route = intent.strip(), route.strip()
+        if intent not in INTENTS or route not in ROUTES:
+            raise ValueError(f"Invalid ROUTER_ROUTES entry: {item}")
+        routes[intent] = route
+    return routes
+
+
+def load_templates(path):
+    """Read {intent: canned reply} from a JSON file"""
+    with open(path, encoding="utf-8") as f:
+        templates = json.load(f)
+    for intent, text in templates.items():
+        if intent not in INTENTS or not isinstance(text, str):
+            raise ValueError(f"Invalid entry in {path}: {intent}")
+    return templates
+
+
+def create_router(small_model=False):
+    """Create the router from ROUTER_* settings, or return None if ROUTER=off"""
+    if os.getenv("ROUTER", "on").lower() in ("off", "false", "0"):
+        return None
+    return IntentRouter(
+        routes=_parse_routes(os.getenv("ROUTER_ROUTES", "")),
+        templates=load_templates(os.environ["ROUTER_TEMPLATES"]) if os.getenv("ROUTER_TEMPLATES") else None,
+        min_confidence=float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.6")),
+        min_margin=float(os.getenv("ROUTER_MIN_MARGIN", "0.05")),
+        template_max_words=int(os.getenv("ROUTER_TEMPLATE_MAX_WORDS", "30")),
+        small_model=small_model,
+    )
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control for LLM calls.
+
+One AdmissionController per process sits in front of every chat turn's call
+to the model, from Streamlit threads and from the API server's event loop:
+
+- a concurrency cap on in-flight requests (LLM_MAX_CONCURRENCY)
+- a token bucket matched to the provider quota (LLM_REQUESTS_PER_MINUTE,
+  LLM_BURST)
+- retries of 429/5xx/connection errors with jittered exponential backoff,
+  honouring Retry-After (LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY,
+  LLM_RETRY_MAX_DELAY)
+- a circuit breaker that fails fast after LLM_BREAKER_FAILURES upstream
+  failures in a row, for LLM_BREAKER_RESET_SECONDS
+
+Time spent waiting for admission is reported as llm_queue_wait, separately
+from model latency, and backoff sleeps as llm_backoff. Calls given a
+cancellation.CancelToken stop waiting and retrying once their turn is
+cancelled or reaches its deadline.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+from metrics import REGISTRY, trace_span
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout",
+                    "ReadTimeout", "ReadError", "RemoteProtocolError", "PoolTimeout"}
+
+# How often waiters re-check a full concurrency cap when nothing notifies them
+POLL_INTERVAL = 0.02
+
+
+class LLMUnavailableError(Exception):
+    """The model is not being called right now; retry_after is a hint in seconds"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling the model while the circuit breaker is open"""
+
+
+class AdmissionTimeoutError(LLMUnavailableError):
+    """Raised when a call waited longer than the queue timeout for admission"""
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    """True for rate limits, upstream 5xx errors and connection problems"""
+    if isinstance(error, LLMUnavailableError):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry_after(error):
+    """Seconds from the error's Retry-After header, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, now):
+        """Take a token if one is available; return 0, or the seconds until one is"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """Closed -> open after failure_threshold failures -> half-open after reset_timeout"""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def check(self, now):
+        """Return 0 if a call may go ahead, or the seconds until the breaker half-opens"""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # One trial call at a time decides whether the upstream is back
+            if self.trial_in_flight:
+                return self.reset_timeout
+            self.trial_in_flight = True
+        return 0.0
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = now
+
+    def release_trial(self):
+        """Forget a trial call that ended without an upstream verdict"""
+        self.trial_in_flight = False
+
+
+class AdmissionController:
+    """Concurrency cap, rate limit, retries and circuit breaker shared by all sessions"""
+
+    def __init__(self, max_concurrency=10, requests_per_minute=0, burst=None, max_retries=2,
+                 retry_base_delay=0.5, retry_max_delay=20.0, breaker_failures=5,
+                 breaker_reset_seconds=30.0, queue_timeout=30.0, registry=REGISTRY):
+        self.max_concurrency = max_concurrency
+        self.bucket = None
+        if requests_per_minute:
+            self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max(1, requests_per_minute // 60))
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset_seconds)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.queue_timeout = queue_timeout
+        self.registry = registry
+
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        # aacquire() waiters in arrival order: (event loop, asyncio.Event)
+        self._async_waiters = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.retries = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    # Admission
+
+    def _try_enter(self):
+        """Admit a call if possible (caller holds the lock); return 0 or seconds to wait.
+
+        Raises CircuitOpenError while the breaker is open.
+        """
+        now = time.monotonic()
+        if self.in_flight >= self.max_concurrency:
+            return POLL_INTERVAL
+        if self.bucket is not None:
+            # The token is refunded below if the breaker turns the call away
+            wait = self.bucket.try_take(now)
+            if wait:
+                return wait
+        breaker_wait = self.breaker.check(now)
+        if breaker_wait:
+            if self.bucket is not None:
+                self.bucket.tokens = min(self.bucket.capacity, self.bucket.tokens + 1)
+            self.rejected += 1
+            raise CircuitOpenError("The assistant is temporarily unavailable, please try again shortly.",
+                                   retry_after=round(breaker_wait, 1))
+        self.in_flight += 1
+        self.admitted += 1
+        return 0.0
+
+    def _admitted(self, waited, trace):
+        with self._lock:
+            self.total_queue_wait += waited
+            self.max_queue_wait = max(self.max_queue_wait, waited)
+        self.registry.observe("llm_queue_wait_seconds", waited, help="Time LLM calls waited for admission")
+        if trace is not None:
+            trace.record("llm_queue_wait", waited)
+
+    @staticmethod
+    def _check(cancel):
+        if cancel is not None:
+            cancel.check()
+
+    @staticmethod
+    def _until_deadline(wait, cancel):
+        """Shorten a wait so it ends no later than the turn's deadline"""
+        remaining = cancel.remaining() if cancel is not None else None
+        return wait if remaining is None else min(wait, max(0.0, remaining))
+
+    def _timeout_error(self, waited):
+        """Count a call that gave up waiting (caller holds the lock)"""
+        self.timeouts += 1
+        return AdmissionTimeoutError(f"The assistant is busy (waited {waited:.0f}s), please try again.",
+                                     retry_after=1.0)
+
+    def acquire(self, trace=None, cancel=None):
+        """Block until a call may start; raises TurnCancelledError if cancel fires first"""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+            try:
+                while True:
+                    self._check(cancel)
+                    wait = self._try_enter()
+                    if not wait:
+                        break
+                    waited = time.monotonic() - start
+                    if self.queue_timeout and waited + wait > self.queue_timeout:
+                        raise self._timeout_error(waited)
+                    self._released.wait(timeout=self._until_deadline(wait, cancel))
+            finally:
+                self.waiting -= 1
+        self._admitted(time.monotonic() - start, trace)
+
+    async def aacquire(self, trace=None, cancel=None):
+        """Wait on the event loop until a call may start.
+
+        Waiters are admitted in arrival order and, while the cap is full,
+        sleep until release() wakes the first of them.
+        """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        wake = lambda: loop.call_soon_threadsafe(event.set)
+        if cancel is not None:
+            cancel.on_cancel(wake)
+        with self._lock:
+            self.waiting += 1
+            self._async_waiters.append(waiter)
+        try:
+            while True:
+                self._check(cancel)
+                with self._lock:
+                    event.clear()
+                    waited = time.monotonic() - start
+                    if self._async_waiters[0] is not waiter or self.in_flight >= self.max_concurrency:
+                        # Wait for release() (or the queue timeout) instead of polling
+                        wait = self.queue_timeout - waited if self.queue_timeout else None
+                        if wait is not None and wait <= 0:
+                            raise self._timeout_error(waited)
+                    else:
+                        wait = self._try_enter()
+                        if not wait:
+                            break
+                        if self.queue_timeout and waited + wait > self.queue_timeout:
+                            raise self._timeout_error(waited)
+                if cancel is not None and cancel.remaining() is not None:
+                    wait = max(0.0, cancel.remaining()) if wait is None else self._until_deadline(wait, cancel)
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if cancel is not None:
+                cancel.remove_callback(wake)
+            with self._lock:
+                self.waiting -= 1
+                first = self._async_waiters[0] is waiter
+                self._async_waiters.remove(waiter)
+                if first:
+                    # Admitted or gone: the next waiter may be able to start too
+                    self._wake_async_waiter()
+        self._admitted(time.monotonic() - start, trace)
+
+    def release(self, upstream_ok=True):
+        """End a call. upstream_ok is True if the upstream answered, False if it
+        failed, None if the call ended without a verdict (e.g. the client left)"""
+        with self._lock:
+            self.in_flight -= 1
+            if upstream_ok:
+                self.breaker.record_success()
+            elif upstream_ok is None:
+                self.breaker.release_trial()
+            else:
+                self.breaker.record_failure(time.monotonic())
+            self._released.notify_all()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self):
+        """Let the first aacquire() waiter try again (caller holds the lock)"""
+        if self._async_waiters:
+            loop, event = self._async_waiters[0]
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Its loop is closed; the waiter is gone
+
+    @staticmethod
+    def _verdict(error, received, cancel=None):
+        # A stream that broke midway did reach the upstream; errors such as a
+        # 400 mean the upstream is up; only transient failures count against it.
+        # A request cut short by its own turn's deadline says nothing either
+        if received or (cancel is not None and (cancel.cancelled or cancel.expired)):
+            return None
+        return not is_retryable(error)
+
+    def _sleep(self, delay, trace, cancel):
+        with trace_span(trace, "llm_backoff"):
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+
+    # Retries
+
+    def _backoff(self, attempt, error):
+        """Full-jitter exponential backoff, at least the server's Retry-After"""
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        hinted = retry_after(error)
+        if hinted is not None:
+            delay = max(delay, min(hinted, self.retry_max_delay))
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def _should_retry(self, attempt, error, received):
+        return not received and attempt < self.max_retries and is_retryable(error)
+
+    def call(self, fn, trace=None, on_start=None, cancel=None):
+        """Run fn() under admission control, retrying transient failures until cancel fires"""
+        attempt = 0
+        while True:
+            self.acquire(trace, cancel)
+            if on_start:
+                on_start()
+            try:
+                value = fn()
+            except Exception as e:
+                self.release(self._verdict(e, False, cancel))
+                if not self._should_retry(attempt, e, False):
+                    raise
+                delay = self._backoff(attempt, e)
+            except BaseException:
+                # KeyboardInterrupt, SystemExit...: free the slot without a verdict
+                self.release(None)
+                raise
+            else:
+                self.release()
+                return value
+            self._sleep(delay, trace, cancel)
+            attempt += 1
+
+    def stream(self, make_stream, trace=None, on_start=None, cancel=None):
+        """Yield from make_stream() under admission control.
+
+        Failures before the first chunk are retried; a failure after it is
+        raised to the caller, which keeps the partial reply. Closing the
+        generator (e.g. when the turn is cancelled) frees the slot at once.
+        """
+        attempt = 0
+        while True:
+            self.acquire(trace, cancel)
+            if on_start:
+                on_start()
+            received = False
+            try:
+                for chunk in make_stream():
+                    received = True
+                    yield chunk
+            except Exception as e:
+                self.release(self._verdict(e, received, cancel))
+                if not self._should_retry(attempt, e, received):
+                    raise
+                delay = self._backoff(attempt, e)
+            except BaseException:
+                # GeneratorExit when the caller closes us, or KeyboardInterrupt...
+                self.release(None)
+                raise
+            else:
+                self.release()
+                return
+            self._sleep(delay, trace, cancel)
+            attempt += 1
+
+    async def astream(self, make_stream, trace=None, on_start=None, cancel=None):
+        """Async version of stream() for make_stream() returning an async iterator"""
+        attempt = 0
+        while True:
+            await self.aacquire(trace, cancel)
+            if on_start:
+                on_start()
+            received = False
+            chunks = make_stream()
+            try:
+                async for chunk in chunks:
+                    received = True
+                    yield chunk
+            except Exception as e:
+                self.release(self._verdict(e, received, cancel))
+                if not self._should_retry(attempt, e, received):
+                    raise
+                delay = self._backoff(attempt, e)
+            except BaseException:
+                # GeneratorExit or CancelledError when the caller gives up
+                self.release(None)
+                # Close the HTTP stream now, not whenever the generator is garbage-collected
+                await chunks.aclose()
+                raise
+            else:
+                self.release()
+                return
+            with trace_span(trace, "llm_backoff"):
+                await asyncio.sleep(self._until_deadline(delay, cancel))
+            attempt += 1
+
+    def stats(self):
+        """Return admission counters, queue wait and breaker state"""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_concurrency": self.max_concurrency,
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_queue_wait": self.total_queue_wait / self.admitted if self.admitted else 0.0,
+                "max_queue_wait": self.max_queue_wait,
+                "circuit_open": int(self.breaker.state != CircuitBreaker.CLOSED),
+                "circuit_state": self.breaker.state,
+            }
+
+
+def create_admission_controller():
+    """Create the controller configured by the LLM_* environment variables"""
+    requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+    burst = os.getenv("LLM_BURST")
+    return AdmissionController(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "10")),
+        requests_per_minute=requests_per_minute,
+        burst=float(burst) if burst else None,
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        retry_base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+        retry_max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+        breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        breaker_reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+        queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+    )
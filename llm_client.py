@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Shared LLM client for the AI Commerce Chatbot.
+
+create_llm() builds a single ChatOpenAI client backed by a pooled, keep-alive
+HTTP connection to the OpenAI-compatible endpoint. chatbot.py caches it with
+st.cache_resource so every session and rerun reuses the same connections
+instead of paying for a new client and TLS handshake each time. Async
+calls (used by api_server.py) get their own pooled client with the same
+limits.
+"""
+import os
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+DEFAULT_MODEL = "meta-llama/Llama-3.2-90B-Vision-Instruct-Turbo"
+DEFAULT_BASE_URL = "https://api.together.xyz/v1"
+
+
+def load_llm_config():
+    """Read LLM client settings from environment variables"""
+    return {
+        "model": os.getenv("LLM_MODEL", DEFAULT_MODEL),
+        # Optional cheaper model for routine questions (see intent_router.py)
+        "small_model": os.getenv("LLM_SMALL_MODEL", ""),
+        "base_url": os.getenv("LLM_BASE_URL", DEFAULT_BASE_URL),
+        "pool_size": int(os.getenv("LLM_POOL_SIZE", "20")),
+        "keepalive_connections": int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "10")),
+        "keepalive_expiry": float(os.getenv("LLM_KEEPALIVE_SECONDS", "60")),
+        "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("LLM_READ_TIMEOUT", "60")),
+    }
+
+
+def _pool_settings(config):
+    limits = httpx.Limits(
+        max_connections=config["pool_size"],
+        max_keepalive_connections=config["keepalive_connections"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"])
+    return {"limits": limits, "timeout": timeout}
+
+
+def create_http_client(config):
+    """Create a pooled HTTP client with keep-alive connections"""
+    return httpx.Client(**_pool_settings(config))
+
+
+def create_async_http_client(config):
+    """Create the asyncio counterpart of create_http_client(), used by astream()/ainvoke()"""
+    return httpx.AsyncClient(**_pool_settings(config))
+
+
+def create_llm(api_key, config=None, model=None):
+    """Create the chat model client shared by all sessions (config["model"] unless model is given)"""
+    config = config or load_llm_config()
+    return ChatOpenAI(
+        model=model or config["model"],
+        openai_api_key=api_key,
+        openai_api_base=config["base_url"],
+        http_client=create_http_client(config),
+        http_async_client=create_async_http_client(config),
+        timeout=config["read_timeout"],
+        # Retries are done by llm_admission.AdmissionController, with backoff
+        # shared by all sessions; the client itself fails fast
+        max_retries=0,
+    )
+
+
+def create_small_llm(api_key, config=None):
+    """Create the client for LLM_SMALL_MODEL, or return None if it is not set"""
+    config = config or load_llm_config()
+    if not config["small_model"]:
+        return None
+    return create_llm(api_key, config, model=config["small_model"])
+
+
+def open_connection(llm, config=None):
+    """Open a keep-alive connection to the model endpoint ahead of the first request.
+
+    Any response, even an error status, leaves a warm connection in the
+    pool. Returns False if the endpoint could not be reached.
+    """
+    config = config or load_llm_config()
+    try:
+        llm.http_client.head(config["base_url"])
+    except httpx.HTTPError:
+        return False
+    return True
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Per-turn performance instrumentation for the AI Commerce Chatbot.
+
+Each script rerun gets a TurnTrace that times the stages of a turn (history
+listing, memory assembly, LLM request, render, save) and records token
+counts. When the rerun finishes the trace is:
+
+- logged as one JSON line on the "chatbot.metrics" logger (stderr, or the
+  file named by METRICS_LOG)
+- added to the process-wide MetricsRegistry, whose histograms aggregate
+  every session and are exported in Prometheus text format on METRICS_PORT
+  (/metrics) and/or written to METRICS_FILE
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("chatbot.metrics")
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+METRIC_PREFIX = "chatbot_"
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Thread-safe histograms, counters and gauges shared by all sessions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._counters = {}     # (name, labels) -> value
+        self._help = {}
+        self._collectors = []   # callables returning {name: value} gauges
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, help=None, **labels):
+        """Add one observation to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+            if help:
+                self._help.setdefault(name, help)
+
+    def inc(self, name, value=1, help=None, **labels):
+        """Increase a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def add_collector(self, collector):
+        """Register a callable returning current gauge values as {name: value}"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+            help_text = dict(self._help)
+            collectors = list(self._collectors)
+
+        gauges = {}
+        for collector in collectors:
+            try:
+                gauges.update(collector())
+            except Exception:
+                logger.exception("Error collecting metrics")
+
+        lines = []
+
+        def header(name, kind):
+            full = METRIC_PREFIX + name
+            if name in help_text:
+                lines.append(f"# HELP {full} {help_text[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name in sorted({name for name, _ in histograms}):
+            full = header(name, "histogram")
+            for (hist_name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if hist_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{full}_bucket{_format_labels(labels, {'le': _format_value(bound)})} {bucket_count}")
+                lines.append(f"{full}_bucket{_format_labels(labels, {'le': '+Inf'})} {count}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(float(total))}")
+                lines.append(f"{full}_count{_format_labels(labels)} {count}")
+
+        for name in sorted({name for name, _ in counters}):
+            full = header(name, "counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, value in sorted(gauges.items()):
+            if value is None:
+                continue
+            full = header(name, "gauge")
+            lines.append(f"{full} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the Prometheus text to path atomically (for the node_exporter textfile collector)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+# Aggregates every session in this server process
+REGISTRY = MetricsRegistry()
+
+
+class TurnTrace:
+    """Timing spans and token counts for one script rerun"""
+
+    def __init__(self, session_id=None, conversation_id=None):
+        self.session_id = session_id
+        self.conversation_id = conversation_id
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.values = {}
+        self.turn = False
+        self.total_time = None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the enclosed block; repeated spans of the same name add up"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Record a duration measured elsewhere"""
+        if seconds is not None:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, name, value):
+        """Record a value such as a token count"""
+        if value is not None:
+            self.values[name] = value
+
+    def as_dict(self):
+        """Trace as a JSON-serializable record (durations in milliseconds)"""
+        record = {
+            "event": "turn" if self.turn else "rerun",
+            "session_id": self.session_id,
+            "conversation_id": self.conversation_id,
+            "rerun_ms": round((self.total_time or 0.0) * 1000, 3),
+        }
+        record.update({f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.spans.items()})
+        record.update(self.values)
+        return record
+
+    def finish(self, registry=REGISTRY):
+        """Close the trace, log it and add it to the registry; returns the record"""
+        self.total_time = time.perf_counter() - self.started
+        record = self.as_dict()
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        registry.observe("rerun_seconds", self.total_time, help="Streamlit script rerun duration",
+                         turn=str(self.turn).lower())
+        for name, seconds in self.spans.items():
+            registry.observe("stage_seconds", seconds, help="Duration of each stage of a rerun", stage=name)
+        for name in ("prompt_tokens", "completion_tokens"):
+            if name in self.values:
+                registry.observe(name, self.values[name], buckets=TOKEN_BUCKETS,
+                                 help=f"{name.replace('_', ' ').capitalize()} per turn")
+        if self.turn:
+            registry.inc("turns_total", help="Chat turns answered",
+                         source=self.values.get("source", "model"))
+            if "route" in self.values:
+                registry.inc("routes_total", help="Chat turns by intent and route",
+                             intent=self.values.get("intent", ""), route=self.values["route"])
+        return record
+
+
+def trace_span(trace, name):
+    """trace.span(name), or a no-op when there is no trace"""
+    return trace.span(name) if trace is not None else contextlib.nullcontext()
+
+
+def count_tokens(text, llm=None):
+    """Count tokens with the model's tokenizer, or estimate (four characters per token)"""
+    if not text:
+        return 0
+    if llm is not None:
+        try:
+            return llm.get_num_tokens(text)
+        except Exception:
+            pass
+    return max(1, len(text) // 4)
+
+
+def stats_gauges(prefix, stats):
+    """Turn a stats() dict into gauges, skipping non-numeric values"""
+    return {f"{prefix}_{key}": value for key, value in stats.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry at /metrics"""
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise flood the Streamlit console
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=REGISTRY):
+    """Serve registry in Prometheus format on a background thread and return the server"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def configure_metrics(registry=REGISTRY):
+    """Set up the exports selected by METRICS_PORT, METRICS_FILE and METRICS_LOG.
+
+    Returns a dict with the running server (or None) and the file path (or
+    None). Call once per process.
+    """
+    log_path = os.getenv("METRICS_LOG", "stderr")
+    if log_path.lower() != "off":
+        if log_path.lower() == "stderr":
+            handler = logging.StreamHandler()
+        else:
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    server = None
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            server = start_metrics_server(int(port), os.getenv("METRICS_HOST", "0.0.0.0"), registry)
+        except OSError:
+            logger.exception("Could not start the metrics server on port %s", port)
+
+    return {"server": server, "file": os.getenv("METRICS_FILE") or None}
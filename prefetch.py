@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Warm-start prefetch of first-turn replies.
+
+The sidebar Quick Actions send fixed messages to a chat whose memory holds
+only the system prompt, and many users open with the same few questions, so
+those first replies can be generated before anyone asks. When the server
+starts, Prefetcher runs each Quick Action prompt, plus the most common first
+questions found in the most recent saved conversations, through
+ChatEngine.prefetch() on a background thread and keeps the replies in the
+response cache. The first click then returns instantly.
+
+Cache keys include the model and a hash of the system prompt, so a changed
+prompt or model never serves an old reply: the startup pass finds nothing
+cached under the new keys and generates the replies again. After that the
+replies are regenerated every PREFETCH_INTERVAL seconds (keep it below
+RESPONSE_CACHE_TTL so they never expire in between), at most
+PREFETCH_CONCURRENCY at a time so users' turns keep most of the model's
+capacity.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from prompts import QUICK_ACTIONS
+from response_cache import normalize_input
+
+logger = logging.getLogger(__name__)
+
+# A first question must have been asked this often to be prefetched
+MIN_QUESTION_COUNT = 2
+MAX_QUESTION_WORDS = 40
+
+
+def first_question(conversation):
+    """The first user message of a saved conversation, or None"""
+    for message in conversation.get("messages", []):
+        if message.get("role") == "user":
+            return message.get("content")
+    return None
+
+
+class Prefetcher:
+    """Keeps the replies to common first messages in the engine's response cache"""
+
+    def __init__(self, engine, prompts=tuple(prompt for _, prompt in QUICK_ACTIONS), top_questions=10,
+                 scan=500, concurrency=2, interval=1800):
+        self.engine = engine
+        self.prompts = list(prompts)
+        self.top_questions = top_questions
+        self.scan = scan
+        self.concurrency = concurrency
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._lock = threading.Lock()
+        self.outcomes = Counter()  # "generated", "cached", "template", "failed"
+        self.refreshes = 0
+        self.questions = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = 0.0
+
+    @property
+    def version(self):
+        """Short hash of the models and system prompt the cached replies belong to"""
+        models = [self.engine.llm.model_name]
+        if self.engine.small_llm is not None:
+            models.append(self.engine.small_llm.model_name)
+        return hashlib.sha256("\x1f".join(models + [self.engine.system_prompt]).encode("utf-8")).hexdigest()[:12]
+
+    def popular_questions(self):
+        """The most common first user messages in the scan most recent saved conversations"""
+        if not self.top_questions or not self.scan or self.engine.store is None:
+            return []
+        prompts = {normalize_input(prompt) for prompt in self.prompts}
+        counts = Counter()
+        wording = {}
+        for entry in self.engine.store.list_conversations(limit=self.scan):
+            try:
+                question = first_question(self.engine.store.load_conversation(entry["id"]))
+            except (OSError, ValueError, KeyError):
+                continue
+            if not question or len(question.split()) > MAX_QUESTION_WORDS:
+                continue
+            key = normalize_input(question)
+            if key in prompts:
+                continue
+            counts[key] += 1
+            wording.setdefault(key, question)
+        return [wording[key] for key, count in counts.most_common(self.top_questions) if count >= MIN_QUESTION_COUNT]
+
+    def all_questions(self):
+        """Quick Action prompts followed by the popular first questions"""
+        return self.prompts + self.popular_questions()
+
+    def _warm(self, question, force):
+        if self._stop.is_set():
+            return "skipped"
+        try:
+            return self.engine.prefetch(question, force=force)
+        except Exception as e:
+            logger.warning("Could not prefetch a reply to %r: %s", question, e)
+            return "failed"
+
+    def refresh(self, force=False):
+        """Prefetch every question now; force=True regenerates replies that are already cached"""
+        started = time.perf_counter()
+        questions = self.all_questions()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prefetch") as pool:
+            outcomes = Counter(pool.map(lambda question: self._warm(question, force), questions))
+        outcomes.pop("skipped", None)
+        with self._lock:
+            self.outcomes.update(outcomes)
+            self.refreshes += 1
+            self.questions = len(questions)
+            self.last_refresh = time.time()
+            self.last_refresh_seconds = time.perf_counter() - started
+        logger.info("Prefetched %d first-turn replies for version %s in %.1fs: %s", len(questions),
+                    self.version, self.last_refresh_seconds, dict(outcomes))
+        return outcomes
+
+    def _run(self):
+        force = False
+        while not self._stop.is_set():
+            self.refresh(force=force)
+            force = True
+            if not self.interval or self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        """Prefetch on a daemon thread now, then again every interval seconds (interval 0: only now)"""
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop after the questions being generated right now"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Return the reply version, refresh counts, the number of questions and the outcome of their prefetches"""
+        with self._lock:
+            return {
+                "version": self.version,
+                "refreshes": self.refreshes,
+                "questions": self.questions,
+                "generated": self.outcomes["generated"],
+                "cached": self.outcomes["cached"],
+                "template": self.outcomes["template"],
+                "failed": self.outcomes["failed"],
+                "last_refresh_seconds": self.last_refresh_seconds,
+            }
+
+
+def start_prefetcher(engine):
+    """Start the prefetcher configured by PREFETCH_* settings and attach it to the engine.
+
+    Returns None if PREFETCH=off or the engine has no response cache.
+    """
+    if os.getenv("PREFETCH", "on").lower() in ("off", "false", "0") or engine.response_cache is None:
+        return None
+    prefetcher = Prefetcher(engine,
+                            top_questions=int(os.getenv("PREFETCH_TOP_QUESTIONS", "10")),
+                            scan=int(os.getenv("PREFETCH_SCAN", "500")),
+                            concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "2")),
+                            interval=float(os.getenv("PREFETCH_INTERVAL", "1800")))
+    engine.prefetcher = prefetcher
+    return prefetcher.start()
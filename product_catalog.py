@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Product catalog retrieval for the AI Commerce Chatbot.
+
+A product catalog (CSV or JSONL) is built offline into an index directory
+(see build_catalog_index.py) that ProductCatalog opens with memory-mapped
+NumPy arrays, so loading takes milliseconds regardless of catalog size and
+the pages are shared between processes.
+
+The index holds:
+
+- product columns (sku, title, brand, category, description, url, price,
+  rating), stored as UTF-8 blobs with offset arrays
+- a BM25 inverted index over hashed terms, with each posting's score
+  contribution precomputed at build time, so a query is a few vectorized
+  additions over the query terms' posting lists
+- a 64-dimensional hashed word + character-trigram vector per product,
+  grouped by k-means cluster (IVF), so vector search scans only the
+  clusters closest to the query; it catches typos and partial words that
+  BM25 misses
+
+search() fuses both rankings with reciprocal rank fusion. The chat engine
+injects the best matches into the prompt so the model can recommend real
+products instead of asking clarifying questions.
+"""
+import os
+import re
+import csv
+import json
+import time
+import zlib
+import shutil
+import threading
+from collections import Counter
+
+import numpy as np
+
+INDEX_VERSION = 1
+TEXT_COLUMNS = ("sku", "title", "brand", "category", "description", "url")
+NUMBER_COLUMNS = ("price", "rating")
+COLUMN_ALIASES = {
+    "id": "sku", "product_id": "sku", "item_id": "sku",
+    "name": "title", "product_name": "title",
+    "manufacturer": "brand",
+    "categories": "category", "department": "category",
+    "desc": "description", "details": "description",
+    "link": "url", "product_url": "url",
+    "cost": "price", "list_price": "price",
+    "stars": "rating", "review_rating": "rating",
+}
+
+HASH_BITS = 20
+VECTOR_DIM = 64
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+MAX_POSTINGS = 20000
+DESCRIPTION_CHARS = 240
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i im in is it its me my of on or our "
+    "please show that the their them this to us want was we what with you your can could "
+    "would looking need find get some any".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase words without stopwords, with a light plural stemmer"""
+    terms = []
+    for word in _TOKEN_RE.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def _hash(feature, bits=HASH_BITS):
+    return zlib.crc32(feature.encode("utf-8")) & ((1 << bits) - 1)
+
+
+class HashingEncoder:
+    """Dense vectors from hashed words and character trigrams (no model needed)"""
+
+    def __init__(self, dim=VECTOR_DIM):
+        self.dim = dim
+        self._cache = {}
+
+    def _features(self, word):
+        features = self._cache.get(word)
+        if features is None:
+            padded = f"#{word}#"
+            grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            hashed = [zlib.crc32(g.encode("utf-8")) for g in [word] + grams]
+            # Low bits pick the dimension, one high bit the sign
+            features = [(h % self.dim, 1.0 if h & 0x80000000 else -1.0, 1.0 if i == 0 else 0.5)
+                        for i, h in enumerate(hashed)]
+            if len(self._cache) < 500000:
+                self._cache[word] = features
+        return features
+
+    def encode(self, text):
+        """L2-normalized float32 vector for text"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in tokenize(text):
+            for index, sign, weight in self._features(word):
+                vector[index] += sign * weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def _normalize_row(row):
+    product = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip().lower().replace(" ", "_")
+        key = COLUMN_ALIASES.get(key, key)
+        if key in TEXT_COLUMNS or key in NUMBER_COLUMNS:
+            product.setdefault(key, value)
+    return product
+
+
+def read_products(path):
+    """Yield product dicts from a CSV or JSONL file, mapping common column names"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield _normalize_row(json.loads(line))
+        else:
+            for row in csv.DictReader(f):
+                yield _normalize_row(row)
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace("$", "").replace(",", "").strip())
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _document_text(product):
+    """Text indexed for BM25: the title counts twice"""
+    return " ".join([product.get("title", "")] * 2 + [product.get(c, "") for c in ("brand", "category", "description")])
+
+
+def _vector_text(product):
+    return " ".join(product.get(c, "") for c in ("title", "brand", "category"))
+
+
+def _kmeans(vectors, clusters, iterations=8, sample_size=100000, seed=0):
+    """Spherical k-means on a sample of unit vectors; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk=65536):
+    return np.concatenate([np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), chunk)]) if len(vectors) else np.zeros(0, np.int64)
+
+
+def _write_strings(directory, name, values):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    with open(os.path.join(directory, f"{name}.bin"), 'wb') as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+
+def build_index(products, index_dir, clusters=None, log=None):
+    """Build a catalog index directory from an iterable of product dicts; returns the product count.
+
+    The index is written to a temporary directory and swapped into place,
+    so a running app never sees a half-written index.
+    """
+    log = log or (lambda message: None)
+    started = time.perf_counter()
+    columns = {name: [] for name in TEXT_COLUMNS}
+    numbers = {name: [] for name in NUMBER_COLUMNS}
+    term_cache = {}
+    posting_terms, posting_docs, posting_tf = [], [], []
+    doc_lengths = []
+    encoder = HashingEncoder()
+    vectors = []
+
+    for doc, product in enumerate(products):
+        for name in TEXT_COLUMNS:
+            value = str(product.get(name) or "").strip()
+            if name == "description":
+                value = value[:DESCRIPTION_CHARS]
+            columns[name].append(value)
+        for name in NUMBER_COLUMNS:
+            numbers[name].append(_to_float(product.get(name)))
+        if not columns["sku"][-1]:
+            columns["sku"][-1] = str(doc)
+
+        counts = Counter(tokenize(_document_text(product)))
+        doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            bucket = term_cache.get(term)
+            if bucket is None:
+                bucket = term_cache[term] = _hash(term)
+            posting_terms.append(bucket)
+            posting_docs.append(doc)
+            posting_tf.append(tf)
+        vectors.append(encoder.encode(_vector_text(product)))
+        if (doc + 1) % 100000 == 0:
+            log(f"  read {doc + 1:,} products")
+
+    count = len(doc_lengths)
+    if not count:
+        raise ValueError("The catalog has no products")
+    log(f"  indexing {count:,} products, {len(term_cache):,} distinct terms")
+
+    # BM25 postings grouped by hashed term, with precomputed per-posting scores
+    terms = np.asarray(posting_terms, dtype=np.int64)
+    docs = np.asarray(posting_docs, dtype=np.int32)
+    tf = np.asarray(posting_tf, dtype=np.float32)
+    lengths = np.asarray(doc_lengths, dtype=np.float32)
+    buckets = 1 << HASH_BITS
+    offsets = np.zeros(buckets + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=buckets), out=offsets[1:])
+    df = np.diff(offsets)[terms].astype(np.float32)
+    idf = np.log(1 + (count - df + 0.5) / (df + 0.5))
+    avgdl = float(lengths.mean()) or 1.0
+    impacts = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / avgdl))
+    # Highest impact first within each term, so queries can stop early on common terms
+    order = np.lexsort((-impacts, terms))
+    docs, impacts = docs[order], impacts[order]
+
+    # Vectors grouped by cluster so a query scans a few contiguous slices
+    vectors = np.vstack(vectors).astype(np.float32)
+    clusters = clusters or max(1, min(4096, int(np.sqrt(count))))
+    if clusters > 1:
+        centroids = _kmeans(vectors, clusters)
+        assignment = _assign(vectors, centroids)
+    else:
+        centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        assignment = np.zeros(count, dtype=np.int64)
+    vector_order = np.argsort(assignment, kind="stable")
+    cluster_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=cluster_offsets[1:])
+
+    index_dir = os.path.abspath(index_dir)
+    tmp_dir = f"{index_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in columns.items():
+        _write_strings(tmp_dir, name, values)
+    for name, values in numbers.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(values, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, "postings.offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "postings.docs.npy"), docs)
+    np.save(os.path.join(tmp_dir, "postings.impacts.npy"), impacts.astype(np.float16))
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors[vector_order].astype(np.float16))
+    np.save(os.path.join(tmp_dir, "vectors.docs.npy"), vector_order.astype(np.int32))
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_dir, "clusters.offsets.npy"), cluster_offsets)
+    meta = {
+        "version": INDEX_VERSION,
+        "products": count,
+        "hash_bits": HASH_BITS,
+        "vector_dim": int(vectors.shape[1]),
+        "clusters": int(len(centroids)),
+        "avgdl": avgdl,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = f"{index_dir}.old{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    log(f"  built in {time.perf_counter() - started:.1f}s")
+    return count
+
+
+class ProductCatalog:
+    """Read-only, memory-mapped catalog index with hybrid BM25 + vector search"""
+
+    def __init__(self, index_dir, results=5, min_similarity=0.5):
+        self.index_dir = index_dir
+        self.results = results
+        self.min_similarity = min_similarity
+        self.searches = 0
+        self.search_seconds = 0.0
+        with open(os.path.join(index_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Catalog index {index_dir} has version {self.meta.get('version')}, "
+                             f"expected {INDEX_VERSION}; rebuild it with build_catalog_index.py")
+        self.size = self.meta["products"]
+        self.version = self.meta["built"]
+        self._strings = {name: (self._blob(name), self._array(f"{name}.offsets")) for name in TEXT_COLUMNS}
+        self._numbers = {name: self._array(name) for name in NUMBER_COLUMNS}
+        self._postings_offsets = self._array("postings.offsets")
+        self._postings_docs = self._array("postings.docs")
+        self._postings_impacts = self._array("postings.impacts")
+        self._vectors = self._array("vectors")
+        self._vector_docs = self._array("vectors.docs")
+        self._centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self._cluster_offsets = self._array("clusters.offsets")
+        self._encoder = HashingEncoder(self.meta["vector_dim"])
+        self._scratch = threading.local()
+
+    def _array(self, name):
+        return np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+
+    def _blob(self, name):
+        path = os.path.join(self.index_dir, f"{name}.bin")
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return self.size
+
+    def product(self, doc):
+        """Columns of one product as a dict"""
+        product = {}
+        for name, (blob, offsets) in self._strings.items():
+            value = bytes(blob[offsets[doc]:offsets[doc + 1]]).decode("utf-8")
+            if value:
+                product[name] = value
+        for name, values in self._numbers.items():
+            value = float(values[doc])
+            if not np.isnan(value):
+                product[name] = value
+        return product
+
+    def _score_buffer(self):
+        # Reused per thread; only touched entries are reset after each query
+        scores = getattr(self._scratch, "scores", None)
+        if scores is None:
+            scores = self._scratch.scores = np.zeros(self.size, dtype=np.float32)
+        return scores
+
+    def bm25(self, query, k=20, max_postings=MAX_POSTINGS):
+        """Top-k (doc ids, scores) by BM25.
+
+        Only the max_postings highest-impact postings of each term are read,
+        which bounds query time for very common terms at a small cost in recall.
+        """
+        buckets = {_hash(term, self.meta["hash_bits"]) for term in tokenize(query)}
+        scores = self._score_buffer()
+        touched = []
+        for bucket in buckets:
+            start, end = self._postings_offsets[bucket], self._postings_offsets[bucket + 1]
+            end = min(end, start + max_postings)
+            if start == end:
+                continue
+            docs = self._postings_docs[start:end]
+            scores[docs] += self._postings_impacts[start:end]
+            touched.append(docs)
+        if not touched:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        candidates = np.concatenate(touched) if len(touched) > 1 else np.asarray(touched[0])
+        candidate_scores = scores[candidates]
+        scores[candidates] = 0
+        # A document appears once per matching term, so this many entries hold k distinct ones
+        limit = k * len(touched)
+        if len(candidates) > limit:
+            top = np.argpartition(-candidate_scores, limit)[:limit]
+            candidates, candidate_scores = candidates[top], candidate_scores[top]
+        candidates, first = np.unique(candidates, return_index=True)
+        candidate_scores = candidate_scores[first]
+        order = np.argsort(-candidate_scores, kind="stable")[:k]
+        return candidates[order].astype(np.int64), candidate_scores[order]
+
+    def vector_search(self, query, k=20, nprobe=8):
+        """Top-k (doc ids, cosine similarities) from the nprobe closest clusters"""
+        query_vector = self._encoder.encode(query)
+        if not query_vector.any():
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        nearest = np.argsort(-(self._centroids @ query_vector))[:nprobe]
+        slices = [(self._cluster_offsets[c], self._cluster_offsets[c + 1]) for c in nearest]
+        ranges = [np.arange(start, end) for start, end in slices if end > start]
+        if not ranges:
+            # Every probed cluster is empty
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        rows = np.concatenate(ranges)
+        similarities = np.asarray(self._vectors[rows], dtype=np.float32) @ query_vector
+        if len(rows) > k:
+            top = np.argpartition(-similarities, k)[:k]
+            rows, similarities = rows[top], similarities[top]
+        order = np.argsort(-similarities, kind="stable")
+        return self._vector_docs[rows[order]].astype(np.int64), similarities[order]
+
+    def search(self, query, k=None, min_similarity=None, candidates=50):
+        """Best products for query, fusing BM25 and vector rankings (reciprocal rank fusion).
+
+        Products found only by vector search need at least min_similarity.
+        """
+        started = time.perf_counter()
+        k = self.results if k is None else k
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        bm25_docs, bm25_scores = self.bm25(query, candidates)
+        vector_docs, similarities = self.vector_search(query, candidates)
+        fused = {}
+        for rank, (doc, score) in enumerate(zip(bm25_docs.tolist(), bm25_scores.tolist())):
+            entry = fused.setdefault(doc, {"rrf": 0.0})
+            entry["rrf"] += 1.0 / (RRF_K + rank + 1)
+            entry["bm25"] = score
+        for rank, (doc, similarity) in enumerate(zip(vector_docs.tolist(), similarities.tolist())):
+            if doc not in fused and similarity < min_similarity:
+                continue
+            entry = fused.setdefault(doc, {"rrf": 0.0})
+            entry["rrf"] += 1.0 / (RRF_K + rank + 1)
+            entry["similarity"] = similarity
+        best = sorted(fused.items(), key=lambda item: -item[1]["rrf"])[:k]
+        results = []
+        for doc, scores in best:
+            product = self.product(doc)
+            product["score"] = scores["rrf"]
+            results.append(product)
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self):
+        """Return the catalog size and search count and average time"""
+        return {
+            "products": self.size,
+            "searches": self.searches,
+            "avg_search_ms": self.search_seconds / self.searches * 1000 if self.searches else 0.0,
+        }
+
+
+def format_products(products):
+    """Catalog matches as a short list for the prompt"""
+    lines = []
+    for product in products:
+        details = ", ".join(product[c] for c in ("brand", "category") if product.get(c))
+        line = f"- [{product['sku']}] {product.get('title', '')}"
+        if details:
+            line += f" ({details})"
+        if "price" in product:
+            line += f", ${product['price']:,.2f}"
+        if "rating" in product:
+            line += f", rated {product['rating']:.1f}/5"
+        if product.get("description"):
+            line += f": {product['description']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def create_catalog():
+    """Open the catalog index at PRODUCT_CATALOG_INDEX, or return None if it is not set up"""
+    index_dir = os.getenv("PRODUCT_CATALOG_INDEX", "catalog_index")
+    if not os.path.exists(os.path.join(index_dir, "meta.json")):
+        return None
+    return ProductCatalog(index_dir,
+                          results=int(os.getenv("CATALOG_RESULTS", "5")),
+                          min_similarity=float(os.getenv("CATALOG_MIN_SIMILARITY", "0.5")))
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Product comparisons with parallel per-product sub-queries.
+
+Asked to compare several products in one prompt, the model writes the
+longest completion of any turn, one product after another. When the intent
+router sends a message to the "compare" route, ProductComparer instead:
+
+1. pulls the product names out of the request ("iPhone 15 vs Pixel 8",
+   "compare the Sony XM5, Bose QC45 and AirPods Max for travel") and looks
+   each one up in the product catalog
+2. asks the model for a short profile of every product (key specs, pros
+   and cons, price notes) concurrently, at most COMPARE_CONCURRENCY at a
+   time, streaming each profile to the user as soon as it arrives
+3. turns the profiles into a comparison table and a recommendation with
+   one short synthesis call, streamed token by token
+
+A turn takes about as long as its slowest profile plus the synthesis,
+rather than one completion covering every product. Requests without at
+least two recognizable products (such as the "⭐ Product Compare" Quick
+Action, which asks for help choosing), or with a catalog configured, fewer
+than two that match a catalog product, are answered by the regular chat path.
+"""
+import os
+import re
+import time
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
+
+from cancellation import ABANDONED, CancelToken, TurnCancelledError, cancel_future
+from metrics import trace_span
+from product_catalog import format_products
+from prompts import (COMMERCE_SYSTEM_PROMPT, COMPARE_CATALOG_NOTE, COMPARE_HISTORY_NOTE, COMPARE_PROFILE_PROMPT,
+                     COMPARE_SYNTHESIS_PROMPT, COMPARE_UNAVAILABLE_NOTE)
+from streaming import StreamResult, acancellable, cancellable, request_options
+
+MAX_NAME_WORDS = 8
+
+# "compare ...", "difference between ...", "which is better ..." introduce the products
+_LEAD = re.compile(r"\b(?:compar(?:e|ing)|comparisons? (?:of|between)|differences? between"
+                   r"|(?:choose|decide|pick) between|which (?:one )?is better(?: between)?)\b[\s:,]*",
+                   re.IGNORECASE)
+_VERSUS = re.compile(r"\b(?:vs\.?|versus)(?=\s)", re.IGNORECASE)
+# Always between two products; "," "and" "or" only between name-shaped parts
+_HARD_SEPARATORS = re.compile(r"\s+(?:vs\.?|versus|against)(?=\s|$)\s*", re.IGNORECASE)
+_SOFT_SEPARATORS = re.compile(r"\s*(?:[,;]|\b(?:and|or)(?=\s|$))\s*", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<!vs)[.?!]+(?:\s+|$)", re.IGNORECASE)
+# What the products are compared on: "... for travel", "for gaming, X or Y"
+_TRAILING_FOCUS = re.compile(r"\s+(?:for|in terms of|when it comes to|regarding|based on|on)\s+(.+)$", re.IGNORECASE)
+_LEADING_FOCUS = re.compile(r"^(?:for|in terms of|when it comes to)\s+([^,:]+)[,:]\s*", re.IGNORECASE)
+_LEADING_WORDS = re.compile(r"^(?:(?:the|a|an|my|your|these|those|this|that|between|both|latest)\s+)+",
+                            re.IGNORECASE)
+# "should I buy the ps5": the verb phrase before a product name
+_LEADING_VERBS = re.compile(r"^(?:(?:should|shall|would|could|can|do|will)\s+(?:i|we)\s+|(?:i|we)\s+(?:want|need|plan)\s+to\s+"
+                            r"|i(?:'m| am)\s+|we(?:'re| are)\s+)?(?:thinking (?:of|about)\s+|considering\s+)?"
+                            r"(?:buy(?:ing)?|get(?:ting)?|choos(?:e|ing)|pick(?:ing)?|go(?:ing)? (?:with|for)|consider(?:ing)?)\s+",
+                            re.IGNORECASE)
+# Words that refer to a product without naming it
+_REFERENCES = {"it", "this", "that", "these", "those", "them", "they", "one", "ones", "other", "others", "another",
+               "either", "both", "which", "what", "something", "anything", "mine", "yours", "new", "old", "first",
+               "second", "last", "current"}
+# Words of a clause rather than a product name ("which should I get")
+_CLAUSE_WORDS = {"i", "i'm", "we", "you", "me", "us", "should", "would", "could", "shall", "do", "does", "did",
+                 "is", "are", "am", "was", "were", "which", "what", "how", "why", "if", "whether"}
+
+
+# Words that join a product to its attributes ("a laptop with 16GB")
+_LINKING_WORDS = {"with", "without", "to", "from", "of", "in", "at", "by"}
+
+
+def _is_product_name(name):
+    words = name.lower().split()
+    return not (all(word in _REFERENCES for word in words) or any(word in _CLAUSE_WORDS for word in words))
+
+
+def _is_name_shaped(name):
+    """Looks like a product name on its own: "Bose QC45", "ps5", not "laptop with 16GB" """
+    words = name.split()
+    return (0 < len(words) <= MAX_NAME_WORDS and not any(word.lower() in _LINKING_WORDS for word in words)
+            and (words[0][0].isupper() or any(c.isdigit() for c in words[0])))
+
+
+def _clean_name(part):
+    name = _LEADING_WORDS.sub("", part.strip(" .,:;!?\"'()")).strip()
+    return _LEADING_WORDS.sub("", _LEADING_VERBS.sub("", name)).strip()
+
+
+def _split_names(text):
+    parts = []
+    for part in _HARD_SEPARATORS.split(text):
+        pieces = [_clean_name(piece) for piece in _SOFT_SEPARATORS.split(part)]
+        pieces = [piece for piece in pieces if piece]
+        # "AT&T and Verizon plans" splits; "16GB and 32GB RAM" after "a laptop with" does not
+        if len(pieces) > 1 and all(_is_name_shaped(piece) for piece in pieces):
+            parts.extend(pieces)
+        else:
+            parts.append(_clean_name(part))
+    names = []
+    for name in parts:
+        if (name and len(name.split()) <= MAX_NAME_WORDS and _is_product_name(name)
+                and name.lower() not in (n.lower() for n in names)):
+            names.append(name)
+    return names
+
+
+def _names_and_focus(region):
+    focus = None
+    match = _LEADING_FOCUS.match(region)
+    if match:
+        focus, region = match.group(1).strip(), region[match.end():]
+    match = _TRAILING_FOCUS.search(region)
+    if match:
+        focus, region = match.group(1).strip(), region[:match.start()]
+    return _split_names(region), focus
+
+
+def extract_comparison(text):
+    """Product names compared in a message and what they are compared on: (names, focus or None).
+
+    Pronouns and other references ("it", "that one") are not names, so
+    fewer than two names means the message names no products to compare.
+    """
+    for sentence in _SENTENCE_END.split(text.strip()):
+        lead = _LEAD.search(sentence)
+        regions = []
+        if lead:
+            regions.append(sentence[lead.end():])
+        if _VERSUS.search(sentence):
+            regions.append(sentence[:lead.start()] if lead else sentence)
+        for region in regions:
+            names, focus = _names_and_focus(region)
+            if len(names) >= 2:
+                return names, focus
+    return [], None
+
+
+def _history(memory, system_prompt):
+    """The summary and recent turns held in memory, as text"""
+    if memory is None:
+        return ""
+    messages = [message for message in memory.load_memory_variables({})["history"]
+                if not (isinstance(message, SystemMessage) and message.content == system_prompt)]
+    return get_buffer_string(messages, human_prefix="Customer", ai_prefix="Assistant")
+
+
+class ComparisonPlan:
+    """The products one comparison request names, with their catalog matches (or None)"""
+
+    def __init__(self, request, names, matches, focus=None, history=""):
+        self.request = request
+        self.names = names
+        self.matches = matches
+        self.focus = focus
+        # The conversation before the request, for the synthesis
+        self.history = history
+
+    @property
+    def context(self):
+        """What the answer depends on besides the request, for the response cache key"""
+        skus = [match.get("sku", "") if match else "" for match in self.matches]
+        return (f"compare: {' | '.join(self.names)} ({', '.join(skus)}) focus: {self.focus or ''}\n"
+                f"history: {self.history}")
+
+
+def _section(name, profile):
+    return f"### {name}\n\n{profile}\n\n"
+
+
+class ProductComparer:
+    """Answers comparison requests with concurrent per-product profiles and one short synthesis"""
+
+    def __init__(self, llm, catalog=None, admission=None, system_prompt=COMMERCE_SYSTEM_PROMPT,
+                 max_products=4, concurrency=4):
+        self.llm = llm
+        self.catalog = catalog
+        self.admission = admission
+        self.system_prompt = system_prompt
+        self.max_products = max_products
+        self.concurrency = concurrency
+
+        self._lock = threading.Lock()
+        self.comparisons = 0
+        self.profiles = 0
+        self.failed_profiles = 0
+        self.total_fanout_seconds = 0.0
+        self.total_profile_seconds = 0.0
+
+    def plan(self, text, memory=None):
+        """The products to compare in a user message, looked up in the catalog, or None.
+
+        memory is the conversation's memory; its summary and recent turns go into the synthesis.
+        """
+        names, focus = extract_comparison(text)
+        if len(names) < 2:
+            return None
+        names = names[:self.max_products]
+        matches = [self._lookup(name) for name in names]
+        if self.catalog is not None and sum(match is not None for match in matches) < 2:
+            # Not two products the catalog knows: one regular answer is safer than profiles of fragments
+            return None
+        return ComparisonPlan(text, names, matches, focus, _history(memory, self.system_prompt))
+
+    def _lookup(self, name):
+        if self.catalog is None:
+            return None
+        products = self.catalog.search(name, k=1)
+        return products[0] if products else None
+
+    # Prompts
+
+    def _profile_messages(self, plan, index):
+        match = plan.matches[index]
+        prompt = COMPARE_PROFILE_PROMPT.format(
+            product=plan.names[index],
+            focus=f", focusing on {plan.focus}" if plan.focus else "",
+            catalog=COMPARE_CATALOG_NOTE.format(product=format_products([match])) if match else "")
+        return [SystemMessage(content=self.system_prompt), HumanMessage(content=prompt)]
+
+    def _synthesis_messages(self, plan, profiles):
+        prompt = COMPARE_SYNTHESIS_PROMPT.format(
+            history=COMPARE_HISTORY_NOTE.format(history=plan.history) if plan.history else "",
+            request=plan.request,
+            profiles="".join(_section(name, profile) for name, profile in profiles).strip(),
+            focus=f" for {plan.focus}" if plan.focus else "")
+        return [SystemMessage(content=self.system_prompt), HumanMessage(content=prompt)]
+
+    def _record(self, fanout_seconds, profile_seconds, failed):
+        with self._lock:
+            self.comparisons += 1
+            self.profiles += len(profile_seconds) + failed
+            self.failed_profiles += failed
+            self.total_fanout_seconds += fanout_seconds
+            self.total_profile_seconds += sum(profile_seconds)
+
+    @staticmethod
+    def _unavailable(plan, profiles):
+        missing = [name for name, profile in zip(plan.names, profiles) if profile is None]
+        if not missing:
+            return ""
+        return COMPARE_UNAVAILABLE_NOTE.format(products=", ".join(missing)) + "\n\n"
+
+    # Blocking version: profiles on a thread pool
+
+    def _stream(self, messages, cancel, trace=None):
+        make_stream = lambda: self.llm.stream(messages, **request_options(self.llm, cancel))
+        if self.admission is not None:
+            chunks = self.admission.stream(make_stream, trace=trace, cancel=cancel)
+        else:
+            chunks = make_stream()
+        return cancellable(chunks, cancel)
+
+    def _profile(self, plan, index, cancel):
+        started = time.perf_counter()
+        with contextlib.closing(self._stream(self._profile_messages(plan, index), cancel)) as chunks:
+            text = "".join(chunk.content for chunk in chunks)
+        return text.strip(), time.perf_counter() - started
+
+    def _profiles(self, plan, cancel):
+        """Yield (index, future) as each product's profile finishes"""
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(plan.names)),
+                                thread_name_prefix="compare") as pool:
+            futures = {pool.submit(self._profile, plan, index, cancel): index for index in range(len(plan.names))}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future
+            except GeneratorExit:
+                # The caller gave up: stop the running sub-queries at their next chunk
+                cancel.cancel(ABANDONED)
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def respond(self, memory, user_input, plan, on_token=None, trace=None, cancel=None):
+        """Answer a comparison, calling on_token(text_so_far) as sections arrive; returns a StreamResult.
+
+        Like streaming.stream_conversation(): an error before any text is
+        raised (e.g. every profile failed), a failure partway through keeps
+        the partial reply in result.error, and the turn is written to memory
+        once, unless it is cancelled.
+        """
+        cancel = cancel or CancelToken()
+        result = StreamResult()
+        started = time.perf_counter()
+        profiles = [None] * len(plan.names)
+        profile_seconds, errors = [], []
+
+        def emit(text):
+            if result.time_to_first_token is None:
+                result.time_to_first_token = time.perf_counter() - started
+            result.text += text
+            if on_token:
+                on_token(result.text)
+
+        with trace_span(trace, "compare_profiles"), contextlib.closing(self._profiles(plan, cancel)) as finished:
+            for index, future in finished:
+                try:
+                    profiles[index], seconds = future.result()
+                except TurnCancelledError:
+                    raise
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                profile_seconds.append(seconds)
+                emit(_section(plan.names[index], profiles[index]))
+        self._record(time.perf_counter() - started, profile_seconds, len(errors))
+        if not profile_seconds:
+            raise errors[0]
+
+        try:
+            if note := self._unavailable(plan, profiles):
+                emit(note)
+            done = [(name, profile) for name, profile in zip(plan.names, profiles) if profile is not None]
+            if len(done) > 1:
+                emit("### Side by side\n\n")
+                with trace_span(trace, "compare_synthesis"), \
+                        contextlib.closing(self._stream(self._synthesis_messages(plan, done), cancel, trace)) as chunks:
+                    for chunk in chunks:
+                        if chunk.content:
+                            emit(chunk.content)
+        except TurnCancelledError:
+            raise
+        except Exception as e:
+            result.error = e
+        return self._finish(memory, user_input, result, started, len(errors), trace, cancel)
+
+    # Event-loop version: profiles as tasks
+
+    def _astream(self, messages, cancel, trace=None):
+        make_stream = lambda: self.llm.astream(messages, **request_options(self.llm, cancel))
+        if self.admission is not None:
+            chunks = self.admission.astream(make_stream, trace=trace, cancel=cancel)
+        else:
+            chunks = make_stream()
+        return acancellable(chunks, cancel)
+
+    async def _aprofile(self, plan, index, cancel, slots):
+        async with slots:
+            started = time.perf_counter()
+            chunks = self._astream(self._profile_messages(plan, index), cancel)
+            try:
+                text = "".join([chunk.content async for chunk in chunks])
+            finally:
+                await chunks.aclose()
+            return text.strip(), time.perf_counter() - started
+
+    async def _aprofiles(self, plan, cancel):
+        """Yield (index, task) as each product's profile finishes (a bounded gather)"""
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = {asyncio.ensure_future(self._aprofile(plan, index, cancel, slots)): index
+                 for index in range(len(plan.names))}
+        pending = set(tasks)
+        try:
+            with cancel_future(cancel) as cancelled:
+                while pending:
+                    done, pending = await asyncio.wait(pending | {cancelled}, timeout=cancel.remaining(),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    pending.discard(cancelled)
+                    cancel.check()
+                    for task in done:
+                        yield tasks[task], task
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def arespond(self, memory, result, user_input, plan, trace=None, cancel=None):
+        """Async generator version of respond(), yielding each new piece of text into result"""
+        cancel = cancel or CancelToken()
+        started = time.perf_counter()
+        profiles = [None] * len(plan.names)
+        profile_seconds, errors = [], []
+
+        def emit(text):
+            if result.time_to_first_token is None:
+                result.time_to_first_token = time.perf_counter() - started
+            result.text += text
+            return text
+
+        finished = self._aprofiles(plan, cancel)
+        try:
+            with trace_span(trace, "compare_profiles"):
+                async for index, task in finished:
+                    try:
+                        profiles[index], seconds = task.result()
+                    except TurnCancelledError:
+                        raise
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    profile_seconds.append(seconds)
+                    yield emit(_section(plan.names[index], profiles[index]))
+        finally:
+            await finished.aclose()
+        self._record(time.perf_counter() - started, profile_seconds, len(errors))
+        if not profile_seconds:
+            raise errors[0]
+
+        try:
+            if note := self._unavailable(plan, profiles):
+                yield emit(note)
+            done = [(name, profile) for name, profile in zip(plan.names, profiles) if profile is not None]
+            if len(done) > 1:
+                yield emit("### Side by side\n\n")
+                chunks = self._astream(self._synthesis_messages(plan, done), cancel, trace)
+                try:
+                    with trace_span(trace, "compare_synthesis"):
+                        async for chunk in chunks:
+                            if chunk.content:
+                                yield emit(chunk.content)
+                finally:
+                    await chunks.aclose()
+        except TurnCancelledError:
+            raise
+        except Exception as e:
+            result.error = e
+        cancel.check(deadline=False)
+        await asyncio.to_thread(self._finish, memory, user_input, result, started, len(errors), trace)
+
+    def _finish(self, memory, user_input, result, started, failed, trace=None, cancel=None):
+        """Time the turn and write it to memory, unless it was cancelled meanwhile"""
+        result.total_time = time.perf_counter() - started
+        if trace is not None:
+            trace.record("llm_first_token", result.time_to_first_token)
+            trace.record("llm", result.total_time)
+            trace.set("compare_failed_profiles", failed)
+        if cancel is not None:
+            cancel.check(deadline=False)
+        with trace_span(trace, "memory_update"):
+            memory.save_context({"input": user_input}, {"response": result.text})
+        return result
+
+    def stats(self):
+        """Return comparison counts, and the profiles' wall time next to what running them one by one would take"""
+        with self._lock:
+            return {
+                "comparisons": self.comparisons,
+                "profiles": self.profiles,
+                "failed_profiles": self.failed_profiles,
+                "avg_fanout_seconds": self.total_fanout_seconds / self.comparisons if self.comparisons else 0.0,
+                "avg_sequential_seconds": self.total_profile_seconds / self.comparisons if self.comparisons else 0.0,
+            }
+
+
+def create_comparer(llm, catalog=None, admission=None):
+    """Create the comparer configured by COMPARE_* settings, or return None if COMPARE=off"""
+    if os.getenv("COMPARE", "on").lower() in ("off", "false", "0"):
+        return None
+    return ProductComparer(llm, catalog=catalog, admission=admission,
+                           max_products=int(os.getenv("COMPARE_MAX_PRODUCTS", "4")),
+                           concurrency=int(os.getenv("COMPARE_CONCURRENCY", "4")))
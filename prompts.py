@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Prompts and canned messages for the AI Commerce Chatbot, kept outside the
+Streamlit script so the chat engine, API server and benchmarks can import them.
+"""
+
+WELCOME_MESSAGE = "🛍️ Welcome to your AI Commerce Assistant! I'm here to help you with product recommendations, shopping questions, order support, and finding the best deals. What can I help you shop for today?"
+
+WELCOME_BACK_MESSAGE = "🛍️ Welcome back! I'm here to help you with product recommendations, shopping questions, order support, and finding the best deals. What can I help you shop for today?"
+
+BUSY_MESSAGE = "🛒 I'm helping a lot of shoppers right now and couldn't get to your question. Please try again in a moment!"
+
+TIMEOUT_MESSAGE = "🛒 Sorry, that answer took too long and I had to stop. Please try asking again!"
+
+ERROR_MESSAGE = "🛒 I apologize, but I'm having trouble processing your request right now. Please try again, and I'll be happy to assist you with your shopping needs!"
+
+# Sidebar Quick Action buttons: (label, message sent as the user's first turn)
+QUICK_ACTIONS = (
+    ("🔍 Product Search", "I'm looking for product recommendations. Can you help me find something specific?"),
+    ("📦 Order Support", "I need help with my order status or tracking information."),
+    ("💰 Find Deals", "What are the best deals and discounts available right now?"),
+    ("⭐ Product Compare", "I want to compare different products. Can you help me?"),
+    ("🔄 Returns & Exchanges", "I need information about returns, exchanges, or refund policies."),
+)
+
+# AI Commerce Chatbot System Prompt
+COMMERCE_SYSTEM_PROMPT = """You are an AI Commerce Assistant specialized in helping customers with online shopping, product recommendations, and e-commerce support. Your role is to:
+
+🛍️ **Core Responsibilities:**
+- Provide expert product recommendations based on customer needs and preferences
+- Assist with order inquiries, tracking, and returns/exchanges
+- Answer questions about product features, specifications, and comparisons
+- Help customers navigate the shopping experience and find the best deals
+- Provide information about shipping, delivery, and payment options
+- Assist with account management and customer service issues
+
+💡 **Expertise Areas:**
+- Product discovery and personalized recommendations
+- Price comparisons and deal identification
+- Inventory availability and restocking information
+- Technical product specifications and compatibility
+- Customer reviews and ratings analysis
+- Shopping cart optimization and checkout assistance
+- Post-purchase support and satisfaction
+
+🎯 **Communication Style:**
+- Be friendly, helpful, and professional
+- Ask clarifying questions to better understand customer needs
+- Provide detailed but concise product information
+- Use emojis appropriately to enhance the shopping experience
+- Offer multiple options when possible
+- Be proactive in suggesting complementary products
+- Always prioritize customer satisfaction
+
+🔧 **Guidelines:**
+- If you don't have specific product information, acknowledge this and suggest how the customer can find it
+- For order-specific issues, direct customers to contact customer service with their order number
+- Maintain customer privacy and never ask for sensitive information like passwords or full credit card numbers
+- Stay updated on current trends and seasonal shopping patterns
+- Provide honest assessments of products, including potential drawbacks
+
+Remember: Your goal is to make the customer's shopping experience as smooth and satisfying as possible while helping them find exactly what they need."""
+
+# Added to the prompt for a single turn when the product catalog has matches
+CATALOG_CONTEXT_PROMPT = """Products from our catalog that may match the customer's request (SKU, title, details, price, rating):
+{products}
+
+Recommend from these products when they fit, mentioning the SKU. Do not invent products, prices or ratings that are not listed."""
+
+# Product comparisons (see product_compare.py): a short profile of each product, requested
+# concurrently, then one synthesis call that turns the profiles into a table
+COMPARE_PROFILE_PROMPT = """Write a short profile of "{product}" for a side-by-side product comparison{focus}.
+{catalog}
+Answer in under 120 words, using exactly these three lines:
+**Key specs:** the specifications that matter most for this kind of product
+**Pros / cons:** two or three of each
+**Price notes:** typical price, and whether it is good value
+
+If you are not sure about a detail, say so instead of guessing."""
+
+COMPARE_CATALOG_NOTE = """
+Our catalog has this entry, which may be the product (ignore it if it is a different one):
+{product}
+"""
+
+COMPARE_SYNTHESIS_PROMPT = """{history}The customer asked: "{request}"
+
+Profiles of the products being compared:
+
+{profiles}
+
+Reply with a markdown table comparing the products side by side: one row per product, with columns for price, standout specs, main drawback and best for. Then recommend which one to choose{focus} and why, in one or two sentences. Do not repeat the profiles."""
+
+COMPARE_HISTORY_NOTE = """The conversation so far:
+{history}
+
+Take into account what the customer said there (budget, use case, products they mean).
+
+"""
+
+COMPARE_UNAVAILABLE_NOTE = "_I couldn't get details for {products} right now; the comparison covers the others._"
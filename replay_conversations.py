@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Replay saved conversations through the current chat setup.
+
+Usage:
+    python replay_conversations.py [--output replay.jsonl] [--concurrency 8] [--limit N]
+                                   [--title-prefix TEXT] [--fake-llm] [--resume]
+
+Streams conversations from the conversation store (CONVERSATION_STORE) and
+sends each user turn, in order, through the same engine the app uses:
+system prompt, memory, intent routing, catalog retrieval and model, as
+configured in .env. The response cache is off and nothing is saved. Many
+conversations run at once on an asyncio event loop, up to --concurrency.
+
+Each conversation becomes one JSON line in the output file, with the new
+reply, the original reply, latencies and token counts for every turn. With
+--resume, conversations already in the output file are skipped, so an
+interrupted run can be continued. --fake-llm answers from a local fake
+server instead of the real model, for offline runs.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import datetime
+import statistics
+
+from dotenv import load_dotenv
+
+from chat_engine import create_engine
+from llm_admission import LLMUnavailableError
+from metrics import TurnTrace
+from prompts import WELCOME_MESSAGE
+from streaming import StreamResult
+
+PAGE_SIZE = 100
+
+
+def completed_ids(path):
+    """Ids of conversations already in a results file, ignoring a torn last line"""
+    done = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if "conversation_id" in record:
+                    done.add(record["conversation_id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def iter_conversation_ids(store, title_prefix=None, limit=None):
+    """Yield conversation ids page by page, newest first"""
+    offset = 0
+    while limit is None or offset < limit:
+        page_size = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - offset)
+        page = store.list_conversations(limit=page_size, offset=offset, title_prefix=title_prefix)
+        if not page:
+            return
+        for entry in page:
+            yield entry["id"]
+        offset += len(page)
+
+
+async def replay_conversation(engine, conversation_id):
+    """Replay every user turn of one saved conversation; returns its result record"""
+    started = time.perf_counter()
+    conversation = await asyncio.to_thread(engine.store.load_conversation, conversation_id)
+    messages = conversation["messages"]
+    welcome = messages[0]["content"] if messages and messages[0]["role"] == "assistant" else WELCOME_MESSAGE
+    session = await asyncio.to_thread(engine.new_session, welcome, conversation_id)
+    turns = []
+    for i, message in enumerate(messages):
+        if message["role"] != "user":
+            continue
+        original = messages[i + 1]["content"] if i + 1 < len(messages) and messages[i + 1]["role"] == "assistant" else None
+        session.add_user_message(message["content"])
+        trace = TurnTrace(session.session_id, conversation_id)
+        result = StreamResult()
+        turn = {"user": message["content"], "original": original}
+        try:
+            async for _ in engine.astream_response(session, result, trace):
+                pass
+        except LLMUnavailableError:
+            # Overloaded or down: stop, so a resumed run replays this conversation
+            raise
+        except Exception as e:
+            # Keep going with the next turn, as the app would after an error reply
+            turn["error"] = f"{type(e).__name__}: {e}"
+            session.messages.pop()
+        turn.update({
+            "response": result.text,
+            "source": result.source,
+            "time_to_first_token": result.time_to_first_token,
+            "total_time": result.total_time,
+        })
+        turn.update({key: value for key, value in trace.values.items() if key not in turn})
+        turns.append(turn)
+    return {
+        "conversation_id": conversation_id,
+        "title": conversation.get("title", ""),
+        "turns": turns,
+        "errors": sum(1 for turn in turns if "error" in turn),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+async def run_replay(engine, conversation_ids, output, concurrency=8, on_result=None):
+    """Replay conversations concurrently, appending one JSON line per conversation to output"""
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def produce():
+        for conversation_id in conversation_ids:
+            await queue.put(conversation_id)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work():
+        while True:
+            conversation_id = await queue.get()
+            if conversation_id is None:
+                return
+            try:
+                record = await replay_conversation(engine, conversation_id)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                record = {"conversation_id": conversation_id, "turns": [], "errors": 1,
+                          "error": f"{type(e).__name__}: {e}"}
+            # One write per conversation, so an interrupted run leaves whole lines
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if on_result:
+                on_result(record)
+
+    await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+
+
+def summarize_results(records):
+    """Latency, token and error totals for a list of result records"""
+    turns = [turn for record in records for turn in record["turns"]]
+    latencies = sorted(turn["total_time"] for turn in turns if turn.get("total_time"))
+    first_tokens = sorted(turn["time_to_first_token"] for turn in turns if turn.get("time_to_first_token"))
+
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+    return {
+        "conversations": len(records),
+        "turns": len(turns),
+        "errors": sum(record["errors"] for record in records),
+        "median_latency_s": statistics.median(latencies) if latencies else None,
+        "p95_latency_s": percentile(latencies, 0.95),
+        "median_first_token_s": statistics.median(first_tokens) if first_tokens else None,
+        "prompt_tokens": sum(turn.get("prompt_tokens", 0) for turn in turns),
+        "completion_tokens": sum(turn.get("completion_tokens", 0) for turn in turns),
+        "sources": {source: sum(1 for turn in turns if turn["source"] == source)
+                    for source in sorted({turn["source"] for turn in turns})},
+    }
+
+
+def _run_header(engine, args):
+    """Settings that identify a replay run"""
+    return {
+        "event": "run",
+        "started": datetime.datetime.now().isoformat(),
+        "model": engine.llm.model_name,
+        "small_model": engine.small_llm.model_name if engine.small_llm is not None else None,
+        "system_prompt_sha256": hashlib.sha256(engine.system_prompt.encode("utf-8")).hexdigest()[:16],
+        "memory_mode": os.getenv("MEMORY_MODE", "token_budget"),
+        "router": engine.router is not None,
+        "catalog": engine.catalog.version if engine.catalog is not None else None,
+        "fake_llm": args.fake_llm,
+    }
+
+
+def main():
+    """Run the replay"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--output", default="replay.jsonl", help="Results file (JSON lines, appended to)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations replayed at once")
+    parser.add_argument("--limit", type=int, help="Replay at most this many conversations (newest first)")
+    parser.add_argument("--title-prefix", help="Only conversations whose title starts with this")
+    parser.add_argument("--resume", action="store_true", help="Skip conversations already in the output file")
+    parser.add_argument("--fake-llm", action="store_true", help="Use a local fake model server (no API key needed)")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="Fake model time to first token (s)")
+    parser.add_argument("--fake-tokens-per-second", type=float, default=200, help="Fake model token rate")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        from benchmarks.fake_llm_server import start_fake_server
+        _, base_url = start_fake_server(latency=args.fake_latency, tokens_per_second=args.fake_tokens_per_second)
+        os.environ["LLM_BASE_URL"] = base_url
+        api_key = "fake"
+    else:
+        api_key = os.getenv("TOGETHER_API_KEY")
+        if not api_key:
+            parser.error("TOGETHER_API_KEY is not set (or use --fake-llm)")
+    if not args.resume and os.path.exists(args.output) and os.path.getsize(args.output):
+        parser.error(f"{args.output} already exists; use --resume to continue it or choose another --output")
+
+    engine = create_engine(api_key, cache=False)
+    if engine.admission is not None:
+        # Replay waits its turn instead of giving up like an interactive user would
+        engine.admission.max_concurrency = max(engine.admission.max_concurrency, args.concurrency)
+        engine.admission.queue_timeout = 0
+
+    done = completed_ids(args.output) if args.resume else set()
+    conversation_ids = (conversation_id for conversation_id in
+                        iter_conversation_ids(engine.store, args.title_prefix, args.limit)
+                        if conversation_id not in done)
+    if done:
+        print(f"⏭️  Skipping {len(done)} conversations already in {args.output}")
+
+    records = []
+
+    def on_result(record):
+        records.append(record)
+        status = f"❌ {record['errors']} errors" if record["errors"] else "✅"
+        print(f"{status} {record['conversation_id']} ({len(record['turns'])} turns)", flush=True)
+
+    print(f"🔁 Replaying conversations into {args.output} ({args.concurrency} at a time)...")
+    with open(args.output, 'a', encoding='utf-8') as output:
+        output.write(json.dumps(_run_header(engine, args), ensure_ascii=False) + "\n")
+        output.flush()
+        try:
+            asyncio.run(run_replay(engine, conversation_ids, output, args.concurrency, on_result))
+        except KeyboardInterrupt:
+            print("\n⏸️  Interrupted; run again with --resume to continue")
+            sys.exit(130)
+        except LLMUnavailableError as e:
+            print(f"\n❌ The model is unavailable ({e}); run again with --resume to continue")
+            sys.exit(1)
+
+    print("\n" + json.dumps(summarize_results(records), indent=2))
+
+
+if __name__ == "__main__":
+    main()
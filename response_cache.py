@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache for repeated prompts.
+
+Quick Action buttons send fixed strings, and in a fresh conversation the
+memory holds only the system prompt, so many users trigger identical LLM
+calls. Replies are cached under a key built from the model, the system
+prompt, the memory context and the normalized user input; a hit skips the
+round trip to the model entirely.
+
+Two backends are available via RESPONSE_CACHE: "memory" (default, in-process
+LRU) and "disk" (SQLite file that survives restarts). "off" disables caching.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_input(text):
+    """Lowercase and collapse whitespace so trivially different inputs share a key"""
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def make_cache_key(model, system_prompt, context_messages, user_input):
+    """Build a cache key from (model, system prompt hash, context hash, normalized input)"""
+    context = json.dumps(
+        [(getattr(msg, "type", ""), getattr(msg, "content", msg)) for msg in context_messages],
+        ensure_ascii=False)
+    return _sha256("\x1f".join([
+        model,
+        _sha256(system_prompt),
+        _sha256(context),
+        normalize_input(user_input),
+    ]))
+
+
+class InMemoryResponseCache:
+    """Thread-safe in-process LRU cache with TTL and hit/miss counters"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, response):
+        """Store a response, evicting the least recently used entries over the cap"""
+        with self._lock:
+            self._entries[key] = (response, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self._entries)}
+
+
+class DiskResponseCache:
+    """SQLite-backed cache that survives restarts (LRU by last access, with TTL)"""
+
+    def __init__(self, path="response_cache.db", max_entries=10000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response):
+        """Store a response, evicting the least recently used entries over the cap"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, response, now, now))
+            excess = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": entries}
+
+
+def create_response_cache():
+    """Create the cache selected by RESPONSE_CACHE, or None if caching is off"""
+    backend = os.getenv("RESPONSE_CACHE", "memory").lower()
+    max_entries = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    if backend == "off":
+        return None
+    if backend == "memory":
+        return InMemoryResponseCache(max_entries=max_entries, ttl=ttl)
+    if backend == "disk":
+        return DiskResponseCache(os.getenv("RESPONSE_CACHE_PATH", "response_cache.db"),
+                                 max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"Unknown RESPONSE_CACHE backend: {backend}")
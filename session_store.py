@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Live chat sessions for the API server and the Streamlit app.
+
+A session holds what the model needs between requests: the transcript and
+the conversation memory. The server keeps them in a SessionStore returned by
+create_session_store(), chosen with the SESSION_STORE environment variable.
+
+- "memory" (default): InMemorySessionStore, a bounded LRU with an idle
+  timeout. A session that falls out of it is gone, but its saved
+  conversation is not: clients resume it by its conversation id, with
+  POST /v1/sessions {"conversation_id": ...} or by sending messages to
+  /v1/sessions/<conversation id>.
+- "spill": SpillingSessionStore, which bounds memory in bytes rather than
+  sessions. It is what chatbot.py uses for Streamlit sessions.
+
+SpillingSessionStore keeps only a hot tail of each transcript in RAM (the
+last SESSION_HOT_MESSAGES messages; older, already saved ones are read back
+from the conversation store if something asks for them). Sessions idle for
+SESSION_IDLE_SECONDS, and the least recently used ones whenever the
+estimated size of all resident sessions exceeds SESSION_MEMORY_MB, are
+saved and dropped from memory. The next get() with their session id
+reloads them transparently from the conversation store, with their memory rebuilt from the saved
+context summary. A session whose user turned auto-save off is never saved
+here: it stays in memory, even over the budget, until it has been idle for
+SESSION_IDLE_SECONDS, and then expires unsaved.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message cost beyond its text (dict, strings, LangChain message)
+MESSAGE_OVERHEAD_BYTES = 400
+# Sessions used more recently than this are never spilled
+MIN_SPILL_IDLE_SECONDS = 120
+
+
+class SessionStore:
+    """Interface for keeping live ChatSession objects between requests"""
+
+    def get(self, session_id):
+        """Return the session, or None if it is unknown or expired"""
+        raise NotImplementedError
+
+    def put(self, session):
+        """Add or refresh a session"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Forget a session"""
+        raise NotImplementedError
+
+    def find(self, conversation_id):
+        """Return {session id: session} for the sessions continuing a conversation (None: spilled)"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Least-recently-used sessions in this process, expired after ttl seconds idle"""
+
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()   # session id -> (session, last access)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            session, last_access = entry
+            if self.ttl and time.monotonic() - last_access > self.ttl:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return None
+            self._sessions[session_id] = (session, time.monotonic())
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session):
+        with self._lock:
+            self._sessions[session.session_id] = (session, time.monotonic())
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def find(self, conversation_id):
+        with self._lock:
+            return {session_id: session for session_id, (session, _) in self._sessions.items()
+                    if session.conversation_id == conversation_id}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        """Return the number of live sessions and evictions"""
+        with self._lock:
+            return {"sessions": len(self._sessions), "evictions": self.evictions}
+
+
+class SpilledMessages:
+    """A transcript whose older, already saved messages live in the conversation store.
+
+    Stands in for the session's message list: len(), indexing, slicing,
+    iteration, append() and pop() cover the whole transcript, but only the
+    tail from offset on is held in memory. Reaching below offset loads the
+    older messages back with load().
+    """
+
+    def __init__(self, messages, offset=0, load=None):
+        self._tail = list(messages)
+        self.offset = offset
+        self._load = load
+
+    def _materialize(self):
+        """Bring the spilled messages back into memory"""
+        if self.offset:
+            older = self._load()[:self.offset]
+            if len(older) != self.offset:
+                raise LookupError(f"Only {len(older)} of {self.offset} spilled messages could be reloaded")
+            self._tail = older + self._tail
+            self.offset = 0
+
+    def trim(self, saved_count, keep, load):
+        """Spill all but the last keep messages, but never one that is not saved yet"""
+        offset = min(saved_count, len(self) - keep)
+        if offset > self.offset:
+            self._tail = self._tail[offset - self.offset:]
+            self.offset = offset
+            self._load = load
+
+    @property
+    def resident(self):
+        """The messages held in memory"""
+        return self._tail
+
+    def __len__(self):
+        return self.offset + len(self._tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step > 0 and start >= self.offset:
+                return self._tail[start - self.offset:max(stop - self.offset, 0):step]
+            self._materialize()
+            return self._tail[index]
+        if index < 0:
+            index += len(self)
+        if index >= self.offset:
+            return self._tail[index - self.offset]
+        if index < 0:
+            raise IndexError("message index out of range")
+        self._materialize()
+        return self._tail[index]
+
+    def __iter__(self):
+        self._materialize()
+        return iter(self._tail)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"<SpilledMessages {len(self)} messages, {len(self._tail)} resident>"
+
+    def append(self, message):
+        self._tail.append(message)
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        if index < self.offset:
+            self._materialize()
+        return self._tail.pop(index - self.offset)
+
+    def copy(self):
+        """Shallow copy that shares the spilled part instead of loading it"""
+        return SpilledMessages(self._tail, self.offset, self._load)
+
+
+def _may_save(session):
+    """Whether the session store may save a session on its user's behalf"""
+    return getattr(session, "auto_save", True)
+
+
+def estimate_session_bytes(session):
+    """Approximate memory held by a session's resident messages and its LLM memory"""
+    messages = session.messages
+    resident = messages.resident if isinstance(messages, SpilledMessages) else messages
+    size = sum(len(message["content"]) + MESSAGE_OVERHEAD_BYTES for message in resident)
+    chat_memory = getattr(session.memory, "chat_memory", None)
+    if chat_memory is not None:
+        size += sum(len(str(message.content)) + MESSAGE_OVERHEAD_BYTES for message in chat_memory.messages)
+    return size + len(getattr(session.memory, "summary", "") or "")
+
+
+class SpillingSessionStore(SessionStore):
+    """Sessions within a memory budget; idle and over-budget ones are moved to the conversation store"""
+
+    def __init__(self, engine, max_bytes=256 * 1024 * 1024, hot_messages=50, idle_seconds=1800,
+                 max_spilled=100000):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.hot_messages = hot_messages
+        self.idle_seconds = idle_seconds
+        self.max_spilled = max_spilled
+        self._sessions = OrderedDict()   # session id -> [session, last access, estimated bytes]
+        self._spilled = OrderedDict()    # session id -> conversation id, or None if it had nothing to save
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+        self.trims = 0
+        self.expired = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                entry[1] = time.monotonic()
+                session = entry[0]
+            else:
+                session = None
+                conversation_id = self._spilled.pop(session_id, None)
+        if session is not None:
+            self._refresh(session)
+            return session
+        if conversation_id is None:
+            return None
+        # Spilled earlier: rebuild it from the conversation store
+        session = self.engine.open_session(conversation_id, session_id=session_id)
+        if session is not None:
+            with self._lock:
+                self.reloads += 1
+            self.put(session)
+        return session
+
+    def put(self, session):
+        with self._lock:
+            self._spilled.pop(session.session_id, None)
+            if session.session_id not in self._sessions:
+                self._sessions[session.session_id] = [session, time.monotonic(), 0]
+            self._sessions.move_to_end(session.session_id)
+            self._sessions[session.session_id][1] = time.monotonic()
+        self._refresh(session)
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self.resident_bytes -= entry[2]
+            self._spilled.pop(session_id, None)
+
+    def find(self, conversation_id):
+        with self._lock:
+            found = {session_id: None for session_id, spilled in self._spilled.items() if spilled == conversation_id}
+            found.update((session_id, entry[0]) for session_id, entry in self._sessions.items()
+                         if entry[0].conversation_id == conversation_id)
+            return found
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _load_messages(self, conversation_id):
+        self.engine.wait_for_save(conversation_id)
+        return self.engine.store.load_conversation(conversation_id)["messages"]
+
+    def _trim(self, session):
+        """Spill the saved messages before the hot tail, and trim window memory to its window"""
+        # Messages whose background save failed are not saved, so they must stay
+        self.engine.save_failure(session)
+        if session.conversation_id and len(session.messages) > 2 * self.hot_messages:
+            if not isinstance(session.messages, SpilledMessages):
+                session.messages = SpilledMessages(session.messages)
+            before = session.messages.offset
+            conversation_id = session.conversation_id
+            session.messages.trim(session.saved_message_count, self.hot_messages,
+                                  lambda: self._load_messages(conversation_id))
+            if session.messages.offset != before:
+                with self._lock:
+                    self.trims += 1
+        # Window memory only sends its last k turns but keeps every message
+        window = getattr(session.memory, "k", None)
+        chat_memory = getattr(session.memory, "chat_memory", None)
+        if window and chat_memory is not None and len(chat_memory.messages) > 2 * window:
+            del chat_memory.messages[:-2 * window]
+
+    def _refresh(self, session):
+        """Trim a session that was just used, update its size, then enforce the budget"""
+        self._trim(session)
+        size = estimate_session_bytes(session)
+        with self._lock:
+            entry = self._sessions.get(session.session_id)
+            if entry is not None:
+                self.resident_bytes += size - entry[2]
+                entry[2] = size
+        self._enforce()
+
+    def _enforce(self):
+        """Spill idle sessions, then least recently used ones until under the budget"""
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            over = self.resident_bytes - self.max_bytes
+            for session_id, (session, last_access, size) in list(self._sessions.items()):
+                idle = now - last_access
+                if idle < MIN_SPILL_IDLE_SECONDS:
+                    break   # Oldest first: every later session is newer still
+                expired = self.idle_seconds and idle > self.idle_seconds
+                if over <= 0 and not expired:
+                    break
+                if not expired and not _may_save(session) and session.unsaved and len(session.messages) > 1:
+                    continue   # Auto-save is off: it can only leave memory by expiring
+                # A turn in progress would write its reply to a session that is no
+                # longer stored; one left waiting for a reply still expires
+                if getattr(session, "turn", None) is not None or (not expired and session.pending_input):
+                    continue
+                del self._sessions[session_id]
+                self.resident_bytes -= size
+                over -= size
+                victims.append(session)
+        for session in victims:
+            self._spill(session)
+
+    def _spill(self, session):
+        """Save a session that left memory, and remember where to reload it from"""
+        if session.unsaved and len(session.messages) > 1 and not _may_save(session):
+            # The user chose not to save this chat, so it expires with its unsaved messages
+            with self._lock:
+                self.expired += 1
+            return
+        try:
+            if session.unsaved and len(session.messages) > 1:
+                self.engine.save(session)
+        except Exception:
+            # Keep it resident rather than lose unsaved messages
+            logger.exception("Error saving session %s; keeping it in memory", session.session_id)
+            size = estimate_session_bytes(session)
+            with self._lock:
+                self._sessions[session.session_id] = [session, time.monotonic(), size]
+                self.resident_bytes += size
+            return
+        with self._lock:
+            self._spilled[session.session_id] = session.conversation_id
+            while len(self._spilled) > self.max_spilled:
+                self._spilled.popitem(last=False)
+            self.spills += 1
+
+    def stats(self):
+        """Return resident sessions and bytes, the budget, and spill/reload counts"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "resident_bytes": self.resident_bytes,
+                "budget_bytes": self.max_bytes,
+                "spilled_sessions": len(self._spilled),
+                "spills": self.spills,
+                "reloads": self.reloads,
+                "trims": self.trims,
+                "expired_unsaved": self.expired,
+            }
+
+
+def create_spilling_session_store(engine):
+    """Create a SpillingSessionStore from the SESSION_MEMORY_MB, SESSION_HOT_MESSAGES and SESSION_IDLE_SECONDS settings"""
+    return SpillingSessionStore(
+        engine,
+        max_bytes=int(float(os.getenv("SESSION_MEMORY_MB", "256")) * 1024 * 1024),
+        hot_messages=int(os.getenv("SESSION_HOT_MESSAGES", "50")),
+        idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", "1800")),
+    )
+
+
+def create_session_store(engine=None):
+    """Create the session store selected by SESSION_STORE ("spill" needs the engine)"""
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    if backend == "memory":
+        return InMemorySessionStore(
+            max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+            ttl=float(os.getenv("SESSION_TTL", "3600")),
+        )
+    if backend == "spill":
+        return create_spilling_session_store(engine)
+    raise ValueError(f"Unknown SESSION_STORE: {backend}")
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite conversation store for the AI Commerce Chatbot.
+
+Conversations and messages live in separate, indexed tables in a single
+SQLite database running in WAL mode, so readers never block the writer.
+Message text is indexed with FTS5 to back the sidebar search box, e.g.
+"laptops under $800". Enable it with CONVERSATION_STORE=sqlite.
+"""
+import re
+import json
+import uuid
+import sqlite3
+import datetime
+import threading
+
+from conversation_store import ConversationConflictError, ConversationStore, make_title
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp DESC, id);
+CREATE INDEX IF NOT EXISTS idx_conversations_title ON conversations(title COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (conversation_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS context_summaries (
+    conversation_id TEXT PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+    context TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+"""
+
+METADATA_COLUMNS = "c.id, c.title, c.timestamp, c.created, c.message_count, c.size"
+
+
+def _metadata(row):
+    """Convert a conversations row to the metadata dict used by the sidebar"""
+    return {
+        "id": row[0],
+        "title": row[1],
+        "timestamp": row[2],
+        "created": row[3],
+        "message_count": row[4],
+        "size": row[5],
+    }
+
+
+def _content_size(messages):
+    return sum(len(msg["content"].encode("utf-8")) for msg in messages)
+
+
+def _escape_like(text):
+    """Escape LIKE wildcards so text matches literally (with ESCAPE '\\')"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _title_clause(title_prefix):
+    """WHERE clause and parameters for a case-insensitive title prefix filter"""
+    if not title_prefix:
+        return "", []
+    return "WHERE c.title LIKE ? ESCAPE '\\'", [_escape_like(title_prefix) + "%"]
+
+
+def _fts_query(query):
+    """Turn free text into an FTS5 query that ORs the quoted words together"""
+    words = re.findall(r"\w+", query.lower())
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+class SqliteStore(ConversationStore):
+    """Conversation store backed by SQLite (WAL mode, FTS5 search)"""
+
+    def __init__(self, path="conversations.db"):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE
+            self.fts_enabled = False
+        conn.commit()
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _insert_conversations(self, conn, conversations):
+        """Insert full conversations with one executemany per table"""
+        conn.executemany(
+            "INSERT OR IGNORE INTO conversations (id, title, timestamp, created, updated, message_count, size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(c["id"], c["title"], c["timestamp"], c["created"], c["created"],
+              len(c["messages"]), _content_size(c["messages"])) for c in conversations])
+        conn.executemany(
+            "INSERT OR IGNORE INTO messages (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+            [(c["id"], i, msg["role"], msg["content"])
+             for c in conversations for i, msg in enumerate(c["messages"])])
+
+    def save_conversation(self, conversation_data, title=None):
+        now = datetime.datetime.now()
+        conversation = {
+            "id": uuid.uuid4().hex,
+            "title": title or make_title(conversation_data),
+            "timestamp": now.strftime("%Y%m%d_%H%M%S"),
+            "created": now.isoformat(),
+            "messages": conversation_data,
+        }
+        conn = self._connect()
+        with self._write_lock, conn:
+            self._insert_conversations(conn, [conversation])
+        return conversation["id"]
+
+    def append_messages(self, conversation_id, conversation_data, start):
+        new_messages = conversation_data[start:]
+        if not new_messages:
+            return
+        conn = self._connect()
+        with self._write_lock, conn:
+            # Take the write lock before reading, so the check and the insert
+            # are one step for every process sharing the database
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT message_count FROM conversations WHERE id = ?",
+                               (conversation_id,)).fetchone()
+            stored = row[0] if row else 0
+            if stored != start:
+                raise ConversationConflictError(conversation_id, start, stored)
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+                [(conversation_id, i, msg["role"], msg["content"])
+                 for i, msg in enumerate(new_messages, start)])
+            conn.execute(
+                "UPDATE conversations SET message_count = ?, size = size + ?, updated = ? WHERE id = ?",
+                (len(conversation_data), _content_size(new_messages),
+                 datetime.datetime.now().isoformat(), conversation_id))
+
+    def list_conversations(self, limit=None, offset=0, title_prefix=None):
+        where, params = _title_clause(title_prefix)
+        rows = self._connect().execute(
+            f"SELECT {METADATA_COLUMNS} FROM conversations c {where} "
+            "ORDER BY c.timestamp DESC, c.id LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset])
+        return [_metadata(row) for row in rows]
+
+    def count_conversations(self, title_prefix=None):
+        where, params = _title_clause(title_prefix)
+        return self._connect().execute(
+            f"SELECT COUNT(*) FROM conversations c {where}", params).fetchone()[0]
+
+    def load_conversation(self, conversation_id):
+        conn = self._connect()
+        row = conn.execute(
+            f"SELECT {METADATA_COLUMNS} FROM conversations c WHERE c.id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Conversation not found: {conversation_id}")
+        conversation = _metadata(row)
+        conversation["messages"] = [
+            {"role": role, "content": content}
+            for role, content in conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY position",
+                (conversation_id,))
+        ]
+        return conversation
+
+    def delete_conversation(self, conversation_id):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def search_conversations(self, query, limit=20):
+        conn = self._connect()
+        if self.fts_enabled:
+            fts_query = _fts_query(query)
+            if not fts_query:
+                return []
+            rows = conn.execute(
+                f"SELECT {METADATA_COLUMNS}, snippet(messages_fts, 0, '**', '**', '…', 12) "
+                "FROM messages_fts "
+                "JOIN messages m ON m.rowid = messages_fts.rowid "
+                "JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE messages_fts MATCH ? ORDER BY messages_fts.rank LIMIT ?",
+                (fts_query, limit * 5))
+        else:
+            rows = conn.execute(
+                f"SELECT {METADATA_COLUMNS}, substr(m.content, 1, 80) "
+                "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE m.content LIKE ? ESCAPE '\\' ORDER BY c.timestamp DESC LIMIT ?",
+                (f"%{_escape_like(query)}%", limit * 5))
+
+        # Several messages can match; keep the best-ranked one per conversation
+        results = {}
+        for row in rows:
+            if row[0] not in results:
+                results[row[0]] = dict(_metadata(row), snippet=row[6])
+                if len(results) == limit:
+                    break
+        return list(results.values())
+
+    def save_context_summary(self, conversation_id, context):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO context_summaries (conversation_id, context, updated) VALUES (?, ?, ?)",
+                (conversation_id, json.dumps(context, ensure_ascii=False), datetime.datetime.now().isoformat()))
+
+    def load_context_summary(self, conversation_id):
+        row = self._connect().execute(
+            "SELECT context FROM context_summaries WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def import_conversations(self, conversations, batch_size=500):
+        """Bulk-insert conversations (dicts with id, title, timestamp, created, messages).
+
+        Rows are written in batches of batch_size conversations per
+        transaction; ids that already exist are skipped, so re-running an
+        import is safe. Returns the number of conversations processed.
+        """
+        conn = self._connect()
+        count = 0
+        batch = []
+        for conversation in conversations:
+            batch.append(conversation)
+            if len(batch) >= batch_size:
+                with self._write_lock, conn:
+                    self._insert_conversations(conn, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with self._write_lock, conn:
+                self._insert_conversations(conn, batch)
+            count += len(batch)
+        return count
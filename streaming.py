@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Token streaming for assistant replies.
+
+ConversationChain.predict() only returns once the whole completion has
+arrived. stream_conversation() builds the same prompt the chain would use,
+streams tokens from the chain's LLM as they arrive, and then writes the
+assembled reply to the chain's memory exactly once. astream_conversation()
+does the same on an asyncio event loop, and complete_conversation() without
+streaming. All three can add retrieved context (e.g. catalog matches) to
+the prompt for this turn only; it is never written to memory.
+
+Given a cancellation.CancelToken, they stop as soon as the turn is
+cancelled or reaches its deadline: the model's HTTP stream is closed, its
+admission slot freed, and TurnCancelledError (or TurnTimeoutError) is
+raised without writing anything to memory. Each request is also sent with a
+timeout no longer than the time left before the deadline.
+"""
+import time
+import asyncio
+
+from langchain_core.messages import SystemMessage
+
+from cancellation import TIMEOUT, TurnCancelledError, cancel_future
+from metrics import trace_span
+
+STREAM_INTERRUPTED_MARKER = "\n\n⚠️ *The response was interrupted and may be incomplete. Please try again.*"
+
+
+class StreamResult:
+    """Outcome of a reply, including timing information and its source ("model", "cache" or "template")"""
+
+    def __init__(self):
+        self.text = ""
+        self.time_to_first_token = None
+        self.total_time = None
+        self.error = None
+        self.source = "model"
+
+    @property
+    def interrupted(self):
+        """True if the stream failed after some tokens were received"""
+        return self.error is not None
+
+    @property
+    def display_text(self):
+        """Text to show the user, with a marker if the stream was cut short"""
+        if self.interrupted:
+            return self.text + STREAM_INTERRUPTED_MARKER
+        return self.text
+
+
+def _prepare_inputs(conversation, inputs, context=None):
+    """Format the chain's prompt, adding context after the history"""
+    if context:
+        key = conversation.memory.memory_key
+        history = inputs[key]
+        if isinstance(history, list):
+            inputs[key] = history + [SystemMessage(content=context)]
+        else:
+            inputs[key] = f"{history}\n{context}"
+    return conversation.prompt.format_prompt(**inputs)
+
+
+def request_options(llm, cancel):
+    """Keyword arguments for the model call: a timeout that ends by the turn's deadline"""
+    remaining = cancel.remaining() if cancel is not None else None
+    if remaining is None:
+        return {}
+    configured = getattr(llm, "request_timeout", None)
+    if isinstance(configured, (int, float)):
+        remaining = min(remaining, configured)
+    return {"timeout": max(0.1, remaining)}
+
+
+def _check_failure(cancel):
+    """Report a failed call as a timeout (or cancellation) if the turn ended meanwhile"""
+    if cancel is not None:
+        cancel.check()
+
+
+_END = object()
+
+
+async def _anext(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+async def _next_chunk(chunks, cancel, cancelled):
+    """The next chunk (or _END), abandoning the wait as soon as cancel fires or its deadline passes"""
+    if cancel is None:
+        return await _anext(chunks)
+    step = asyncio.ensure_future(_anext(chunks))
+    try:
+        await asyncio.wait({step, cancelled}, timeout=cancel.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        step.cancel()
+        await asyncio.wait({step})
+        raise
+    if step.done():
+        return step.result()
+    # Cancelling the pending read aborts the HTTP request and frees the admission slot
+    step.cancel()
+    await asyncio.wait({step})
+    if not step.cancelled():
+        step.exception()
+    if not cancel.cancelled:
+        cancel.cancel(TIMEOUT)
+    cancel.check()
+
+
+async def acancellable(chunks, cancel):
+    """Yield from an async iterator until cancel fires or its deadline passes, then raise
+    TurnCancelledError at once, even mid-wait; chunks is closed either way"""
+    try:
+        if cancel is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+        with cancel_future(cancel) as cancelled:
+            while (chunk := await _next_chunk(chunks, cancel, cancelled)) is not _END:
+                cancel.check()
+                yield chunk
+    finally:
+        await chunks.aclose()
+
+
+def cancellable(chunks, cancel):
+    """Yield from a stream of chunks, raising TurnCancelledError between chunks once
+    cancel fires or its deadline passes; chunks is closed either way"""
+    try:
+        for chunk in chunks:
+            if cancel is not None:
+                cancel.check()
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def stream_conversation(conversation, user_input, on_token=None, trace=None, admission=None, context=None,
+                        cancel=None):
+    """Stream a reply from a ConversationChain, calling on_token(text_so_far).
+
+    If the stream fails before any token arrives the exception is re-raised,
+    so callers can fall back to their usual error handling. If it fails
+    partway through, the partial text is kept and result.error is set.
+    An optional metrics.TurnTrace receives the memory and LLM stage timings;
+    an optional llm_admission.AdmissionController gates and retries the call,
+    and model timings start once it admits the request. context is added to
+    the prompt for this turn only. cancel (a CancelToken) is checked while
+    waiting for admission and between chunks.
+    """
+    memory = conversation.memory
+    with trace_span(trace, "memory_assembly"):
+        inputs = {conversation.input_key: user_input}
+        inputs.update(memory.load_memory_variables(inputs))
+        prompt_value = _prepare_inputs(conversation, inputs, context)
+
+    result = StreamResult()
+    started = [time.perf_counter()]
+    if cancel is not None:
+        cancel.check()
+    make_stream = lambda: conversation.llm.stream(prompt_value, **request_options(conversation.llm, cancel))
+    if admission is not None:
+        chunks = admission.stream(make_stream, trace=trace, cancel=cancel,
+                                  on_start=lambda: started.__setitem__(0, time.perf_counter()))
+    else:
+        chunks = make_stream()
+    chunks = cancellable(chunks, cancel)
+    try:
+        for chunk in chunks:
+            token = chunk.content
+            if not token:
+                continue
+            if result.time_to_first_token is None:
+                result.time_to_first_token = time.perf_counter() - started[0]
+            result.text += token
+            if on_token:
+                on_token(result.text)
+    except TurnCancelledError:
+        raise
+    except Exception as e:
+        _check_failure(cancel)
+        if not result.text:
+            raise
+        result.error = e
+    finally:
+        # Closes the HTTP stream and frees the admission slot if the loop stopped early
+        chunks.close()
+    result.total_time = time.perf_counter() - started[0]
+    if trace is not None:
+        trace.record("llm_first_token", result.time_to_first_token)
+        trace.record("llm", result.total_time)
+
+    # A turn cancelled by now is dropped; past this point it is written to memory
+    if cancel is not None:
+        cancel.check(deadline=False)
+    # Only the model's own words go into memory, never the interruption marker
+    with trace_span(trace, "memory_update"):
+        memory.save_context({conversation.input_key: user_input}, {conversation.output_key: result.text})
+    return result
+
+
+def complete_conversation(conversation, user_input, trace=None, admission=None, context=None, cancel=None):
+    """Get a whole reply in one request, like ConversationChain.predict(), and return a StreamResult.
+
+    Takes the same arguments as stream_conversation() and times the same stages.
+    """
+    memory = conversation.memory
+    with trace_span(trace, "memory_assembly"):
+        inputs = {conversation.input_key: user_input}
+        inputs.update(memory.load_memory_variables(inputs))
+        prompt_value = _prepare_inputs(conversation, inputs, context)
+
+    result = StreamResult()
+    started = [time.perf_counter()]
+    if cancel is not None:
+        cancel.check()
+    invoke = lambda: conversation.llm.invoke(prompt_value, **request_options(conversation.llm, cancel))
+    try:
+        if admission is not None:
+            message = admission.call(invoke, trace=trace, cancel=cancel,
+                                     on_start=lambda: started.__setitem__(0, time.perf_counter()))
+        else:
+            message = invoke()
+    except TurnCancelledError:
+        raise
+    except Exception:
+        _check_failure(cancel)
+        raise
+    result.text = message.content
+    result.total_time = time.perf_counter() - started[0]
+    if trace is not None:
+        trace.record("llm", result.total_time)
+
+    if cancel is not None:
+        cancel.check(deadline=False)
+    with trace_span(trace, "memory_update"):
+        memory.save_context({conversation.input_key: user_input}, {conversation.output_key: result.text})
+    return result
+
+
+async def astream_conversation(conversation, result, user_input, trace=None, admission=None, context=None,
+                               cancel=None):
+    """Async generator version of stream_conversation(), yielding each new token.
+
+    The outcome is written to result (a StreamResult). Memory reads and
+    writes run in a worker thread, since updating memory may call the LLM
+    synchronously to summarize old turns. If the consumer stops early the
+    reply is not written to memory. Cancelling the token (from any thread)
+    aborts the request at once, even while waiting for the first token.
+    """
+    memory = conversation.memory
+    with trace_span(trace, "memory_assembly"):
+        inputs = {conversation.input_key: user_input}
+        inputs.update(await asyncio.to_thread(memory.load_memory_variables, inputs))
+        prompt_value = _prepare_inputs(conversation, inputs, context)
+
+    started = [time.perf_counter()]
+    if cancel is not None:
+        cancel.check()
+    make_stream = lambda: conversation.llm.astream(prompt_value, **request_options(conversation.llm, cancel))
+    if admission is not None:
+        chunks = admission.astream(make_stream, trace=trace, cancel=cancel,
+                                   on_start=lambda: started.__setitem__(0, time.perf_counter()))
+    else:
+        chunks = make_stream()
+    chunks = acancellable(chunks, cancel)
+    try:
+        async for chunk in chunks:
+            token = chunk.content
+            if not token:
+                continue
+            if result.time_to_first_token is None:
+                result.time_to_first_token = time.perf_counter() - started[0]
+            result.text += token
+            yield token
+    except TurnCancelledError:
+        raise
+    except Exception as e:
+        _check_failure(cancel)
+        if not result.text:
+            raise
+        result.error = e
+    finally:
+        await chunks.aclose()
+    result.total_time = time.perf_counter() - started[0]
+    if trace is not None:
+        trace.record("llm_first_token", result.time_to_first_token)
+        trace.record("llm", result.total_time)
+
+    if cancel is not None:
+        cancel.check(deadline=False)
+    with trace_span(trace, "memory_update"):
+        await asyncio.to_thread(memory.save_context, {conversation.input_key: user_input},
+                                {conversation.output_key: result.text})
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Windowed transcript rendering for the AI Commerce Chatbot.
+
+Streamlit re-runs the whole script on every interaction, and every element
+it draws is sent to the browser again. Drawing the full transcript would
+make each rerun's render time and websocket payload grow with the
+conversation. chatbot.py instead draws only the last TRANSCRIPT_WINDOW
+messages; older ones stay collapsed behind a "Show earlier messages"
+button that loads TRANSCRIPT_PAGE_SIZE more per click.
+
+Message text is turned into the markdown Streamlit displays once per
+distinct message (keyed by a hash of role and content) and kept in an LRU
+cache, so a rerun does no per-message work for messages it has drawn
+before. Dollar signs are escaped on the way, so prices like "$499 and
+$799" are not typeset as LaTeX math.
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+TRANSCRIPT_WINDOW = 30
+TRANSCRIPT_PAGE_SIZE = 20
+
+_UNESCAPED_DOLLAR = re.compile(r"(?<!\\)\$")
+
+
+def to_markdown(text):
+    """Markdown that displays text literally where Streamlit would typeset math"""
+    return _UNESCAPED_DOLLAR.sub(r"\\$", text)
+
+
+def message_key(message):
+    """Stable hash of a message's role and content"""
+    return hashlib.sha1(f"{message['role']}\x1f{message['content']}".encode("utf-8")).hexdigest()
+
+
+def visible_start(message_count, window=TRANSCRIPT_WINDOW, page_size=TRANSCRIPT_PAGE_SIZE, pages=0):
+    """Index of the first message to draw, with pages of older messages loaded on top of the window"""
+    return max(0, message_count - window - pages * page_size)
+
+
+class MarkdownCache:
+    """Thread-safe LRU of rendered markdown per message hash, with hit/miss counters"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, message):
+        """Markdown for a message, computed once per distinct role and content"""
+        key = message_key(message)
+        with self._lock:
+            markdown = self._entries.get(key)
+            if markdown is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return markdown
+            self.misses += 1
+        markdown = to_markdown(message["content"])
+        with self._lock:
+            self._entries[key] = markdown
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return markdown
+
+    def stats(self):
+        """Return the number of cached messages and hit/miss counts"""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
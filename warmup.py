@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Background warm-up for the AI Commerce Chatbot.
+
+Building the chat engine imports LangChain, the OpenAI client and numpy and
+loads the product catalog, which takes a few seconds in a fresh server
+process. chatbot.py starts that work on a background thread as soon as the
+process runs the script, renders the page shell and welcome message right
+away, and waits for the engine only where it is first needed. The warm-up
+also opens a keep-alive connection to the model endpoint (LLM_PRECONNECT),
+so the first turn does not pay for the TLS handshake either. Once the
+engine is up, the replies to the Quick Actions and the most common first
+questions are generated in the background (see prefetch.py).
+
+Heavy modules are imported inside the functions below, never at the top of
+this module or of chatbot.py; `python -m benchmarks` tracks the import time
+of the chatbot shell so a stray top-level import shows up as a regression.
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+
+class Warmup:
+    """Run factory() on a daemon thread; result() waits for and returns its value"""
+
+    def __init__(self, factory, name="warmup"):
+        self._future = Future()
+        self._thread = threading.Thread(target=self._run, args=(factory,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, factory):
+        try:
+            self._future.set_result(factory())
+        except BaseException as e:
+            self._future.set_exception(e)
+
+    def ready(self):
+        """Whether the value (or error) is available without waiting"""
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """Wait for the value; re-raises the factory's exception"""
+        return self._future.result(timeout)
+
+
+def warm_engine(api_key):
+    """Import and create the chat engine, pre-open its model connection and start prefetching"""
+    from chat_engine import create_engine
+    from llm_client import open_connection
+    from prefetch import start_prefetcher
+
+    engine = create_engine(api_key)
+    if os.getenv("LLM_PRECONNECT", "true").lower() != "false":
+        open_connection(engine.llm)
+    start_prefetcher(engine)
+    return engine